@@ -1,20 +1,64 @@
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, flash
+from flask import (Flask, render_template, request, jsonify, send_file, send_from_directory,
+                   redirect, url_for, flash, stream_with_context)
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-import pandas as pd
+from werkzeug.utils import safe_join
+import io
 import os
+import tempfile
+from contextlib import closing
 from datetime import datetime, timedelta
-from models import db, User, Group, Student, Supervisor, WorkType, Topic, TopicReservation
+from models import (db, User, Group, Student, Supervisor, WorkType, Topic, TopicReservation,
+                    TopicPreference)
 from config import Config
-import random
-import threading
-import time
+from database import init_database
+from migrations import upgrade
+from profiling import QueryProfiler
+from user_cache import UserCache
+from events import EventBroker, RESYNC
+from snapshots import SnapshotCache
+from passwords import PasswordVerifier, VerifierBusy
+from provisioning import provision_students
+from sqlalchemy import select, insert, update, delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from importers import import_students, import_topics, STUDENT_COLUMNS, TOPIC_COLUMNS
+from sync import sync_students, sync_topics
+from spreadsheet import SpreadsheetError, check_format, estimate_rows, read_batches
+from scheduler import ExpiryScheduler
+from distribution import distribute
+from matching import match_preferences
+from exports import (assignments_query, count_rows, iter_csv, write_file, export_filename,
+                     export_folder, remove_expired_files, EXPORT_FORMATS)
+from jobs import JobQueue
+import stats
+from queries import (students_query, topics_query, available_topics_query,
+                     student_filters, topic_filters, paginate, page_args, parse_int,
+                     serialize_page, serialize_student, serialize_topic)
 
 # === Создание приложения ===
 app = Flask(__name__)
 app.config.from_object(Config)
 
 # === Инициализация базы ===
-db.init_app(app)
+init_database(app, db)
+
+# === Профилирование запросов ===
+profiler = QueryProfiler(app, db)
+
+# === Проверка паролей ===
+password_verifier = PasswordVerifier(app)
+
+# === События об изменении статуса тем ===
+event_broker = EventBroker(app)
+
+# === Готовые ответы списка тем и резерваций ===
+snapshot_cache = SnapshotCache(app, events=event_broker)
+
+# === Планировщик снятия просроченных резерваций ===
+expiry_scheduler = ExpiryScheduler(app, events=event_broker)
+
+# === Фоновые задачи ===
+job_queue = JobQueue(app)
 
 # === Настройка Flask-Login ===
 login_manager = LoginManager()
@@ -22,15 +66,21 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 
+user_cache = UserCache(app)
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
 
 # === Функции инициализации ===
 def init_db():
     with app.app_context():
-        db.create_all()
+        upgrade(db.engine, app.config)
+        resumed = job_queue.recover()
+        if resumed:
+            print(f"✅ Возобновлено фоновых задач: {resumed}")
         if not User.query.filter_by(username='admin').first():
             admin = User(username='admin', role='admin')
             admin.set_password('admin')
@@ -77,6 +127,7 @@ def create_test_student():
                 group_id=group.id
             )
             db.session.add(student)
+            stats.apply(db.session.connection(), stats.students_added([group.id]))
             db.session.commit()
             print('✅ Создан тестовый студент: Иванов Иван Иванович')
 
@@ -97,40 +148,15 @@ def create_test_student():
 
 def cleanup_expired_reservations():
     """Очистка просроченных резерваций"""
-    with app.app_context():
-        try:
-            now = datetime.utcnow()
-            expired_reservations = TopicReservation.query.filter(
-                TopicReservation.expires_at < now
-            ).all()
-
-            for reservation in expired_reservations:
-                topic = reservation.topic
-                if topic.status == 'reserved':
-                    topic.status = 'free'
-                    topic.group_id = None
-                    topic.reserved_at = None
-                    topic.reserved_by = None
-
-                db.session.delete(reservation)
-                print(f"✅ Удалена просроченная резервация темы {topic.id}")
-
-            db.session.commit()
-        except Exception as e:
-            print(f"❌ Ошибка при очистке резерваций: {e}")
+    return expiry_scheduler.release_expired()
 
 
 def start_background_cleanup():
-    """Запуск фоновой задачи очистки"""
-
-    def cleanup_loop():
-        while True:
-            cleanup_expired_reservations()
-            time.sleep(60)  # Проверка каждую минуту
-
-    thread = threading.Thread(target=cleanup_loop)
-    thread.daemon = True
-    thread.start()
+    """Запуск фоновой задачи очистки, удаления старых выгрузок и
+    периодической сверки статистики"""
+    expiry_scheduler.start()
+    job_queue.every('cleanup_exports', app.config['EXPORT_CLEANUP_INTERVAL'])
+    job_queue.every('reconcile_stats', app.config['STATS_RECONCILE_INTERVAL'])
 
 
 # === Маршруты аутентификации ===
@@ -146,7 +172,15 @@ def login():
         password = request.form['password']
         user = User.query.filter_by(username=username).first()
 
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and password_verifier.verify(user, password)
+        except VerifierBusy:
+            flash('Слишком много одновременных входов, повторите попытку через несколько секунд')
+            return render_template('login.html'), 503
+
+        if valid:
+            # Хэш мог быть пересчитан под текущие параметры
+            db.session.commit()
             login_user(user)
             if user.role == 'admin':
                 return redirect(url_for('admin_dashboard'))
@@ -177,18 +211,230 @@ def admin_dashboard():
         flash('Доступ запрещен')
         return redirect(url_for('login'))
 
-    groups = Group.query.all()
-    students = Student.query.all()
-    supervisors = Supervisor.query.all()
-    topics = Topic.query.all()
-    work_types = WorkType.query.all()
+    page_size = app.config['ADMIN_PAGE_SIZE']
+    student_args = student_filters(request.args, prefix='students_')
+    topic_args = topic_filters(request.args, prefix='topics_')
+    students = paginate(students_query(**student_args),
+                        parse_int(request.args.get('students_page')) or 1, page_size)
+    topics = paginate(topics_query(**topic_args),
+                      parse_int(request.args.get('topics_page')) or 1, page_size)
 
     return render_template('admin.html',
-                           groups=groups,
+                           groups=Group.query.order_by(Group.name).all(),
+                           supervisors=Supervisor.query.order_by(Supervisor.full_name).all(),
+                           work_types=WorkType.query.all(),
                            students=students,
-                           supervisors=supervisors,
                            topics=topics,
-                           work_types=work_types)
+                           student_args=student_args,
+                           topic_args=topic_args)
+
+
+@app.route('/admin/api/students')
+@login_required
+def admin_students_api():
+    """Страница таблицы студентов с фильтрами по группе, статусу и типу работы"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    page, per_page = page_args(request.args, app.config['ADMIN_PAGE_SIZE'],
+                               app.config['MAX_PAGE_SIZE'])
+    pagination = paginate(students_query(**student_filters(request.args)), page, per_page)
+    return jsonify(serialize_page(pagination, serialize_student))
+
+
+@app.route('/admin/api/topics')
+@login_required
+def admin_topics_api():
+    """Страница таблицы тем с фильтрами по группе, статусу и типу работы"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    page, per_page = page_args(request.args, app.config['ADMIN_PAGE_SIZE'],
+                               app.config['MAX_PAGE_SIZE'])
+    pagination = paginate(topics_query(**topic_filters(request.args)), page, per_page)
+    return jsonify(serialize_page(pagination, serialize_topic))
+
+
+# === Фоновые задачи администратора ===
+@job_queue.register('import_students')
+def import_students_job(job, upload, filename):
+    job.progress(0, estimate_rows(upload, filename))
+    # Чтение закрывается раньше файла, в том числе при отмене задачи
+    with open(upload, 'rb') as stream, closing(
+            read_batches(stream, filename, STUDENT_COLUMNS, app.config['IMPORT_BATCH_SIZE'])) as batches:
+        report = import_students(batches, progress=job.progress)
+    report['success'] = (f"Загружено студентов: {report['inserted']} "
+                         f"({report['rows_per_sec']} строк/с)")
+    return report
+
+
+@job_queue.register('import_topics')
+def import_topics_job(job, upload, filename, dry_run=False):
+    job.progress(0, estimate_rows(upload, filename))
+    # Чтение закрывается раньше файла, в том числе при отмене задачи
+    with open(upload, 'rb') as stream, closing(
+            read_batches(stream, filename, TOPIC_COLUMNS, app.config['IMPORT_BATCH_SIZE'])) as batches:
+        report = import_topics(batches, dry_run=dry_run, progress=job.progress,
+                               duplicate_threshold=app.config['TOPIC_DUPLICATE_THRESHOLD'])
+    if dry_run:
+        report['success'] = (f"Проверка: будет добавлено тем {report['new_topics']}, "
+                             f"руководителей {len(report['new_supervisors'])}, "
+                             f"типов работ {len(report['new_work_types'])}")
+    else:
+        report['success'] = (f"Загружено тем: {report['inserted']} "
+                             f"({report['rows_per_sec']} строк/с)")
+        if report['inserted']:
+            # Новые темы не требуют перезагрузки вкладок, но меняют списки
+            snapshot_cache.bump()
+    return report
+
+
+def sync_message(report, title):
+    if report['applied']:
+        return (f"{title}: добавлено {report['inserted']}, изменено {report['updated']}, "
+                f"удалено {report['deleted']}, без изменений {report['unchanged']}")
+    return (f"Проверка ({title.lower()}): новых {report['new']}, измененных {report['changed']}, "
+            f"без изменений {report['unchanged']}, нет в файле {report['missing']}")
+
+
+@job_queue.register('sync_students')
+def sync_students_job(job, upload, filename, apply=False, delete_missing=False):
+    job.progress(0, estimate_rows(upload, filename))
+    with open(upload, 'rb') as stream, closing(
+            read_batches(stream, filename, STUDENT_COLUMNS, app.config['IMPORT_BATCH_SIZE'])) as batches:
+        report = sync_students(batches, apply=apply, delete_missing=delete_missing,
+                               progress=job.progress)
+    report['success'] = sync_message(report, 'Студенты')
+    return report
+
+
+@job_queue.register('sync_topics')
+def sync_topics_job(job, upload, filename, apply=False, delete_missing=False):
+    job.progress(0, estimate_rows(upload, filename))
+    with open(upload, 'rb') as stream, closing(
+            read_batches(stream, filename, TOPIC_COLUMNS, app.config['IMPORT_BATCH_SIZE'])) as batches:
+        report = sync_topics(batches, apply=apply, delete_missing=delete_missing,
+                             progress=job.progress)
+    report['success'] = sync_message(report, 'Темы')
+    if report['applied'] and report['deleted']:
+        event_broker.publish(RESYNC)
+    elif report['applied'] and report['inserted']:
+        snapshot_cache.bump()
+    return report
+
+
+@job_queue.register('random_distribute')
+def random_distribute_job(job, **params):
+    report = distribute(progress=job.progress, **params)
+    report['success'] = f"Распределено {report['assigned']} тем"
+    if report['assigned']:
+        event_broker.publish(RESYNC)
+    return report
+
+
+@job_queue.register('preference_matching')
+def preference_matching_job(job, **params):
+    report = match_preferences(progress=job.progress, **params)
+    if report['applied']:
+        report['success'] = f"Распределено по пожеланиям {report['assigned']} тем"
+        if report['assigned']:
+            event_broker.publish(RESYNC)
+    else:
+        report['success'] = (f"Можно распределить {report['matched']} из "
+                             f"{report['students']} студентов")
+    return report
+
+
+@job_queue.register('provision_students')
+def provision_students_job(job, group_ids=None):
+    report = provision_students(export_folder(app), app.config, group_ids, progress=job.progress)
+    if report['created']:
+        report['success'] = f"Создано учетных записей: {report['created']}"
+        if report['renamed']:
+            report['success'] += (f". Занятых логинов student<id>: {len(report['renamed'])}, "
+                                  f"вместо них выданы логины с суффиксом (см. файл с паролями)")
+    else:
+        report['success'] = 'Все студенты уже имеют учетные записи'
+    return report
+
+
+@job_queue.register('cleanup_exports', writes=False)
+def cleanup_exports_job(job):
+    removed = remove_expired_files(export_folder(app), app.config['EXPORT_RETENTION'])
+    return {'removed': removed, 'success': f'Удалено устаревших файлов: {removed}'}
+
+
+@job_queue.register('reconcile_stats')
+def reconcile_stats_job(job):
+    report = stats.reconcile()
+    report['success'] = (f"Счетчики исправлены: {report['drifted']}" if report['drifted']
+                         else 'Счетчики совпадают с данными')
+    return report
+
+
+@job_queue.register('export_assignments', writes=False)
+def export_assignments_job(job, export_format, filters):
+    query = assignments_query(**filters)
+    job.progress(0, count_rows(query))
+    filename = export_filename(export_format)
+    path = os.path.join(export_folder(app), filename)
+    try:
+        rows = write_file(query, path, export_format, progress=job.progress)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return {'file': filename, 'rows': rows}
+
+
+def save_upload(file):
+    """Сохраняет загруженный файл до запуска задачи, возвращает путь"""
+    folder = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+    os.makedirs(folder, exist_ok=True)
+    handle, path = tempfile.mkstemp(suffix=os.path.splitext(file.filename)[1].lower(),
+                                    dir=folder)
+    with os.fdopen(handle, 'wb') as stream:
+        file.save(stream)
+    return path
+
+
+def form_flag(name):
+    return request.form.get(name) in ('1', 'true', 'on')
+
+
+def sync_params(file):
+    """Параметры задачи синхронизации: без apply - только предпросмотр разницы"""
+    return {'upload': save_upload(file), 'filename': file.filename,
+            'apply': form_flag('apply'), 'delete_missing': form_flag('delete_missing')}
+
+
+def json_group_ids(value):
+    """Список id групп из JSON; ValueError, если это не список целых чисел"""
+    if not isinstance(value, list):
+        raise ValueError('group_ids должен быть списком id групп')
+    group_ids = [parse_int(group_id) for group_id in value]
+    if None in group_ids:
+        raise ValueError('Неверный id группы')
+    return group_ids
+
+
+def json_optional_int(data, key, default=None):
+    """Необязательное целое из JSON: null - значение не задано, иначе
+    ValueError для строк и чисел, которые нельзя разобрать"""
+    value = data.get(key, default)
+    if value is None:
+        return None
+    number = parse_int(value)
+    if number is None or number < 0:
+        raise ValueError(f'Неверное значение {key}')
+    return number
+
+
+def job_started(job_id):
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id)
+    }), 202
 
 
 @app.route('/admin/upload_students', methods=['POST'])
@@ -203,30 +449,19 @@ def upload_students():
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'Файл не выбран'}), 400
+    try:
+        check_format(file.filename)
+    except SpreadsheetError as e:
+        return jsonify({'error': str(e)}), 400
 
     try:
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file)
+        if form_flag('sync'):
+            job_id = job_queue.submit('sync_students', sync_params(file), user_id=current_user.id)
         else:
-            df = pd.read_excel(file)
-
-        for _, row in df.iterrows():
-            group_name = row['group']
-            group = Group.query.filter_by(name=group_name).first()
-            if not group:
-                group = Group(name=group_name, cmk=row.get('cmk', 'Общая'))
-                db.session.add(group)
-                db.session.commit()
-
-            student = Student(
-                full_name=row['full_name'],
-                phone=row.get('phone', ''),
-                group_id=group.id
-            )
-            db.session.add(student)
-
-        db.session.commit()
-        return jsonify({'success': 'Студенты успешно загружены'})
+            job_id = job_queue.submit('import_students',
+                                      {'upload': save_upload(file), 'filename': file.filename},
+                                      user_id=current_user.id)
+        return job_started(job_id)
 
     except Exception as e:
         return jsonify({'error': f'Ошибка: {str(e)}'}), 500
@@ -244,47 +479,20 @@ def upload_topics():
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'Файл не выбран'}), 400
+    try:
+        check_format(file.filename)
+    except SpreadsheetError as e:
+        return jsonify({'error': str(e)}), 400
 
     try:
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file)
+        if form_flag('sync'):
+            job_id = job_queue.submit('sync_topics', sync_params(file), user_id=current_user.id)
         else:
-            df = pd.read_excel(file)
-
-        for _, row in df.iterrows():
-            supervisor_name = row['supervisor']
-            supervisor = Supervisor.query.filter_by(full_name=supervisor_name).first()
-            if not supervisor:
-                supervisor = Supervisor(
-                    full_name=supervisor_name,
-                    subjects=row.get('subjects', '')
-                )
-                db.session.add(supervisor)
-                db.session.commit()
-
-            work_type_name = row['work_type']
-            work_type_subject = row['subject']
-            work_type = WorkType.query.filter_by(
-                name=work_type_name,
-                subject=work_type_subject
-            ).first()
-            if not work_type:
-                work_type = WorkType(
-                    name=work_type_name,
-                    subject=work_type_subject
-                )
-                db.session.add(work_type)
-                db.session.commit()
-
-            topic = Topic(
-                title=row['title'],
-                supervisor_id=supervisor.id,
-                work_type_id=work_type.id
-            )
-            db.session.add(topic)
-
-        db.session.commit()
-        return jsonify({'success': 'Темы успешно загружены'})
+            job_id = job_queue.submit('import_topics',
+                                      {'upload': save_upload(file), 'filename': file.filename,
+                                       'dry_run': form_flag('dry_run')},
+                                      user_id=current_user.id)
+        return job_started(job_id)
 
     except Exception as e:
         return jsonify({'error': f'Ошибка: {str(e)}'}), 500
@@ -296,97 +504,395 @@ def random_distribute():
     if current_user.role != 'admin':
         return jsonify({'error': 'Доступ запрещен'}), 403
 
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Неверный запрос'}), 400
     try:
-        group_id = request.json.get('group_id')
-        work_type_id = request.json.get('work_type_id')
+        # Все группы распределяются только по явному group_id='all'
+        if data.get('group_ids'):
+            group_ids = json_group_ids(data['group_ids'])
+        elif data.get('group_id') == 'all':
+            group_ids = None
+        elif data.get('group_id') not in (None, ''):
+            group_ids = json_group_ids([data['group_id']])
+        else:
+            return jsonify({'error': 'Выберите группу'}), 400
+
+        work_type_id = parse_int(data.get('work_type_id'))
+        if work_type_id is None:
+            return jsonify({'error': 'Выберите тип работы'}), 400
+
+        params = {
+            'group_ids': group_ids,
+            'work_type_id': work_type_id,
+            'seed': json_optional_int(data, 'seed'),
+            'max_load': json_optional_int(data, 'max_load', app.config['SUPERVISOR_MAX_LOAD']),
+            'allow_partial': bool(data.get('allow_partial'))
+        }
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        students = Student.query.filter_by(group_id=group_id, topic_id=None).all()
-        topics = Topic.query.filter_by(status='free', work_type_id=work_type_id).all()
+    try:
+        return job_started(job_queue.submit('random_distribute', params, user_id=current_user.id))
+    except Exception as e:
+        return jsonify({'error': f'Ошибка: {str(e)}'}), 500
+
+
+@app.route('/admin/preference_matching', methods=['POST'])
+@login_required
+def preference_matching():
+    """Распределение по пожеланиям студентов; без apply только расчет"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
 
-        if len(students) > len(topics):
-            return jsonify({'error': 'Недостаточно свободных тем для всех студентов'})
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Неверный запрос'}), 400
+    try:
+        # Пустой или отсутствующий список - все группы
+        group_ids = json_group_ids(data.get('group_ids') or [])
+        params = {
+            'group_ids': group_ids or None,
+            'seed': json_optional_int(data, 'seed'),
+            'max_load': json_optional_int(data, 'max_load', app.config['SUPERVISOR_MAX_LOAD']),
+            'apply': bool(data.get('apply'))
+        }
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        random.shuffle(students)
-        random.shuffle(topics)
+    try:
+        return job_started(job_queue.submit('preference_matching', params,
+                                            user_id=current_user.id))
+    except Exception as e:
+        return jsonify({'error': f'Ошибка: {str(e)}'}), 500
 
-        for i, student in enumerate(students):
-            if i < len(topics):
-                topics[i].status = 'assigned'
-                topics[i].student_id = student.id
-                topics[i].group_id = group_id
 
-        db.session.commit()
-        return jsonify({'success': f'Распределено {min(len(students), len(topics))} тем'})
+@app.route('/admin/provision_students', methods=['POST'])
+@login_required
+def provision_student_accounts():
+    """Создание учетных записей студентам без пользователя"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    try:
+        data = request.json or {}
+        group_ids = [parse_int(group_id) for group_id in data.get('group_ids') or []]
+        job_id = job_queue.submit('provision_students', {'group_ids': group_ids or None},
+                                  user_id=current_user.id)
+        return job_started(job_id)
 
     except Exception as e:
         return jsonify({'error': f'Ошибка: {str(e)}'}), 500
 
 
+@app.route('/admin/credentials/<filename>')
+@login_required
+def download_credentials(filename):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    if not filename.startswith('credentials_'):
+        return jsonify({'error': 'Файл не найден'}), 404
+
+    # Пароли в открытом виде не храним: файл читается и сразу удаляется
+    path = safe_join(export_folder(app), filename)
+    try:
+        if path is None:
+            raise FileNotFoundError(filename)
+        with open(path, 'rb') as file:
+            data = file.read()
+        os.remove(path)
+    except FileNotFoundError:
+        return jsonify({'error': 'Файл уже скачан или удален'}), 404
+    return send_file(io.BytesIO(data), mimetype='text/csv', as_attachment=True,
+                     download_name=filename)
+
+
+@app.route('/admin/export/assignments')
+@login_required
+def export_assignments():
+    """Выгрузка назначенных тем; большие выгрузки уходят в фоновую задачу"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Неизвестный формат выгрузки'}), 400
+
+    filters = {
+        'group_id': parse_int(request.args.get('group_id')),
+        'supervisor_id': parse_int(request.args.get('supervisor_id')),
+        'work_type_id': parse_int(request.args.get('work_type_id'))
+    }
+    query = assignments_query(**filters)
+    if request.args.get('background') or count_rows(query) > app.config['EXPORT_SYNC_LIMIT']:
+        job_id = job_queue.submit('export_assignments',
+                                  {'export_format': export_format, 'filters': filters},
+                                  user_id=current_user.id)
+        return job_started(job_id)
+
+    filename = export_filename(export_format)
+    if export_format == 'csv':
+        return app.response_class(
+            stream_with_context(iter_csv(query)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    write_file(query, path, export_format)
+    response = send_file(path, as_attachment=True, download_name=filename)
+    response.call_on_close(lambda: os.remove(path))
+    return response
+
+
+@app.route('/admin/export/download/<job_id>')
+@login_required
+def export_download(job_id):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    job = job_queue.get(job_id)
+    if not job or job['kind'] != 'export_assignments' or job['status'] != 'done':
+        return jsonify({'error': 'Выгрузка не найдена или еще не готова'}), 404
+    if not os.path.isfile(os.path.join(export_folder(app), job['result']['file'])):
+        return jsonify({'error': 'Файл выгрузки удален по сроку хранения'}), 404
+    return send_from_directory(export_folder(app), job['result']['file'], as_attachment=True)
+
+
+@app.route('/admin/jobs')
+@login_required
+def job_list():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    return jsonify({'items': job_queue.recent(app.config['JOB_LIST_LIMIT'])})
+
+
+@app.route('/admin/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    """Состояние задачи: обработано строк, процент, оценка оставшегося времени"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    result = job['result'] or {}
+    if job['status'] == 'done' and result.get('file'):
+        if job['kind'] == 'export_assignments':
+            job['download_url'] = url_for('export_download', job_id=job_id)
+        else:
+            job['download_url'] = url_for('download_credentials', filename=result['file'])
+    return jsonify(job)
+
+
+@app.route('/admin/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def job_cancel(job_id):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    accepted = job_queue.cancel(job_id)
+    if accepted is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    if not accepted:
+        return jsonify({'error': 'Задача уже завершена'}), 409
+    return jsonify({'success': 'Задача отменяется'}), 202
+
+
+@app.route('/admin/stats')
+@login_required
+def distribution_stats():
+    """Темы по типам работ и статусам, нагрузка руководителей и охват групп
+    из таблицы сводных счетчиков"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    return jsonify(stats.summary())
+
+
+@app.route('/admin/stats/reconcile', methods=['POST'])
+@login_required
+def reconcile_stats():
+    """Внеочередная сверка счетчиков с данными"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    return job_started(job_queue.submit('reconcile_stats', user_id=current_user.id))
+
+
+@app.route('/admin/reservation_scheduler')
+@login_required
+def reservation_scheduler_stats():
+    """Метрики планировщика: очередь сроков и задержка снятия резерваций"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    return jsonify(expiry_scheduler.stats())
+
+
+@app.route('/admin/snapshot_cache')
+@login_required
+def snapshot_cache_stats():
+    """Версия каталога тем и попадания в кэш готовых ответов"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    return jsonify(snapshot_cache.stats())
+
+
+@app.route('/admin/password_stats')
+@login_required
+def password_stats():
+    """Очередь и время проверки паролей"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    return jsonify(password_verifier.stats())
+
+
+@app.route('/admin/events')
+@login_required
+def event_stats():
+    """Подписчики и число разосланных событий"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    return jsonify(event_broker.stats())
+
+
+@app.route('/admin/user_cache')
+@login_required
+def user_cache_stats():
+    """Попадания в кэш пользователей"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    return jsonify(user_cache.stats())
+
+
+@app.route('/admin/profiler', methods=['GET', 'DELETE'])
+@login_required
+def profiler_stats():
+    """Статистика запросов к базе по маршрутам; DELETE - сбросить"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    if request.method == 'DELETE':
+        profiler.reset()
+        return jsonify({'success': 'Статистика сброшена'})
+    return jsonify(profiler.stats())
+
+
 # === Маршруты старосты ===
 @app.route('/headman')
 @login_required
 def headman_dashboard():
     if current_user.role == 'admin':
         return redirect(url_for('admin_dashboard'))
+    if current_user.role != 'headman':
+        return redirect(url_for('student_dashboard'))
 
     group = current_user.group
-    students = Student.query.filter_by(group_id=group.id).all()
-    topics = Topic.query.all()
+    students = Student.query.options(joinedload(Student.topic)).filter_by(
+        group_id=group.id).order_by(Student.full_name).all()
+    # Список студентов без темы строится один раз на запрос
+    unassigned = [s for s in students if s.topic_id is None]
+    topics = paginate(available_topics_query(group.id), 1, app.config['HEADMAN_PAGE_SIZE'])
 
     return render_template('headman.html',
                            group=group,
                            students=students,
-                           topics=topics)
+                           unassigned=unassigned,
+                           topics=topics,
+                           work_types=WorkType.query.all())
+
+
+@app.route('/headman/api/topics')
+@login_required
+def headman_topics_api():
+    """Страница доступных группе тем с поиском по названию и фильтром по типу работы"""
+    if current_user.role != 'headman':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    page, per_page = page_args(request.args, app.config['HEADMAN_PAGE_SIZE'],
+                               app.config['MAX_PAGE_SIZE'])
+    group_id = current_user.group_id
+    work_type_id = parse_int(request.args.get('work_type_id'))
+    search = (request.args.get('q') or '').strip()
+
+    def build():
+        query = available_topics_query(group_id, work_type_id=work_type_id, search=search)
+        return serialize_page(paginate(query, page, per_page), serialize_topic)
+
+    return snapshot_cache.respond(('topics', group_id, work_type_id, search, page, per_page),
+                                  build)
 
 
 @app.route('/headman/reserve_topic', methods=['POST'])
 @login_required
 def reserve_topic():
-    if current_user.role == 'admin':
+    if current_user.role != 'headman':
         return jsonify({'error': 'Доступ запрещен'}), 403
 
     try:
         topic_id = request.json.get('topic_id')
-
-        topic = Topic.query.get(topic_id)
-        if not topic:
-            return jsonify({'error': 'Тема не найдена'}), 404
-
-        if topic.status != 'free':
-            return jsonify({'error': 'Тема уже занята или зарезервирована'}), 400
-
-        # Проверяем, нет ли активной резервации
-        existing_reservation = TopicReservation.query.filter_by(topic_id=topic_id).first()
-        if existing_reservation:
-            if existing_reservation.expires_at > datetime.utcnow():
-                return jsonify({'error': 'Тема уже зарезервирована другим пользователем'}), 400
-            else:
-                # Удаляем просроченную резервацию
-                db.session.delete(existing_reservation)
+        group_id = current_user.group.id
 
         # Создаем новую резервацию на 30 минут
         reserved_at = datetime.utcnow()
-        expires_at = reserved_at + timedelta(minutes=30)
+        expires_at = reserved_at + timedelta(seconds=app.config['RESERVATION_TIMEOUT'])
+
+        # Атомарно занимаем тему: обновление пройдет только если она свободна
+        # или ее резервация уже истекла (не дожидаясь фоновой очистки).
+        # Прежний статус проверяется отдельно - от него зависят счетчики статистики
+        for previous in ('free', 'reserved'):
+            topic = db.session.execute(
+                update(Topic)
+                .where(Topic.id == topic_id, Topic.status == previous,
+                       Topic.effective_status_is('free'))
+                .values(status='reserved', group_id=group_id,
+                        reserved_at=reserved_at, reserved_by=current_user.id)
+                .returning(Topic.work_type_id, Topic.supervisor_id)
+                .execution_options(synchronize_session=False)
+            ).first()
+            if topic:
+                break
+        if topic is None:
+            db.session.rollback()
+            if not db.session.get(Topic, topic_id):
+                return jsonify({'error': 'Тема не найдена'}), 404
+            return jsonify({'error': 'Тема уже занята или зарезервирована'}), 400
+        stats.apply(db.session.connection(),
+                    stats.topic_moved(*topic, previous, 'reserved'))
 
-        reservation = TopicReservation(
+        # Тема свободна, значит оставшаяся резервация просрочена
+        # (в том числе резервация другого старосты, которую мы перехватили)
+        db.session.execute(
+            delete(TopicReservation).where(TopicReservation.topic_id == topic_id)
+        )
+        db.session.add(TopicReservation(
             topic_id=topic_id,
-            group_id=current_user.group.id,
+            group_id=group_id,
             reserved_by=current_user.id,
             reserved_at=reserved_at,
             expires_at=expires_at
-        )
+        ))
 
-        # Обновляем статус темы
-        topic.status = 'reserved'
-        topic.group_id = current_user.group.id
-        topic.reserved_at = reserved_at
-        topic.reserved_by = current_user.id
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': 'Тема уже зарезервирована другим пользователем'}), 400
 
-        db.session.add(reservation)
-        db.session.commit()
+        expiry_scheduler.schedule(topic_id, expires_at)
+        event_broker.publish('reserved', topic_ids=[topic_id], group_id=group_id,
+                             user_id=current_user.id)
 
         return jsonify({
-            'success': 'Тема зарезервирована на 30 минут',
+            'success': f"Тема зарезервирована на {app.config['RESERVATION_TIMEOUT'] // 60} минут",
             'expires_at': expires_at.isoformat()
         })
 
@@ -394,18 +900,41 @@ def reserve_topic():
         return jsonify({'error': f'Ошибка: {str(e)}'}), 500
 
 
+@app.route('/headman/events')
+@login_required
+def topic_events():
+    """Поток Server-Sent Events об изменении статуса тем"""
+    if current_user.role != 'headman':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    last_event_id = parse_int(request.headers.get('Last-Event-ID'))
+    # Поток живет долго: соединение с базой возвращаем в пул сразу
+    db.session.remove()
+    return app.response_class(
+        event_broker.stream(last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/headman/get_reservations')
 @login_required
 def get_reservations():
     """Получить активные резервации пользователя"""
-    if current_user.role == 'admin':
+    if current_user.role != 'headman':
         return jsonify({'error': 'Доступ запрещен'}), 403
 
-    try:
-        reservations = TopicReservation.query.filter_by(
-            reserved_by=current_user.id
+    user_id = current_user.id
+
+    # Оставшееся время страница считает по expires_at: ответ не зависит
+    # от момента запроса и хранится снимком до изменения каталога
+    def build():
+        reservations = TopicReservation.query.options(
+            joinedload(TopicReservation.topic)
+        ).filter_by(
+            reserved_by=user_id
         ).filter(
-            TopicReservation.expires_at > datetime.utcnow()
+            TopicReservation.is_active
         ).all()
 
         result = []
@@ -415,11 +944,12 @@ def get_reservations():
                 'topic_title': reservation.topic.title[:50] + '...' if len(
                     reservation.topic.title) > 50 else reservation.topic.title,
                 'reserved_at': reservation.reserved_at.isoformat(),
-                'expires_at': reservation.expires_at.isoformat(),
-                'minutes_left': int((reservation.expires_at - datetime.utcnow()).total_seconds() / 60)
+                'expires_at': reservation.expires_at.isoformat()
             })
+        return {'reservations': result}
 
-        return jsonify({'reservations': result})
+    try:
+        return snapshot_cache.respond(('reservations', user_id), build)
 
     except Exception as e:
         return jsonify({'error': f'Ошибка: {str(e)}'}), 500
@@ -429,7 +959,7 @@ def get_reservations():
 @login_required
 def cancel_reservation():
     """Отменить резервацию"""
-    if current_user.role == 'admin':
+    if current_user.role != 'headman':
         return jsonify({'error': 'Доступ запрещен'}), 403
 
     try:
@@ -443,14 +973,21 @@ def cancel_reservation():
         if not reservation:
             return jsonify({'error': 'Резервация не найдена'}), 404
 
-        topic = reservation.topic
-        topic.status = 'free'
-        topic.group_id = None
-        topic.reserved_at = None
-        topic.reserved_by = None
+        # Тема освобождается, только если она все еще зарезервирована этим старостой
+        topic = db.session.execute(
+            update(Topic)
+            .where(Topic.id == topic_id, Topic.status == 'reserved',
+                   Topic.reserved_by == current_user.id)
+            .values(status='free', group_id=None, reserved_at=None, reserved_by=None)
+            .returning(Topic.work_type_id, Topic.supervisor_id)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if topic:
+            stats.apply(db.session.connection(), stats.topic_moved(*topic, 'reserved', 'free'))
 
         db.session.delete(reservation)
         db.session.commit()
+        event_broker.publish('released', topic_ids=[topic_id], user_id=current_user.id)
 
         return jsonify({'success': 'Резервация отменена'})
 
@@ -461,7 +998,7 @@ def cancel_reservation():
 @app.route('/headman/assign_topic', methods=['POST'])
 @login_required
 def assign_topic():
-    if current_user.role == 'admin':
+    if current_user.role != 'headman':
         return jsonify({'error': 'Доступ запрещен'}), 403
 
     try:
@@ -484,7 +1021,7 @@ def assign_topic():
         if not reservation:
             return jsonify({'error': 'Тема не зарезервирована вами'}), 400
 
-        if reservation.expires_at < datetime.utcnow():
+        if not reservation.is_active:
             return jsonify({'error': 'Время резервации истекло'}), 400
 
         if topic.status == 'assigned':
@@ -493,15 +1030,40 @@ def assign_topic():
         if student.topic_id is not None:
             return jsonify({'error': 'Студент уже имеет тему'}), 400
 
-        # Назначаем тему
-        topic.status = 'assigned'
-        topic.student_id = student.id
-        topic.group_id = current_user.group.id
+        # Назначаем тему, только если резервация еще действует на момент записи
+        assigned = db.session.execute(
+            update(Topic)
+            .where(Topic.id == topic_id,
+                   Topic.reserved_by == current_user.id,
+                   Topic.effective_status_is('reserved'))
+            .values(status='assigned', student_id=student.id, group_id=current_user.group.id)
+            .returning(Topic.work_type_id, Topic.supervisor_id)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if assigned is None:
+            db.session.rollback()
+            return jsonify({'error': 'Время резервации истекло'}), 400
+
+        result = db.session.execute(
+            update(Student)
+            .where(Student.id == student.id, Student.topic_id.is_(None))
+            .values(topic_id=topic_id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            return jsonify({'error': 'Студент уже имеет тему'}), 400
+
+        deltas = stats.topic_moved(*assigned, 'reserved', 'assigned')
+        deltas.update(stats.student_assigned(student.group_id))
+        stats.apply(db.session.connection(), deltas)
 
         # Удаляем резервацию
         db.session.delete(reservation)
 
         db.session.commit()
+        event_broker.publish('assigned', topic_ids=[topic_id], group_id=current_user.group_id,
+                             user_id=current_user.id)
         return jsonify({'success': 'Тема успешно назначена'})
 
     except Exception as e:
@@ -535,7 +1097,74 @@ def student_dashboard():
 
     return render_template('student.html',
                            student=student,
-                           topic=topic)
+                           topic=topic,
+                           preferences_limit=app.config['PREFERENCES_LIMIT'])
+
+
+@app.route('/student/api/topics')
+@login_required
+def student_topics_api():
+    """Страница свободных тем с поиском по названию для выбора пожеланий"""
+    if current_user.role != 'student':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    page, per_page = page_args(request.args, app.config['HEADMAN_PAGE_SIZE'],
+                               app.config['MAX_PAGE_SIZE'])
+    search = (request.args.get('q') or '').strip()
+    pagination = paginate(topics_query(status='free', search=search or None), page, per_page)
+    return jsonify(serialize_page(pagination, serialize_topic))
+
+
+@app.route('/student/preferences', methods=['GET', 'POST'])
+@login_required
+def student_preferences():
+    """Список желаемых тем студента в порядке убывания желания"""
+    if current_user.role != 'student' or not current_user.student_id:
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    if request.method == 'GET':
+        preferences = TopicPreference.query.options(
+            joinedload(TopicPreference.topic)
+        ).filter_by(student_id=current_user.student_id).order_by(TopicPreference.rank).all()
+        return jsonify({'preferences': [{
+            'rank': preference.rank,
+            'topic_id': preference.topic_id,
+            'topic_title': preference.topic.title
+        } for preference in preferences]})
+
+    data = request.get_json(silent=True) or {}
+    topic_ids = data.get('topic_ids') if isinstance(data, dict) else None
+    if not isinstance(topic_ids, list):
+        return jsonify({'error': 'Передайте список тем topic_ids'}), 400
+
+    try:
+        topic_ids = [parse_int(topic_id) for topic_id in topic_ids]
+        limit = app.config['PREFERENCES_LIMIT']
+        if len(topic_ids) > limit:
+            return jsonify({'error': f'Можно выбрать не больше {limit} тем'}), 400
+        if None in topic_ids or len(set(topic_ids)) != len(topic_ids):
+            return jsonify({'error': 'Список тем содержит повторы или неверные значения'}), 400
+
+        found = db.session.scalar(
+            select(func.count()).select_from(Topic).where(Topic.id.in_(topic_ids)))
+        if found != len(topic_ids):
+            return jsonify({'error': 'Тема не найдена'}), 404
+
+        db.session.execute(
+            delete(TopicPreference).where(TopicPreference.student_id == current_user.student_id)
+        )
+        if topic_ids:
+            db.session.execute(insert(TopicPreference), [{
+                'student_id': current_user.student_id,
+                'topic_id': topic_id,
+                'rank': rank
+            } for rank, topic_id in enumerate(topic_ids, start=1)])
+        db.session.commit()
+        return jsonify({'success': f'Сохранено пожеланий: {len(topic_ids)}'})
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Ошибка: {str(e)}'}), 500
 
 
 # === Главная страница ===
@@ -0,0 +1,69 @@
+"""Общие функции бенчмарков: временная база и заполнение тестовыми данными"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def create_app(db_path=None):
+    """Импортирует приложение, подключенное к временной SQLite базе.
+    Если задана переменная BENCH_DATABASE_URL, используется эта (пустая) база"""
+    import config
+    uri = os.environ.get('BENCH_DATABASE_URL')
+    if uri is None:
+        if db_path is None:
+            db_path = os.path.join(tempfile.mkdtemp(prefix='thesis_bench_'), 'bench.db')
+        uri = f'sqlite:///{db_path}'
+    config.Config.SQLALCHEMY_DATABASE_URI = uri
+
+    from app import app, init_db
+    init_db()
+    return app
+
+
+def seed_headmen(app, count, password='bench'):
+    """Создает группы и по одному старосте в каждой, возвращает логины"""
+    from models import db, Group, User
+
+    with app.app_context():
+        users = []
+        for i in range(count):
+            group = Group(name=f'BENCH-{i}', cmk='Бенчмарк')
+            db.session.add(group)
+            db.session.flush()
+            user = User(username=f'headman{i}', role='headman', group_id=group.id)
+            user.set_password(password)
+            db.session.add(user)
+            users.append(user.username)
+        db.session.commit()
+    return users
+
+
+def seed_topics(app, count):
+    """Создает руководителя, тип работы и count свободных тем, возвращает их id"""
+    from sqlalchemy import insert, select
+    from models import db, Supervisor, WorkType, Topic
+
+    with app.app_context():
+        supervisor = Supervisor(full_name='Бенчмарк Б.Б.', subjects='')
+        work_type = WorkType(name='курсовая', subject='Бенчмарк')
+        db.session.add_all([supervisor, work_type])
+        db.session.flush()
+        db.session.execute(insert(Topic), [{
+            'title': f'Тема бенчмарка {i}',
+            'status': 'free',
+            'supervisor_id': supervisor.id,
+            'work_type_id': work_type.id
+        } for i in range(count)])
+        db.session.commit()
+        return list(db.session.scalars(
+            select(Topic.id).where(Topic.work_type_id == work_type.id)))
+
+
+def login(app, username, password='bench'):
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302, f'Не удалось войти как {username}'
+    return client
@@ -0,0 +1,78 @@
+"""Повторная загрузка списка студентов: полная загрузка против синхронизации.
+
+Загружает CSV из --students строк (как /admin/upload_students), затем
+изменяет в файле --changed процентов строк поровну: новые студенты,
+другой телефон и удаленные строки. Измененный файл синхронизируется
+(проверка и применение с удалением отсутствующих) и для сравнения
+загружается полностью в пустую базу. Выводит время по фазам.
+
+    python benchmarks/delta_sync.py --students 100000 --changed 1
+"""
+import argparse
+import csv
+import io
+import time
+
+from common import create_app
+
+
+def make_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['full_name', 'group', 'phone', 'cmk'])
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def run(students, changed, groups):
+    app = create_app()
+
+    from sqlalchemy import delete
+    from importers import STUDENT_COLUMNS, import_students
+    from models import db, Group, Student
+    from spreadsheet import read_batches
+    from sync import sync_students
+
+    batch_size = app.config['IMPORT_BATCH_SIZE']
+
+    def batches(data):
+        return read_batches(io.BytesIO(data), 'students.csv', STUDENT_COLUMNS, batch_size)
+
+    rows = [(f'Студент {i}', f'Группа {i % groups}', f'7999{i:07d}', 'Бенчмарк')
+            for i in range(students)]
+    step = max(int(300 / changed), 3)
+    modified = [(name, group, '+70000000000' if i % step == 0 else phone, cmk)
+                for i, (name, group, phone, cmk) in enumerate(rows) if i % step != 1]
+    modified += [(f'Новый студент {i}', f'Группа {i % groups}', '', 'Бенчмарк')
+                 for i in range(len(rows[::step]))]
+    original, updated = make_csv(rows), make_csv(modified)
+
+    with app.app_context():
+        started = time.perf_counter()
+        import_students(batches(original))
+        print(f'Студентов: {students}, групп: {groups}, изменено строк: ~{changed}%')
+        print(f'Полная загрузка исходного файла: {time.perf_counter() - started:.2f} с')
+
+        for apply in (False, True):
+            started = time.perf_counter()
+            report = sync_students(batches(updated), apply=apply, delete_missing=True)
+            print(f"Синхронизация ({'применение' if apply else 'проверка'}): "
+                  f'{time.perf_counter() - started:.2f} с, новых {report["new"]}, '
+                  f'измененных {report["changed"]}, нет в файле {report["missing"]}, '
+                  f'фазы {report["timings"]}')
+
+        db.session.execute(delete(Student))
+        db.session.execute(delete(Group))
+        db.session.commit()
+        started = time.perf_counter()
+        import_students(batches(updated))
+        print(f'Полная загрузка измененного файла: {time.perf_counter() - started:.2f} с')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--changed', type=float, default=1.0, help='процент измененных строк')
+    parser.add_argument('--groups', type=int, default=200)
+    args = parser.parse_args()
+    run(args.students, args.changed, args.groups)
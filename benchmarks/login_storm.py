@@ -0,0 +1,89 @@
+"""Наплыв входов в начале регистрации.
+
+Создает --users пользователей с хэшем по выбранной схеме (по умолчанию -
+PASSWORD_HASH_METHOD из Config) и запускает --concurrency потоков, которые
+входят в систему, пока не выполнят --logins входов. Выводит пропускную
+способность, p50/p99 времени ответа /login и метрики пула проверки паролей.
+
+    python benchmarks/login_storm.py --concurrency 64 --logins 500
+    python benchmarks/login_storm.py --method pbkdf2:sha256:600000
+"""
+import argparse
+import itertools
+import threading
+import time
+from collections import Counter
+
+from common import create_app
+
+
+def run(users, concurrency, logins, method, workers, queue_limit):
+    import config
+    if method:
+        config.Config.PASSWORD_HASH_METHOD = method
+    if workers:
+        config.Config.PASSWORD_WORKERS = workers
+    if queue_limit is not None:
+        config.Config.PASSWORD_QUEUE_LIMIT = queue_limit
+    app = create_app()
+
+    from sqlalchemy import insert
+    from app import password_verifier
+    from models import db, User
+    from passwords import hash_password
+
+    with app.app_context():
+        # Один хэш на всех: заполнение не должно занимать время бенчмарка
+        password_hash = hash_password('storm', password_verifier.method)
+        db.session.execute(insert(User), [
+            {'username': f'storm{i}', 'password_hash': password_hash, 'role': 'headman'}
+            for i in range(users)])
+        db.session.commit()
+
+    counter = itertools.count()
+    statuses = Counter()
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency)
+
+    def worker():
+        client = app.test_client()
+        barrier.wait()
+        while (number := next(counter)) < logins:
+            started = time.perf_counter()
+            response = client.post('/login', data={'username': f'storm{number % users}',
+                                                   'password': 'storm'})
+            elapsed = time.perf_counter() - started
+            client.get('/logout')
+            with lock:
+                statuses[response.status_code] += 1
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f'Схема: {password_verifier.method}, потоков проверки: {password_verifier.workers}, '
+          f'очередь: {password_verifier.queue_limit}')
+    print(f'Клиентов: {concurrency}, входов: {logins}, ответы: {dict(statuses)}')
+    print(f'Время: {elapsed:.2f} с, {logins / elapsed:.1f} входов/с')
+    print(f'Ответ /login: p50 {latencies[len(latencies) // 2] * 1000:.0f} мс, '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.0f} мс')
+    print(f'Пул: {password_verifier.stats()}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--logins', type=int, default=300)
+    parser.add_argument('--method', help='схема хэша, например scrypt:16384:8:1')
+    parser.add_argument('--workers', type=int, help='потоков проверки паролей')
+    parser.add_argument('--queue-limit', type=int)
+    args = parser.parse_args()
+    run(args.users, args.concurrency, args.logins, args.method, args.workers, args.queue_limit)
@@ -0,0 +1,74 @@
+"""Производительность распределения по пожеланиям.
+
+Синтетические данные: студенты, темы и руководители, у каждого студента
+список из нескольких тем, популярность тем неравномерная (часть тем
+выбирают намного чаще). Замеряются время и пиковая память решателя.
+
+    python benchmarks/preference_matching.py --students 10000 --topics 15000 --prefs 10
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+import common  # noqa: F401  (добавляет корень проекта в sys.path)
+from matching import stable_match
+
+
+def generate(students, topics, supervisors, prefs, seed):
+    rng = np.random.default_rng(seed)
+    topic_supervisors = dict(enumerate(rng.integers(supervisors, size=topics).tolist()))
+    # Распределение Парето (с ограничением сверху): небольшая часть тем очень популярна
+    weights = np.cumsum(np.minimum(rng.pareto(1.2, size=topics) + 1, 50.0))
+    # С запасом, чтобы после удаления повторов осталось prefs разных тем
+    draws = np.searchsorted(weights, rng.random((students, prefs * 3)) * weights[-1])
+    preferences = {}
+    for student_id, row in enumerate(draws.tolist()):
+        chosen = list(dict.fromkeys(row))[:prefs]
+        while len(chosen) < prefs:
+            topic_id = int(rng.integers(topics))
+            if topic_id not in chosen:
+                chosen.append(topic_id)
+        preferences[student_id] = chosen
+    return preferences, topic_supervisors
+
+
+def run(students, topics, supervisors, prefs, max_load, seed):
+    preferences, topic_supervisors = generate(students, topics, supervisors, prefs, seed)
+    capacities = {}
+    if max_load is not None:
+        capacities = dict.fromkeys(range(supervisors), max_load)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    matching = stable_match(preferences, topic_supervisors, capacities, seed)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    taken = list(matching.values())
+    assert len(taken) == len(set(taken)), 'Одна тема назначена двум студентам'
+    if max_load is not None:
+        loads = {}
+        for topic_id in taken:
+            loads[topic_supervisors[topic_id]] = loads.get(topic_supervisors[topic_id], 0) + 1
+        assert max(loads.values(), default=0) <= max_load, 'Превышен лимит руководителя'
+
+    ranks = [preferences[s].index(t) + 1 for s, t in matching.items()]
+    print(f'Студентов: {students}, тем: {topics}, руководителей: {supervisors}, пожеланий: {prefs}')
+    print(f'Распределено: {len(matching)} ({len(matching) / students:.1%}), '
+          f'первый выбор: {ranks.count(1)}, средний ранг: {sum(ranks) / max(len(ranks), 1):.2f}')
+    print(f'Время: {elapsed:.3f} с, пиковая память решателя: {peak / 2 ** 20:.1f} МБ')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--topics', type=int, default=15000)
+    parser.add_argument('--supervisors', type=int, default=300)
+    parser.add_argument('--prefs', type=int, default=10)
+    parser.add_argument('--max-load', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    run(args.students, args.topics, args.supervisors, args.prefs, args.max_load, args.seed)
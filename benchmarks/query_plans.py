@@ -0,0 +1,142 @@
+"""Проверка планов запросов горячих маршрутов.
+
+Скрипт заполняет временную SQLite базу, вызывает маршруты старосты,
+администратора и студента, а также снятие просроченных резерваций,
+перехватывает все выполненные SELECT/UPDATE/DELETE и для каждого строит
+EXPLAIN QUERY PLAN. Полный просмотр больших таблиц считается ошибкой,
+в том числе по псевдониму из join и полный просмотр индекса (SCAN ...
+USING [COVERING] INDEX), если индекс не внесен в ALLOWED_INDEX_SCANS.
+
+    python benchmarks/query_plans.py --verbose
+"""
+import argparse
+import re
+from datetime import datetime, timedelta
+
+from common import create_app, seed_headmen, seed_topics, login
+
+# Таблицы, которые растут вместе с числом студентов и тем
+HOT_TABLES = ('topic', 'student', 'topic_reservation', 'topic_preference', 'user')
+# SCAN таблица [AS псевдоним] [USING [COVERING] INDEX имя]; у псевдонимов
+# SQLAlchemy (topic_1, student_2) суффикс номера отбрасывается
+SCAN = re.compile(r'^SCAN (\w+?)(?:_\d+)?(?: AS \w+)?(?: USING (COVERING )?INDEX (\w+))?$')
+# Полные просмотры индекса, которые допустимы: (таблица, индекс)
+ALLOWED_INDEX_SCANS = set()
+
+
+def hot_scan(line):
+    """Строка плана с полным просмотром большой таблицы или ее индекса"""
+    match = SCAN.match(line)
+    if not match or match.group(1) not in HOT_TABLES:
+        return False
+    table, index = match.group(1), match.group(3)
+    return index is None or (table, index) not in ALLOWED_INDEX_SCANS
+
+
+def seed(app):
+    from sqlalchemy import insert, select
+    from models import db, Group, Student, Topic, User, WorkType
+
+    headmen = seed_headmen(app, 20)
+    topic_ids = seed_topics(app, 2000)
+    with app.app_context():
+        group_ids = db.session.scalars(select(Group.id)).all()
+        db.session.execute(insert(Student), [
+            {'full_name': f'Студент {group_id}-{i}', 'group_id': group_id}
+            for group_id in group_ids for i in range(50)])
+        student = db.session.scalars(select(Student).where(Student.group_id == group_ids[0])).first()
+        user = User(username='bench_student', role='student', group_id=student.group_id,
+                    student_id=student.id)
+        user.set_password('bench')
+        db.session.add(user)
+        work_type_id = db.session.scalar(select(WorkType.id))
+        db.session.commit()
+        # Для просмотра назначенных тем в выгрузке
+        student_ids = db.session.scalars(select(Student.id).limit(100)).all()
+        for topic_id, student_id in zip(topic_ids[-100:], student_ids):
+            db.session.execute(
+                Topic.__table__.update().where(Topic.id == topic_id)
+                .values(status='assigned', student_id=student_id, group_id=group_ids[0]))
+        db.session.commit()
+    return headmen, topic_ids, work_type_id, group_ids[0]
+
+
+def exercise(app, headmen, topic_ids, work_type_id, group_id):
+    """Вызывает горячие маршруты"""
+    from app import expiry_scheduler
+    from models import db, Student
+
+    admin = login(app, 'admin', 'admin')
+    admin.get(f'/admin?students_group_id={group_id}&topics_status=free')
+    admin.get(f'/admin/api/students?group_id={group_id}&status=unassigned')
+    admin.get(f'/admin/api/topics?status=reserved&work_type_id={work_type_id}')
+    admin.get(f'/admin/api/topics?group_id={group_id}')
+    admin.get(f'/admin/export/assignments?format=csv&group_id={group_id}').get_data()
+
+    headman = login(app, headmen[0])
+    headman.get('/headman')
+    headman.get(f'/headman/api/topics?work_type_id={work_type_id}&q=тема')
+    with app.app_context():
+        student_id = db.session.query(Student.id).filter(
+            Student.group_id == group_id, Student.topic_id.is_(None)).first()[0]
+    headman.post('/headman/reserve_topic', json={'topic_id': topic_ids[0]})
+    headman.post('/headman/reserve_topic', json={'topic_id': topic_ids[1]})
+    headman.get('/headman/get_reservations')
+    headman.post('/headman/cancel_reservation', json={'topic_id': topic_ids[1]})
+    headman.post('/headman/assign_topic', json={'topic_id': topic_ids[0], 'student_id': student_id})
+    # Эта резервация остается и снимается как просроченная
+    headman.post('/headman/reserve_topic', json={'topic_id': topic_ids[5]})
+
+    student = login(app, 'bench_student')
+    student.get('/student')
+    student.post('/student/preferences', json={'topic_ids': topic_ids[2:5]})
+    student.get('/student/preferences')
+
+    expiry_scheduler.release_expired(datetime.utcnow() + timedelta(days=1))
+
+
+def check(verbose=False):
+    from sqlalchemy import event
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            print('Проверка планов поддерживает только SQLite')
+            return 1
+    data = seed(app)
+
+    statements = {}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            statements.setdefault(statement, parameters)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', capture)
+    exercise(app, *data)
+    event.remove(engine, 'before_cursor_execute', capture)
+
+    failures = 0
+    with engine.connect() as connection:
+        for statement, parameters in statements.items():
+            plan = [row[3] for row in connection.exec_driver_sql(
+                f'EXPLAIN QUERY PLAN {statement}', parameters)]
+            scans = [line for line in plan if hot_scan(line)]
+            if scans:
+                failures += 1
+            if scans or verbose:
+                print(('❌ ' if scans else '✅ ') + ' '.join(statement.split())[:200])
+                for line in plan:
+                    print(f'      {line}')
+
+    print(f'Запросов: {len(statements)}, с полным просмотром больших таблиц: {failures}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--verbose', action='store_true', help='показать планы всех запросов')
+    args = parser.parse_args()
+    raise SystemExit(check(args.verbose))
@@ -0,0 +1,402 @@
+"""День регистрации: нагрузка старост, студентов и администраторов.
+
+Заполняет временную базу синтетическим факультетом (группы, студенты,
+руководители, типы работ, темы) и запускает через тестовый клиент Flask
+параллельных пользователей с типичными сценариями:
+
+- староста открывает панель, листает список тем (с If-None-Match, как
+  браузер), резервирует свободную тему и назначает ее студенту своей
+  группы или отменяет резервацию, проверяет свои резервации;
+- студент входит, открывает свою страницу и сохраняет пожелания;
+- администратор открывает панель, статистику и таблицы студентов и тем.
+
+Вход через /login замеряется как отдельный маршрут, сценарий каждого
+пользователя длится --duration секунд после его входа. Для каждого маршрута
+выводятся пропускная способность, p50/p95/p99 времени ответа, коды ответов
+и число SQL-запросов (заголовок X-DB-Queries), после прогона проверяются
+инварианты: тема не назначена дважды, тема и студент ссылаются друг на
+друга, у темы не больше одной резервации, счетчики статистики совпадают с
+данными, нет ответов 5xx, каждый пользователь вошел и сделал хотя бы один
+запрос. --json сохраняет результат для сравнения прогонов, --compare
+выводит разницу с сохраненным.
+
+    python benchmarks/registration_day.py --groups 20 --topics 1000 --duration 30
+    python benchmarks/registration_day.py --json after.json --compare before.json
+"""
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from common import create_app
+
+PASSWORD = 'bench'
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Recorder:
+    """Время ответа, коды и число SQL-запросов по маршрутам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = defaultdict(list)
+        self._statuses = defaultdict(lambda: defaultdict(int))
+        self._queries = defaultdict(list)
+        self._actor = threading.local()
+
+    def login(self, app, username):
+        """Вход через /login с замером времени; вход не считается запросом сценария"""
+        client = app.test_client()
+        response = self._send(client, 'POST', '/login', '/login',
+                              data={'username': username, 'password': PASSWORD})
+        if response.status_code != 302:
+            raise RuntimeError(f'Не удалось войти как {username}: {response.status_code}')
+        self._actor.requests = 0
+        return client
+
+    def actor_requests(self):
+        """Запросы сценария текущего потока после входа"""
+        return getattr(self._actor, 'requests', 0)
+
+    def request(self, client, method, label, url, **kwargs):
+        self._actor.requests = self.actor_requests() + 1
+        return self._send(client, method, label, url, **kwargs)
+
+    def _send(self, client, method, label, url, **kwargs):
+        started = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        route = f'{method} {label}'
+        queries = response.headers.get('X-DB-Queries')
+        with self._lock:
+            self._timings[route].append(elapsed)
+            self._statuses[route][response.status_code] += 1
+            if queries is not None:
+                self._queries[route].append(int(queries))
+        return response
+
+    def routes(self, duration):
+        result = {}
+        with self._lock:
+            for route, timings in sorted(self._timings.items()):
+                queries = self._queries[route]
+                result[route] = {
+                    'count': len(timings),
+                    'rps': round(len(timings) / duration, 1),
+                    'statuses': {str(code): count
+                                 for code, count in sorted(self._statuses[route].items())},
+                    'mean_ms': round(sum(timings) / len(timings) * 1000, 2),
+                    'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+                    'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+                    'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+                    'sql_avg': round(sum(queries) / len(queries), 1) if queries else None,
+                    'sql_max': max(queries) if queries else None
+                }
+        return result
+
+
+class ConditionalClient:
+    """Повторные GET с If-None-Match: 304 отдает сохраненный ответ, как браузер"""
+
+    def __init__(self, client, recorder):
+        self.client = client
+        self.recorder = recorder
+        self._cache = {}  # url -> (ETag, данные)
+
+    def get_json(self, label, url):
+        cached = self._cache.get(url)
+        headers = {'Accept-Encoding': 'gzip'}
+        if cached:
+            headers['If-None-Match'] = cached[0]
+        response = self.recorder.request(self.client, 'GET', label, url, headers=headers)
+        if response.status_code == 304:
+            return cached[1]
+        if response.status_code != 200:
+            return None
+        body = response.data
+        if response.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        data = json.loads(body)
+        if response.headers.get('ETag'):
+            self._cache[url] = (response.headers['ETag'], data)
+        return data
+
+
+def seed_faculty(app, groups, students_per_group, supervisors, work_types, topics,
+                 student_users, hash_method, rng):
+    """Создает факультет одной транзакцией; возвращает логины и студентов по группам"""
+    from sqlalchemy import insert, select
+    from models import db, Group, Student, Supervisor, Topic, User, WorkType
+    from passwords import hash_password
+    import stats
+
+    with app.app_context():
+        password_hash = hash_password(PASSWORD, hash_method)
+        db.session.execute(insert(Group), [{'name': f'ГР-{i:03d}', 'cmk': f'ЦМК {i % 5}'}
+                                           for i in range(groups)])
+        group_ids = list(db.session.scalars(select(Group.id).order_by(Group.id)))
+        db.session.execute(insert(Student), [
+            {'full_name': f'Студент {group_id}-{i}', 'phone': f'+7999{group_id:03d}{i:04d}',
+             'group_id': group_id}
+            for group_id in group_ids for i in range(students_per_group)])
+        db.session.execute(insert(Supervisor), [
+            {'full_name': f'Руководитель {i}', 'subjects': ''} for i in range(supervisors)])
+        supervisor_ids = list(db.session.scalars(select(Supervisor.id)))
+        db.session.execute(insert(WorkType), [
+            {'name': 'курсовая' if i % 2 else 'дипломная', 'subject': f'Предмет {i}'}
+            for i in range(work_types)])
+        work_type_ids = list(db.session.scalars(select(WorkType.id)))
+        db.session.execute(insert(Topic), [
+            {'title': f'Тема {i}: разработка системы {rng.randint(1, 10 ** 6)}', 'status': 'free',
+             'supervisor_id': supervisor_ids[i % len(supervisor_ids)],
+             'work_type_id': work_type_ids[i % len(work_type_ids)]}
+            for i in range(topics)])
+
+        students = defaultdict(list)
+        for student_id, group_id in db.session.execute(
+                select(Student.id, Student.group_id).order_by(Student.id)):
+            students[group_id].append(student_id)
+        headmen = {f'headman{group_id}': group_id for group_id in group_ids}
+        db.session.execute(insert(User), [
+            {'username': username, 'password_hash': password_hash, 'role': 'headman',
+             'group_id': group_id} for username, group_id in headmen.items()])
+        # Учетные записи у части студентов: они заходят выбирать пожелания
+        chosen = rng.sample([student_id for ids in students.values() for student_id in ids],
+                            min(student_users, sum(len(ids) for ids in students.values())))
+        db.session.execute(insert(User), [
+            {'username': f'student{student_id}', 'password_hash': password_hash,
+             'role': 'student', 'student_id': student_id} for student_id in chosen])
+        db.session.execute(insert(User), [
+            {'username': 'admin_bench', 'password_hash': password_hash, 'role': 'admin'}])
+        stats.recompute(db.session.connection())
+        db.session.commit()
+    return headmen, students, [f'student{student_id}' for student_id in chosen]
+
+
+def headman_script(app, recorder, username, unassigned, duration, rng, think, results):
+    client = recorder.login(app, username)
+    deadline = time.monotonic() + duration
+    conditional = ConditionalClient(client, recorder)
+    recorder.request(client, 'GET', '/headman', '/headman')
+    page = 1
+    while unassigned and time.monotonic() < deadline:
+        data = conditional.get_json('/headman/api/topics', f'/headman/api/topics?page={page}')
+        if data is None:
+            break
+        free = [topic['id'] for topic in data['items'] if topic['status'] == 'free']
+        if not free:
+            if page >= (data['pages'] or 1):
+                break
+            page += 1
+            continue
+        topic_id = rng.choice(free)
+        response = recorder.request(client, 'POST', '/headman/reserve_topic',
+                                    '/headman/reserve_topic', json={'topic_id': topic_id})
+        if response.status_code == 200:
+            conditional.get_json('/headman/get_reservations', '/headman/get_reservations')
+            if rng.random() < 0.8:
+                student_id = unassigned[-1]
+                response = recorder.request(client, 'POST', '/headman/assign_topic',
+                                            '/headman/assign_topic',
+                                            json={'topic_id': topic_id, 'student_id': student_id})
+                if response.status_code == 200:
+                    unassigned.pop()
+                    results['assigned'].append((topic_id, student_id))
+            else:
+                recorder.request(client, 'POST', '/headman/cancel_reservation',
+                                 '/headman/cancel_reservation', json={'topic_id': topic_id})
+        time.sleep(rng.uniform(0, think))
+
+
+def student_script(app, recorder, username, topics, duration, rng, think, limit):
+    client = recorder.login(app, username)
+    deadline = time.monotonic() + duration
+    recorder.request(client, 'GET', '/student', '/student')
+    recorder.request(client, 'GET', '/student/preferences', '/student/preferences')
+    recorder.request(client, 'POST', '/student/preferences', '/student/preferences',
+                     json={'topic_ids': rng.sample(range(1, topics + 1), min(limit, topics))})
+    while time.monotonic() < deadline:
+        time.sleep(rng.uniform(think * 4, think * 20))
+        recorder.request(client, 'GET', '/student', '/student')
+
+
+def admin_script(app, recorder, duration, rng, think, topic_pages, student_pages):
+    client = recorder.login(app, 'admin_bench')
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        recorder.request(client, 'GET', '/admin', '/admin')
+        recorder.request(client, 'GET', '/admin/stats', '/admin/stats')
+        recorder.request(client, 'GET', '/admin/api/topics',
+                         f'/admin/api/topics?status=assigned&page={rng.randint(1, topic_pages)}')
+        recorder.request(client, 'GET', '/admin/api/students',
+                         f'/admin/api/students?page={rng.randint(1, student_pages)}')
+        time.sleep(rng.uniform(think * 4, think * 20))
+
+
+def check_invariants(app, assigned_responses, server_errors, failed_actors):
+    from sqlalchemy import func, select
+    from models import db, Student, Topic, TopicReservation
+    import stats
+
+    with app.app_context():
+        topics_per_student = select(Topic.student_id).where(Topic.student_id.isnot(None)) \
+            .group_by(Topic.student_id).having(func.count() > 1).subquery()
+        reservations_per_topic = select(TopicReservation.topic_id) \
+            .group_by(TopicReservation.topic_id).having(func.count() > 1).subquery()
+        assigned = db.session.scalar(
+            select(func.count()).select_from(Topic).where(Topic.status == 'assigned'))
+        return {
+            'students_with_several_topics': db.session.scalar(
+                select(func.count()).select_from(topics_per_student)),
+            'topic_student_mismatch': db.session.scalar(
+                select(func.count()).select_from(Topic)
+                .outerjoin(Student, Student.id == Topic.student_id)
+                .where(Topic.status == 'assigned',
+                       (Student.id.is_(None)) | (Student.topic_id != Topic.id))),
+            'topics_with_several_reservations': db.session.scalar(
+                select(func.count()).select_from(reservations_per_topic)),
+            'assigned_without_response': assigned - assigned_responses,
+            'stats_drift': stats.reconcile()['drifted'],
+            'server_errors': server_errors,
+            'failed_actors': failed_actors
+        }
+
+
+def compare(result, previous_path):
+    with open(previous_path, encoding='utf-8') as file:
+        previous = json.load(file)
+    print(f'\nСравнение с {previous_path} ({previous.get("started_at")}):')
+    print(f"{'маршрут':34} {'запросов/с':>18} {'p95, мс':>20}")
+    for route, current in result['routes'].items():
+        before = previous['routes'].get(route)
+        if before is None:
+            print(f'{route:34} {"нет в прошлом прогоне":>18}')
+            continue
+        change = (current['p95_ms'] / before['p95_ms'] - 1) * 100 if before['p95_ms'] else 0.0
+        print(f"{route:34} {before['rps']:>8} -> {current['rps']:<8} "
+              f"{before['p95_ms']:>8} -> {current['p95_ms']:<8} ({change:+.0f}%)")
+
+
+def run(args):
+    import config
+    config.Config.PROFILER_SAMPLE_RATE = 1.0
+    config.Config.PROFILER_HEADERS = True
+    config.Config.SLOW_QUERY_THRESHOLD_MS = args.slow_query_ms
+    app = create_app()
+    rng = random.Random(args.seed)
+
+    hash_method = args.hash_method or app.config['PASSWORD_HASH_METHOD']
+    started = time.perf_counter()
+    headmen, students, student_users = seed_faculty(
+        app, args.groups, args.students, args.supervisors, args.work_types, args.topics,
+        args.student_users, hash_method, rng)
+    seed_time = time.perf_counter() - started
+    print(f'Факультет: групп {args.groups}, студентов {args.groups * args.students}, '
+          f'руководителей {args.supervisors}, тем {args.topics}; заполнение {seed_time:.1f} с')
+    print(f'Пользователей: старост {len(headmen)}, студентов {len(student_users)}, '
+          f'администраторов {args.admins}; сценарий {args.duration} с после входа')
+
+    recorder = Recorder()
+    results = {'assigned': []}
+    failures = []
+    page_size = app.config['ADMIN_PAGE_SIZE']
+    scripts = [
+        (headman_script, (app, recorder, username, list(students[group_id]), args.duration,
+                          random.Random(args.seed + index), args.think, results))
+        for index, (username, group_id) in enumerate(headmen.items())]
+    scripts += [
+        (student_script, (app, recorder, username, args.topics, args.duration,
+                          random.Random(args.seed + 10000 + index), args.think,
+                          app.config['PREFERENCES_LIMIT']))
+        for index, username in enumerate(student_users)]
+    scripts += [
+        (admin_script, (app, recorder, args.duration, random.Random(args.seed + 20000 + index),
+                        args.think, max(args.topics // page_size, 1),
+                        max(args.groups * args.students // page_size, 1)))
+        for index in range(args.admins)]
+
+    def worker(script, script_args):
+        try:
+            script(*script_args)
+        except Exception as e:
+            failures.append(f'{script.__name__}: {e!r}')
+            return
+        if not recorder.actor_requests():
+            failures.append(f'{script.__name__}: нет запросов после входа')
+
+    threads = [threading.Thread(target=worker, args=script) for script in scripts]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    routes = recorder.routes(elapsed)
+    server_errors = sum(count for route in routes.values()
+                        for code, count in route['statuses'].items() if code.startswith('5'))
+    invariants = check_invariants(app, len(results['assigned']), server_errors, len(failures))
+    result = {
+        'benchmark': 'registration_day',
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'params': vars(args),
+        'elapsed': round(elapsed, 2),
+        'requests': sum(route['count'] for route in routes.values()),
+        'assigned': len(results['assigned']),
+        'routes': routes,
+        'invariants': invariants,
+        'failures': failures[:20],
+        'ok': not any(invariants.values())
+    }
+
+    print(f"\nВремя: {elapsed:.1f} с, запросов: {result['requests']} "
+          f"({result['requests'] / elapsed:.0f}/с), назначено тем: {result['assigned']}")
+    print(f"{'маршрут':34} {'число':>6} {'в сек':>7} {'p50':>7} {'p95':>7} {'p99':>7} "
+          f"{'SQL':>5}  коды")
+    for route, data in routes.items():
+        sql = data['sql_avg'] if data['sql_avg'] is not None else '-'
+        print(f"{route:34} {data['count']:>6} {data['rps']:>7} {data['p50_ms']:>7} "
+              f"{data['p95_ms']:>7} {data['p99_ms']:>7} {sql:>5}  {data['statuses']}")
+    for failure in failures[:5]:
+        print(f'❌ {failure}')
+    for name, value in invariants.items():
+        print(f"{'✅' if not value else '❌'} {name}: {value}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+        print(f'Результат сохранен: {args.json}')
+    if args.compare:
+        compare(result, args.compare)
+    return 0 if result['ok'] else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--groups', type=int, default=20, help='групп (по старосте в каждой)')
+    parser.add_argument('--students', type=int, default=25, help='студентов в группе')
+    parser.add_argument('--supervisors', type=int, default=40)
+    parser.add_argument('--work-types', type=int, default=4)
+    parser.add_argument('--topics', type=int, default=1000)
+    parser.add_argument('--student-users', type=int, default=50,
+                        help='студентов с учетной записью, заходящих в систему')
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=30.0, help='длительность сценария каждого пользователя после входа, с')
+    parser.add_argument('--think', type=float, default=0.05,
+                        help='наибольшая пауза старосты между действиями, с; '
+                             'студенты и администраторы заходят реже')
+    parser.add_argument('--hash-method', help='схема хэша паролей; по умолчанию из Config')
+    parser.add_argument('--slow-query-ms', type=float, default=1000,
+                        help='порог журнала медленных запросов')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='файл для результата в JSON')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    raise SystemExit(run(parser.parse_args()))
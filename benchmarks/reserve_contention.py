@@ -0,0 +1,80 @@
+"""Конкурентное резервирование тем.
+
+N потоков-старост одновременно пытаются зарезервировать одни и те же темы.
+Проверяется, что каждую тему получил ровно один староста, и считается
+пропускная способность /headman/reserve_topic.
+
+    python benchmarks/reserve_contention.py --threads 16 --topics 200
+"""
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+
+from common import create_app, seed_headmen, seed_topics, login
+
+
+def run(threads, topics, rounds):
+    app = create_app()
+    usernames = seed_headmen(app, threads)
+    topic_ids = seed_topics(app, topics)
+    clients = [login(app, username) for username in usernames]
+
+    wins = Counter()
+    statuses = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(client):
+        # Каждый поток проходит все темы в своем порядке
+        order = topic_ids * rounds
+        random.shuffle(order)
+        barrier.wait()
+        for topic_id in order:
+            response = client.post('/headman/reserve_topic', json={'topic_id': topic_id})
+            with lock:
+                statuses[response.status_code] += 1
+                if response.status_code == 200:
+                    wins[topic_id] += 1
+
+    workers = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    from sqlalchemy import func, select
+    from models import db, Topic, TopicReservation
+
+    with app.app_context():
+        reservations = dict(db.session.execute(
+            select(TopicReservation.topic_id, func.count())
+            .group_by(TopicReservation.topic_id)).all())
+        reserved = db.session.scalar(
+            select(func.count()).select_from(Topic).where(Topic.status == 'reserved'))
+
+    requests_total = sum(statuses.values())
+    double = [topic_id for topic_id, count in wins.items() if count > 1]
+    double += [topic_id for topic_id, count in reservations.items() if count > 1]
+
+    print(f'Потоков: {threads}, тем: {topics}, запросов: {requests_total}')
+    print(f'Ответы: {dict(statuses)}')
+    print(f'Успешных резерваций: {sum(wins.values())}, тем в статусе reserved: {reserved}')
+    print(f'Время: {elapsed:.2f} с, {requests_total / elapsed:.0f} запросов/с')
+    if double or sum(wins.values()) != reserved:
+        print(f'❌ Двойные резервации: {sorted(set(double))}')
+        return 1
+    print('✅ Двойных резерваций нет')
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--topics', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=1)
+    args = parser.parse_args()
+    raise SystemExit(run(args.threads, args.topics, args.rounds))
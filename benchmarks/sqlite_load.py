@@ -0,0 +1,176 @@
+"""Нагрузочный тест резервирования и назначения тем на SQLite.
+
+Потоки-старосты в цикле резервируют случайную свободную тему, назначают ее
+студенту своей группы и читают список тем, а отдельный поток непрерывно
+снимает просроченные резервации, как фоновая очистка. Сравниваются два
+профиля: baseline - настройки SQLite по умолчанию (журнал отката,
+synchronous=FULL, пул 5+10), и tuned - настройки из Config (WAL и т.д.).
+Каждый профиль запускается в отдельном процессе на новой базе.
+
+    python benchmarks/sqlite_load.py --threads 16 --duration 10
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from common import create_app, seed_headmen, seed_topics, login
+
+PROFILES = ('baseline', 'tuned')
+
+
+def configure(profile):
+    import config
+    if profile == 'baseline':
+        config.Config.SQLITE_PRAGMAS = {'journal_mode': 'DELETE'}
+        config.Config.DB_POOL_SIZE = 5
+        config.Config.DB_MAX_OVERFLOW = 10
+    # Резервации быстро истекают, чтобы очистка постоянно писала в базу
+    config.Config.RESERVATION_TIMEOUT = 2
+
+
+def seed_students(app, per_group):
+    """По per_group студентов без темы в каждой группе, {id группы: [id студентов]}"""
+    from sqlalchemy import insert, select
+    from models import db, Group, Student
+
+    with app.app_context():
+        group_ids = db.session.scalars(select(Group.id)).all()
+        db.session.execute(insert(Student), [
+            {'full_name': f'Студент {group_id}-{i}', 'group_id': group_id}
+            for group_id in group_ids for i in range(per_group)])
+        db.session.commit()
+        students = {}
+        for student_id, group_id in db.session.execute(select(Student.id, Student.group_id)):
+            students.setdefault(group_id, []).append(student_id)
+        return students
+
+
+def run(profile, threads, duration, db_path):
+    configure(profile)
+    app = create_app(db_path)
+
+    from app import expiry_scheduler
+    from database import sqlite_settings
+    from models import db, User
+
+    usernames = seed_headmen(app, threads)
+    topic_ids = seed_topics(app, threads * 200)
+    students = seed_students(app, 200)
+    with app.app_context():
+        groups = {user.username: user.group_id
+                  for user in User.query.filter(User.username.in_(usernames))}
+        with db.engine.connect() as connection:
+            settings = sqlite_settings(connection)
+
+    statuses = Counter()
+    locked = Counter()
+    latencies = []
+    lock = threading.Lock()
+    stop = threading.Event()
+    barrier = threading.Barrier(threads + 1)
+
+    def record(kind, response, elapsed):
+        with lock:
+            statuses[(kind, response.status_code)] += 1
+            latencies.append(elapsed)
+            if response.status_code == 500 and 'locked' in response.get_data(as_text=True):
+                locked[kind] += 1
+
+    def call(kind, client, method, url, **kwargs):
+        started = time.perf_counter()
+        response = getattr(client, method)(url, **kwargs)
+        record(kind, response, time.perf_counter() - started)
+        return response
+
+    def headman(username):
+        client = login(app, username)
+        waiting = list(students[groups[username]])
+        rng = random.Random(username)
+        barrier.wait()
+        while not stop.is_set() and waiting:
+            topic_id = rng.choice(topic_ids)
+            response = call('reserve', client, 'post', '/headman/reserve_topic',
+                            json={'topic_id': topic_id})
+            if response.status_code == 200:
+                response = call('assign', client, 'post', '/headman/assign_topic',
+                                json={'topic_id': topic_id, 'student_id': waiting[-1]})
+                if response.status_code == 200:
+                    waiting.pop()
+            call('read', client, 'get', '/headman/api/topics?page=1')
+
+    def cleanup():
+        barrier.wait()
+        while not stop.is_set():
+            expiry_scheduler.release_expired()
+            time.sleep(0.01)
+
+    workers = [threading.Thread(target=headman, args=(username,)) for username in usernames]
+    workers.append(threading.Thread(target=cleanup))
+    for thread in workers:
+        thread.start()
+    started = time.perf_counter()
+    time.sleep(duration)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ok = {kind: statuses[(kind, 200)] for kind in ('reserve', 'assign', 'read')}
+    return {
+        'profile': profile,
+        'settings': settings,
+        'elapsed': round(elapsed, 2),
+        'requests': sum(statuses.values()),
+        'requests_per_sec': round(sum(statuses.values()) / elapsed, 1),
+        'assigned_per_sec': round(ok['assign'] / elapsed, 1),
+        'ok': ok,
+        'errors_500': sum(count for (kind, code), count in statuses.items() if code == 500),
+        'locked': dict(locked),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 1) if latencies else None
+    }
+
+
+def compare(threads, duration, directory):
+    os.makedirs(directory, exist_ok=True)
+    results = []
+    for profile in PROFILES:
+        db_path = os.path.join(directory, f'{profile}.db')
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--profile', profile,
+             '--threads', str(threads), '--duration', str(duration), '--db', db_path, '--json'],
+            stdout=subprocess.PIPE, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    for result in results:
+        print(f"{result['profile']:>8}: {result['settings']}")
+    print(f"{'профиль':>8} {'запр/с':>8} {'назн/с':>8} {'500':>6} {'locked':>7} {'p50 мс':>8} {'p99 мс':>8}")
+    for result in results:
+        print(f"{result['profile']:>8} {result['requests_per_sec']:>8} {result['assigned_per_sec']:>8} "
+              f"{result['errors_500']:>6} {sum(result['locked'].values()):>7} "
+              f"{result['p50_ms']:>8} {result['p99_ms']:>8}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profile', choices=PROFILES)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--db', help='каталог для баз (с --profile - путь к файлу базы); по умолчанию временный')
+    parser.add_argument('--json', action='store_true', help='вывести результат одной строкой JSON')
+    args = parser.parse_args()
+
+    if args.profile is None:
+        compare(args.threads, args.duration, args.db or tempfile.mkdtemp(prefix='thesis_bench_'))
+    else:
+        result = run(args.profile, args.threads, args.duration, args.db)
+        print(json.dumps(result, ensure_ascii=False) if args.json
+              else json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,74 @@
+"""Поиск тем по названию: индекс FTS5 против ILIKE.
+
+Создает --topics тем со случайными названиями из словаря и для каждого
+запроса замеряет первую страницу выдачи (как /headman/api/topics?q=...)
+с индексом topic_fts и без него. Выводит медиану и p95 времени.
+
+    python benchmarks/topic_search.py --topics 50000
+"""
+import argparse
+import random
+import time
+
+from common import create_app
+
+WORDS = ['разработка', 'информационной', 'системы', 'учёта', 'анализ', 'рынка',
+         'автоматизация', 'склада', 'проектирование', 'базы', 'данных', 'веб',
+         'приложения', 'предприятия', 'моделирование', 'сети', 'защиты', 'кадров',
+         'мобильного', 'сервиса', 'оптимизация', 'логистики', 'учебного', 'процесса']
+QUERIES = ['инфор сист', 'учет кадр', 'веб прил', 'модел', 'оптимизация логистики склада',
+           'защиты данных предприятия']
+
+
+def run(topics, repeat, per_page, seed):
+    app = create_app()
+
+    from sqlalchemy import insert
+    from models import db, Supervisor, WorkType, Topic
+    from queries import available_topics_query, paginate
+    import search
+
+    rng = random.Random(seed)
+    with app.app_context():
+        supervisor = Supervisor(full_name='Бенчмарк Б.Б.', subjects='')
+        work_type = WorkType(name='курсовая', subject='Бенчмарк')
+        db.session.add_all([supervisor, work_type])
+        db.session.flush()
+        db.session.execute(insert(Topic), [{
+            'title': ' '.join(rng.sample(WORDS, rng.randint(4, 8))).capitalize(),
+            'status': 'free',
+            'supervisor_id': supervisor.id,
+            'work_type_id': work_type.id
+        } for _ in range(topics)])
+        db.session.commit()
+
+        print(f'Тем: {topics}, страница: {per_page}, повторов: {repeat}')
+        print(f"{'запрос':32} {'найдено':>8} {'FTS5 p50/p95, мс':>18} {'ILIKE p50/p95, мс':>18}")
+        for query_text in QUERIES:
+            results = []
+            for enabled in (True, False):
+                search._fts_enabled[db.engine] = enabled
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    page = paginate(available_topics_query(1, search=query_text), 1, per_page)
+                    [topic.supervisor.full_name for topic in page.items]
+                    timings.append((time.perf_counter() - started) * 1000)
+                    db.session.rollback()
+                timings.sort()
+                results.append((page.total, timings[len(timings) // 2],
+                                timings[min(int(len(timings) * 0.95), len(timings) - 1)]))
+            (fts_total, fts_p50, fts_p95), (_, like_p50, like_p95) = results
+            print(f'{query_text:32} {fts_total:>8} {fts_p50:>9.1f}/{fts_p95:<8.1f} '
+                  f'{like_p50:>9.1f}/{like_p95:<8.1f}')
+        search._fts_enabled.pop(db.engine, None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--topics', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--per-page', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    run(args.topics, args.repeat, args.per_page, args.seed)
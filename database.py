@@ -0,0 +1,85 @@
+"""Настройка подключения к базе.
+
+Адрес базы берется из SQLALCHEMY_DATABASE_URI (переменная окружения
+DATABASE_URL), по умолчанию используется файл SQLite.
+
+Для файловой SQLite база переводится в режим WAL: читатели не блокируют
+писателя, а запись ждет освобождения блокировки до busy_timeout вместо
+немедленной ошибки "database is locked". Параметры задаются PRAGMA при
+каждом новом подключении, пул соединений рассчитан на многопоточный сервер.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def is_file_sqlite(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def normalize_uri(uri):
+    """postgres:// (так адрес выдают многие хостинги) -> postgresql://"""
+    if uri.startswith('postgres://'):
+        return 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def engine_options(config):
+    """Параметры движка по настройкам приложения; явно заданные
+    SQLALCHEMY_ENGINE_OPTIONS имеют приоритет"""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if is_sqlite(uri) and not is_file_sqlite(uri):
+        # База в памяти живет в одном соединении, пул не настраивается
+        return options
+
+    options.setdefault('pool_size', config['DB_POOL_SIZE'])
+    options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    if not is_sqlite(uri):
+        # Серверная база может закрыть простаивающее соединение
+        options.setdefault('pool_pre_ping', True)
+    else:
+        connect_args = dict(options.get('connect_args') or {})
+        # Соединения из пула переходят между потоками обработчиков
+        connect_args.setdefault('check_same_thread', False)
+        busy_timeout = config['SQLITE_PRAGMAS'].get('busy_timeout')
+        if busy_timeout is not None:
+            connect_args.setdefault('timeout', busy_timeout / 1000)
+        options['connect_args'] = connect_args
+    return options
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def init_database(app, db):
+    """Подключает db к приложению с настройками пула и PRAGMA для SQLite"""
+    app.config['SQLALCHEMY_DATABASE_URI'] = normalize_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    db.init_app(app)
+
+    if not is_sqlite(app.config['SQLALCHEMY_DATABASE_URI']):
+        return
+    pragmas = dict(app.config['SQLITE_PRAGMAS'])
+    with app.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, pragmas)
+
+
+def sqlite_settings(connection):
+    """Текущие значения PRAGMA соединения, для проверки настроек"""
+    return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+            for name in ('journal_mode', 'synchronous', 'busy_timeout',
+                         'cache_size', 'mmap_size', 'temp_store')}
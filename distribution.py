@@ -0,0 +1,202 @@
+"""Массовое случайное распределение тем между студентами.
+
+Распределение строится на массивах numpy: студенты и подходящие темы
+перемешиваются генератором с заданным seed, темы сверх лимита нагрузки
+руководителя отбрасываются, оставшиеся сопоставляются студентам по порядку.
+Результат записывается пакетными UPDATE в таблицы topic и student.
+"""
+import random
+import time
+
+import numpy as np
+from sqlalchemy import bindparam, func, select, update
+
+import stats
+from models import db, Student, Supervisor, Topic, WorkType
+
+WRITE_BATCH_SIZE = 5000
+
+
+class DistributionError(Exception):
+    """Распределение невозможно (например, не хватает свободных тем)"""
+
+
+def parse_subjects(subjects):
+    """Список предметов руководителя из CSV-строки"""
+    return {item.strip().lower() for item in (subjects or '').split(',') if item.strip()}
+
+
+def _load(group_ids, work_type_id):
+    # Чтение через соединение без ORM: строки сразу превращаются в кортежи
+    connection = db.session.connection()
+
+    student_query = select(Student.id, Student.group_id).where(Student.topic_id.is_(None),
+                                                              Student.id.not_in(assigned_students()))
+    if group_ids:
+        student_query = student_query.where(Student.group_id.in_(group_ids))
+    students = np.array([tuple(row) for row in
+                         connection.execute(student_query.order_by(Student.id))],
+                        dtype=np.int64).reshape(-1, 2)
+
+    topic_query = (
+        select(Topic.id, Topic.supervisor_id, WorkType.subject)
+        .join(WorkType, Topic.work_type_id == WorkType.id)
+        .where(Topic.effective_status_is('free'))
+    )
+    if work_type_id:
+        topic_query = topic_query.where(Topic.work_type_id == work_type_id)
+    topic_rows = [tuple(row) for row in connection.execute(topic_query.order_by(Topic.id))]
+
+    supervisors = dict(connection.execute(select(Supervisor.id, Supervisor.subjects)).all())
+    return students, topic_rows, supervisors, supervisor_loads(connection)
+
+
+def assigned_students():
+    """Студенты, уже указанные в назначенной теме. Старые базы до миграции 8
+    хранят назначение только в topic.student_id, student.topic_id там пуст"""
+    return select(Topic.student_id).where(Topic.student_id.isnot(None))
+
+
+def supervisor_loads(connection):
+    """Текущее число назначенных тем у каждого руководителя"""
+    return dict(connection.execute(
+        select(Topic.supervisor_id, func.count())
+        .where(Topic.status == 'assigned')
+        .group_by(Topic.supervisor_id)
+    ).all())
+
+
+def _eligible_topics(topic_rows, supervisors):
+    """Массивы (id темы, id руководителя) для тем, чей предмет ведет руководитель.
+    Если у руководителя не указаны предметы, подходят все его темы."""
+    subjects = {}
+    allowed = {}
+    ids = []
+    supervisor_ids = []
+    for topic_id, supervisor_id, subject in topic_rows:
+        key = (supervisor_id, subject)
+        if key not in allowed:
+            if supervisor_id not in subjects:
+                subjects[supervisor_id] = parse_subjects(supervisors.get(supervisor_id))
+            allowed[key] = not subjects[supervisor_id] or subject.strip().lower() in subjects[supervisor_id]
+        if allowed[key]:
+            ids.append(topic_id)
+            supervisor_ids.append(supervisor_id)
+    return np.array(ids, dtype=np.int64), np.array(supervisor_ids, dtype=np.int64)
+
+
+def _apply_load_caps(supervisor_ids, loads, max_load):
+    """Маска тем, которые можно выдать без превышения нагрузки руководителя.
+    supervisor_ids уже перемешаны: берутся первые темы каждого руководителя."""
+    if max_load is None or not len(supervisor_ids):
+        return np.ones(len(supervisor_ids), dtype=bool)
+
+    order = np.argsort(supervisor_ids, kind='stable')
+    sorted_ids = supervisor_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_ids)])
+    ranks = np.empty(len(sorted_ids), dtype=np.int64)
+    ranks[order] = np.arange(len(sorted_ids)) - np.repeat(starts, counts)
+
+    current = np.array([loads.get(int(s), 0) for s in sorted_ids[starts]], dtype=np.int64)
+    remaining = np.repeat(np.maximum(max_load - current, 0), counts)
+    capacity = np.empty(len(sorted_ids), dtype=np.int64)
+    capacity[order] = remaining
+    return ranks < capacity
+
+
+def write_assignments(pairs, progress=None):
+    """Записывает назначения (id темы, id студента, id группы) пакетными UPDATE
+    одной транзакцией вместе со счетчиками статистики, возвращает число
+    фактически назначенных тем.
+    progress(записано, всего) вызывается после каждой пачки."""
+    assigned_before = db.session.scalar(
+        select(func.count()).select_from(Topic).where(Topic.status == 'assigned'))
+    topic_table = Topic.__table__
+    student_table = Student.__table__
+    # Тема могла быть зарезервирована после загрузки - такие строки пропускаются
+    topic_update = (
+        update(topic_table)
+        .where(topic_table.c.id == bindparam('b_topic'), Topic.effective_status_is('free'))
+        .values(status='assigned', student_id=bindparam('b_student'),
+                group_id=bindparam('b_group'), reserved_at=None, reserved_by=None)
+    )
+    # Студенту записывается тема, только если она действительно досталась ему
+    student_update = (
+        update(student_table)
+        .where(student_table.c.id == bindparam('b_student'),
+               student_table.c.topic_id.is_(None),
+               select(topic_table.c.id)
+               .where(topic_table.c.id == bindparam('b_topic'),
+                      topic_table.c.student_id == bindparam('b_student'))
+               .exists())
+        .values(topic_id=bindparam('b_topic'))
+    )
+    try:
+        for start in range(0, len(pairs), WRITE_BATCH_SIZE):
+            params = [{'b_topic': topic_id, 'b_student': student_id, 'b_group': group_id}
+                      for topic_id, student_id, group_id in pairs[start:start + WRITE_BATCH_SIZE]]
+            db.session.execute(topic_update, params)
+            db.session.execute(student_update, params)
+            if progress:
+                progress(start + len(params), len(pairs))
+        assigned = db.session.scalar(
+            select(func.count()).select_from(Topic).where(Topic.status == 'assigned')
+        ) - assigned_before
+        # Пересчет GROUP BY дешевле загрузки тем перед распределением
+        stats.recompute(db.session.connection())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return assigned
+
+
+def distribute(group_ids=None, work_type_id=None, seed=None, max_load=None,
+               allow_partial=False, progress=None):
+    """Распределяет свободные темы между студентами без темы.
+
+    group_ids - список групп (None - все группы), work_type_id - тип работы
+    (None - любой), seed - зерно генератора для воспроизводимости,
+    max_load - наибольшее число назначенных тем у одного руководителя,
+    progress - передается в write_assignments.
+    Возвращает отчет с числом назначений и временем каждой фазы.
+    """
+    if seed is None:
+        seed = random.SystemRandom().randrange(2 ** 32)
+    timings = {}
+
+    started = time.perf_counter()
+    students, topic_rows, supervisors, loads = _load(group_ids, work_type_id)
+    timings['load'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    topic_ids, topic_supervisors = _eligible_topics(topic_rows, supervisors)
+    students = students[rng.permutation(len(students))]
+    order = rng.permutation(len(topic_ids))
+    topic_ids, topic_supervisors = topic_ids[order], topic_supervisors[order]
+    topic_ids = topic_ids[_apply_load_caps(topic_supervisors, loads, max_load)]
+
+    if len(students) > len(topic_ids) and not allow_partial:
+        raise DistributionError(
+            f'Недостаточно свободных тем для всех студентов: '
+            f'студентов {len(students)}, доступных тем {len(topic_ids)}')
+    count = min(len(students), len(topic_ids))
+    # Строки вида (id темы, id студента, id группы)
+    pairs = np.column_stack((topic_ids[:count], students[:count]))
+    timings['plan'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    assigned = write_assignments(pairs.tolist(), progress)
+    timings['write'] = time.perf_counter() - started
+
+    return {
+        'assigned': assigned,
+        'planned': count,
+        'students': len(students),
+        'topics': len(topic_ids),
+        'unassigned': len(students) - assigned,
+        'seed': seed,
+        'timings': {phase: round(value, 3) for phase, value in timings.items()}
+    }
@@ -0,0 +1,123 @@
+"""Рассылка изменений статуса тем через Server-Sent Events.
+
+Маршруты резервирования и назначения и планировщик снятия резерваций
+публикуют события в брокер, а брокер раскладывает их по очередям
+подписчиков - открытых вкладок старост. Последние EVENTS_BUFFER событий
+хранятся, чтобы переподключившийся клиент (заголовок Last-Event-ID)
+получил пропущенное. Если клиент отстал больше, чем помещается в буфер
+или в его очередь, ему отправляется событие resync - перезагрузить данные.
+"""
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+RESYNC = 'resync'
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+class EventBroker:
+    def __init__(self, app):
+        self.heartbeat = app.config['EVENTS_HEARTBEAT']
+        self.queue_size = app.config['EVENTS_QUEUE_SIZE']
+        self._buffer = deque(maxlen=app.config['EVENTS_BUFFER'])
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._listeners = []
+        self.published = 0
+        self.dropped = 0
+
+    def add_listener(self, callback):
+        """callback(событие) вызывается в потоке публикации при каждом событии"""
+        self._listeners.append(callback)
+
+    def publish(self, event_type, topic_ids=(), **data):
+        """Отправляет событие всем подписчикам; вызывать после commit"""
+        with self._lock:
+            self._last_id += 1
+            event = dict(data, id=self._last_id, type=event_type, topic_ids=list(topic_ids))
+            self._buffer.append(event)
+            self.published += 1
+            subscribers = list(self._subscribers)
+        for listener in self._listeners:
+            listener(event)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Клиент не успевает читать: очищаем очередь и просим перезагрузку
+                self._drain(subscriber)
+                try:
+                    subscriber.put_nowait({'id': event['id'], 'type': RESYNC, 'topic_ids': []})
+                except queue.Full:
+                    pass
+                with self._lock:
+                    self.dropped += 1
+        return event
+
+    @staticmethod
+    def _drain(subscriber):
+        try:
+            while True:
+                subscriber.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _missed(self, last_event_id):
+        """События после last_event_id или None, если часть уже вытеснена из буфера"""
+        with self._lock:
+            if last_event_id > self._last_id:
+                # Сервер перезапускался, нумерация событий началась заново
+                return None
+            if not self._buffer or last_event_id == self._last_id:
+                return []
+            if self._buffer[0]['id'] > last_event_id + 1:
+                return None
+            return [event for event in self._buffer if event['id'] > last_event_id]
+
+    def stream(self, last_event_id=None):
+        """Генератор текста text/event-stream для одного клиента"""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            current_id = self._last_id
+        try:
+            # Клиент переподключается по разрыву через retry мс и присылает
+            # последний полученный id
+            if last_event_id is None:
+                yield f'retry: 3000\nid: {current_id}\n\n'
+            else:
+                yield 'retry: 3000\n\n'
+                missed = self._missed(last_event_id)
+                if missed is None:
+                    yield format_event({'id': current_id, 'type': RESYNC, 'topic_ids': []})
+                else:
+                    for event in missed:
+                        if event['id'] <= current_id:
+                            yield format_event(event)
+
+            while True:
+                try:
+                    event = subscriber.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # Комментарий держит соединение и выявляет закрытые вкладки
+                    yield f': ping {int(time.time())}\n\n'
+                    continue
+                yield format_event(event)
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'dropped': self.dropped,
+                'last_event_id': self._last_id
+            }
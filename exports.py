@@ -0,0 +1,131 @@
+"""Выгрузка назначенных тем в CSV/Excel.
+
+Строки читаются из базы курсором пачками (yield_per) и сразу пишутся в
+ответ или файл, поэтому память не зависит от числа строк. CSV отдается
+потоком, Excel собирается книгой openpyxl в режиме write_only. Большие
+выгрузки выполняются фоновой задачей (jobs.py) в файл в EXPORT_FOLDER;
+файлы старше EXPORT_RETENTION удаляет периодическая задача.
+"""
+import csv
+import io
+import os
+import time
+import uuid
+from datetime import datetime
+
+from openpyxl import Workbook
+from sqlalchemy import func, select
+
+from models import db, Group, Student, Supervisor, Topic, WorkType
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+FETCH_SIZE = 1000
+
+# Файлы, которые приложение само пишет в EXPORT_FOLDER: выгрузки и логины студентов
+GENERATED_PREFIXES = ('assignments_', 'credentials_')
+
+HEADER = ['Группа', 'ЦМК', 'Студент', 'Телефон', 'Тема', 'Руководитель',
+          'Тип работы', 'Предмет']
+
+
+def assignments_query(group_id=None, supervisor_id=None, work_type_id=None):
+    """Назначенные темы с данными студента, группы, руководителя и типа работы"""
+    query = (
+        select(Group.name, Group.cmk, Student.full_name, Student.phone, Topic.title,
+               Supervisor.full_name, WorkType.name, WorkType.subject)
+        .select_from(Topic)
+        .join(Student, Student.id == Topic.student_id)
+        .join(Group, Group.id == Student.group_id)
+        .join(Supervisor, Supervisor.id == Topic.supervisor_id)
+        .join(WorkType, WorkType.id == Topic.work_type_id)
+        .where(Topic.status == 'assigned')
+    )
+    if group_id:
+        query = query.where(Student.group_id == group_id)
+    if supervisor_id:
+        query = query.where(Topic.supervisor_id == supervisor_id)
+    if work_type_id:
+        query = query.where(Topic.work_type_id == work_type_id)
+    return query.order_by(Group.name, Student.full_name)
+
+
+def count_rows(query):
+    return db.session.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+
+
+def iter_rows(query):
+    """Строки выгрузки, читаемые с сервера пачками по FETCH_SIZE"""
+    result = db.session.execute(query.execution_options(yield_per=FETCH_SIZE))
+    for row in result:
+        yield ['' if value is None else value for value in row]
+
+
+def iter_csv(query):
+    """CSV по частям: заголовок и затем по одной пачке строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM, чтобы Excel правильно открыл UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(HEADER)
+    for number, row in enumerate(iter_rows(query), start=1):
+        writer.writerow(row)
+        if number % FETCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_file(query, path, export_format, progress=None):
+    """Пишет выгрузку в файл, возвращает число строк"""
+    rows = 0
+    if export_format == 'csv':
+        with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(HEADER)
+            for row in iter_rows(query):
+                writer.writerow(row)
+                rows += 1
+                if progress and rows % FETCH_SIZE == 0:
+                    progress(rows)
+        return rows
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Назначения')
+    sheet.append(HEADER)
+    for row in iter_rows(query):
+        sheet.append(row)
+        rows += 1
+        if progress and rows % FETCH_SIZE == 0:
+            progress(rows)
+    workbook.save(path)
+    return rows
+
+
+def export_filename(export_format):
+    return f"assignments_{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:6]}.{export_format}"
+
+
+def export_folder(app):
+    folder = os.path.join(app.root_path, app.config['EXPORT_FOLDER'])
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def remove_expired_files(folder, max_age):
+    """Удаляет выгрузки и файлы с логинами старше max_age секунд,
+    возвращает число удаленных файлов"""
+    deadline = time.time() - max_age
+    removed = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.startswith(GENERATED_PREFIXES):
+                continue
+            try:
+                if entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                # Файл уже удален, например после скачивания
+                continue
+    return removed
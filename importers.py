@@ -0,0 +1,294 @@
+"""Массовая загрузка данных из Excel/CSV в базу"""
+import math
+import time
+from collections import Counter
+
+from sqlalchemy import insert, select
+
+import stats
+from models import db, Group, Student, Supervisor, WorkType, Topic
+from search import DuplicateIndex
+
+# Ограничение SQLite на число параметров в одном запросе
+IN_CLAUSE_LIMIT = 900
+# Сколько ошибок по строкам возвращать в отчете
+MAX_REPORTED_ERRORS = 1000
+
+# Обязательные колонки файла со студентами
+STUDENT_COLUMNS = ('full_name', 'group')
+# Обязательные колонки файла с темами
+TOPIC_COLUMNS = ('title', 'supervisor', 'work_type', 'subject')
+
+
+def clean_value(value):
+    """Приводит значение ячейки к строке или None для пустых ячеек"""
+    if value is None:
+        return None
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def chunked(items, size):
+    """Разбивает список на части фиксированного размера"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def fetch_group_ids(names):
+    """Возвращает словарь {название группы: id} для существующих групп"""
+    result = {}
+    for part in chunked(list(names), IN_CLAUSE_LIMIT):
+        rows = db.session.execute(
+            select(Group.name, Group.id).where(Group.name.in_(part))
+        )
+        result.update({name: group_id for name, group_id in rows})
+    return result
+
+
+def fetch_supervisor_ids(names):
+    """Возвращает словарь {ФИО руководителя: id} для существующих руководителей"""
+    result = {}
+    for part in chunked(list(names), IN_CLAUSE_LIMIT):
+        rows = db.session.execute(
+            select(Supervisor.full_name, Supervisor.id)
+            .where(Supervisor.full_name.in_(part))
+            .order_by(Supervisor.id)
+        )
+        for name, supervisor_id in rows:
+            result.setdefault(name, supervisor_id)
+    return result
+
+
+def fetch_work_type_ids(keys):
+    """Возвращает словарь {(тип работы, предмет): id} для существующих типов работ"""
+    keys = set(keys)
+    result = {}
+    for part in chunked(list({name for name, _ in keys}), IN_CLAUSE_LIMIT):
+        rows = db.session.execute(
+            select(WorkType.name, WorkType.subject, WorkType.id)
+            .where(WorkType.name.in_(part))
+            .order_by(WorkType.id)
+        )
+        for name, subject, work_type_id in rows:
+            if (name, subject) in keys:
+                result.setdefault((name, subject), work_type_id)
+    return result
+
+
+class ImportReport:
+    """Счетчики загрузки: строки, ошибки, скорость"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': line, 'error': message})
+
+    def as_dict(self, **extra):
+        elapsed = time.perf_counter() - self.started
+        result = {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'elapsed': round(elapsed, 3),
+            'rows_per_sec': round(self.rows / elapsed) if elapsed > 0 else self.rows
+        }
+        result.update(extra)
+        return result
+
+
+def import_students(batches, progress=None):
+    """Загрузка студентов одной транзакцией.
+
+    batches - итератор пачек пар (номер строки, словарь с ключами full_name,
+    group, phone, cmk). Для каждой пачки группы определяются одним запросом,
+    недостающие создаются одной вставкой, затем студенты вставляются пачкой.
+    В памяти держится только текущая пачка и справочник групп.
+    progress(строк) вызывается после каждой пачки; исключение из него
+    откатывает загрузку.
+    """
+    report = ImportReport()
+    group_ids = {}
+    groups_created = 0
+    deltas = Counter()  # изменения счетчиков статистики
+
+    try:
+        for batch in batches:
+            students = []
+            new_groups = {}
+            for line, row in batch:
+                report.rows += 1
+                full_name = clean_value(row.get('full_name'))
+                group_name = clean_value(row.get('group'))
+                if not full_name:
+                    report.error(line, 'Не указано ФИО')
+                    continue
+                if not group_name:
+                    report.error(line, 'Не указана группа')
+                    continue
+
+                if group_name not in group_ids:
+                    new_groups.setdefault(group_name, clean_value(row.get('cmk')) or 'Общая')
+                students.append((full_name, clean_value(row.get('phone')) or '', group_name))
+
+            if new_groups:
+                group_ids.update(fetch_group_ids(new_groups))
+                missing = [{'name': name, 'cmk': cmk} for name, cmk in new_groups.items()
+                           if name not in group_ids]
+                if missing:
+                    db.session.execute(insert(Group), missing)
+                    group_ids.update(fetch_group_ids(item['name'] for item in missing))
+                    groups_created += len(missing)
+
+            if students:
+                db.session.execute(insert(Student), [{
+                    'full_name': full_name,
+                    'phone': phone,
+                    'group_id': group_ids[group_name]
+                } for full_name, phone, group_name in students])
+                report.inserted += len(students)
+                deltas.update(stats.students_added(group_ids[group_name]
+                                                   for _, _, group_name in students))
+            if progress:
+                progress(report.rows)
+
+        stats.apply(db.session.connection(), deltas)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return report.as_dict(groups_created=groups_created)
+
+
+def import_topics(batches, duplicate_threshold, dry_run=False, progress=None):
+    """Загрузка каталога тем одной транзакцией.
+
+    batches - итератор пачек пар (номер строки, словарь с ключами title,
+    supervisor, subjects, work_type, subject). Руководители и типы работ
+    кэшируются в словарях по уникальным значениям, недостающие создаются
+    одним запросом на таблицу для каждой пачки, темы вставляются пачками.
+    При dry_run=True база не изменяется, возвращается только список того,
+    что было бы создано. progress - как в import_students.
+
+    Название сравнивается с темами того же руководителя в базе и в файле:
+    совпадающее после нормализации (регистр, ё, знаки препинания)
+    пропускается, похожее не меньше чем на duplicate_threshold (обычно
+    TOPIC_DUPLICATE_THRESHOLD из настроек) загружается и попадает в список
+    duplicates отчета.
+    """
+    report = ImportReport()
+    supervisor_ids = {}
+    work_type_ids = {}
+    new_supervisors = []
+    new_work_types = []
+    new_topics = 0
+    titles = DuplicateIndex(duplicate_threshold)
+    duplicates = []
+    deltas = Counter()  # изменения счетчиков статистики
+
+    try:
+        for batch in batches:
+            topics = []
+            supervisors = {}
+            work_types = set()
+            for line, row in batch:
+                report.rows += 1
+                values = {column: clean_value(row.get(column)) for column in TOPIC_COLUMNS}
+                empty = [column for column, value in values.items() if not value]
+                if empty:
+                    report.error(line, f'Пустые колонки: {", ".join(empty)}')
+                    continue
+
+                work_type_key = (values['work_type'], values['subject'])
+                if values['supervisor'] not in supervisor_ids:
+                    supervisors.setdefault(values['supervisor'],
+                                           clean_value(row.get('subjects')) or '')
+                if work_type_key not in work_type_ids:
+                    work_types.add(work_type_key)
+                topics.append((line, values['title'], values['supervisor'], work_type_key))
+
+            if supervisors:
+                supervisor_ids.update(fetch_supervisor_ids(supervisors))
+                missing = [{'full_name': name, 'subjects': subjects}
+                           for name, subjects in supervisors.items()
+                           if name not in supervisor_ids]
+                new_supervisors.extend(item['full_name'] for item in missing)
+                if missing and not dry_run:
+                    db.session.execute(insert(Supervisor), missing)
+                    supervisor_ids.update(fetch_supervisor_ids(
+                        item['full_name'] for item in missing))
+                elif missing:
+                    # В режиме проверки запоминаем имена, чтобы не запрашивать их снова
+                    supervisor_ids.update((item['full_name'], None) for item in missing)
+
+            if work_types:
+                work_type_ids.update(fetch_work_type_ids(work_types))
+                missing = [{'name': name, 'subject': subject}
+                           for name, subject in sorted(work_types)
+                           if (name, subject) not in work_type_ids]
+                new_work_types.extend(f"{item['name']} - {item['subject']}" for item in missing)
+                if missing and not dry_run:
+                    db.session.execute(insert(WorkType), missing)
+                    work_type_ids.update(fetch_work_type_ids(
+                        (item['name'], item['subject']) for item in missing))
+                elif missing:
+                    work_type_ids.update(((item['name'], item['subject']), None)
+                                         for item in missing)
+
+            unknown = list({supervisor for _, _, supervisor, _ in topics
+                            if not titles.known(supervisor)})
+            for names in chunked(unknown, IN_CLAUSE_LIMIT):
+                titles.load(db.session.connection(),
+                            {name: supervisor_ids.get(name) for name in names})
+            unique_topics = []
+            for line, title, supervisor, work_type in topics:
+                match = titles.find(supervisor, title)
+                if match and match[1] == 1.0:
+                    report.error(line, f'Тема уже есть у руководителя: {match[0]}')
+                    continue
+                if match and len(duplicates) < MAX_REPORTED_ERRORS:
+                    duplicates.append({'row': line, 'title': title, 'similar_to': match[0],
+                                       'similarity': round(match[1], 2)})
+                titles.add(supervisor, title)
+                unique_topics.append((title, supervisor, work_type))
+
+            new_topics += len(unique_topics)
+            if unique_topics and not dry_run:
+                db.session.execute(insert(Topic), [{
+                    'title': title,
+                    'status': 'free',
+                    'supervisor_id': supervisor_ids[supervisor],
+                    'work_type_id': work_type_ids[work_type]
+                } for title, supervisor, work_type in unique_topics])
+                report.inserted += len(unique_topics)
+                deltas.update(stats.topics_added(
+                    (work_type_ids[work_type], supervisor_ids[supervisor])
+                    for _, supervisor, work_type in unique_topics))
+            if progress:
+                progress(report.rows)
+
+        if not dry_run:
+            stats.apply(db.session.connection(), deltas)
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return report.as_dict(dry_run=dry_run,
+                          new_topics=new_topics,
+                          new_supervisors=new_supervisors,
+                          new_work_types=new_work_types,
+                          duplicates=duplicates)
@@ -0,0 +1,289 @@
+"""Фоновые задачи администратора.
+
+Загрузка файлов, распределение тем, создание учетных записей и большие
+выгрузки выполняются в пуле из JOB_WORKERS потоков, а маршрут сразу
+возвращает id задачи. Задача хранится в таблице job: параметры, состояние,
+итоговый отчет или ошибка сохраняются после перезапуска сервера. Задачи,
+меняющие данные, выполняются по одной - в SQLite пишет одна транзакция.
+
+Ход выполнения (обработано строк из total) ведется в памяти процесса,
+выполняющего задачу: пишущая транзакция задачи держит блокировку базы, и
+промежуточный UPDATE из другой транзакции ждал бы ее окончания. В таблицу
+счетчики записываются при завершении. По той же причине отмена задачи
+своего процесса отмечается в памяти; задача другого процесса отмечается в
+таблице, и задача проверяет отметку не чаще раза в JOB_CANCEL_CHECK
+секунд. Отмененная задача прерывается исключением JobCancelled с откатом
+своей транзакции.
+
+Функция задачи регистрируется декоратором @job_queue.register(вид) и получает
+JobContext и параметры задачи:
+
+    @job_queue.register('import_students')
+    def run_import(job, upload, filename):
+        ...
+        job.progress(rows, total)
+        return отчет
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+
+from models import db, Job
+
+FINISHED = ('done', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    """Задача отменена администратором"""
+
+
+class JobContext:
+    """Передается функции задачи: отчет о ходе выполнения и проверка отмены"""
+
+    def __init__(self, queue, job_id):
+        self.id = job_id
+        self._queue = queue
+        self._checked = None
+
+    def progress(self, processed, total=None):
+        """Обработано processed из total; прерывает задачу, если ее отменили"""
+        self._queue._set_progress(self.id, processed, total)
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        now = time.monotonic()
+        if self._queue._cancel_seen(self.id):
+            raise JobCancelled()
+        if self._checked is not None and now - self._checked < self._queue.cancel_check:
+            return
+        self._checked = now
+        if self._queue.cancel_requested(self.id):
+            raise JobCancelled()
+
+
+class JobQueue:
+    def __init__(self, app):
+        self.app = app
+        self.workers = app.config['JOB_WORKERS']
+        self.cancel_check = app.config['JOB_CANCEL_CHECK']
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._handlers = {}
+        self._owned = set()  # задачи, поставленные в очередь этим процессом
+        self._live = {}  # id задачи -> ход выполнения в этом процессе
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def register(self, kind, writes=True):
+        """Регистрирует функцию задачи; writes=False - задача только читает базу
+        и может выполняться параллельно с другими"""
+        def decorator(function):
+            self._handlers[kind] = (function, writes)
+            return function
+        return decorator
+
+    def submit(self, kind, params=None, user_id=None, total=None):
+        """Создает задачу и ставит ее в очередь, возвращает id.
+        Файл params['upload'] удаляется, когда задача завершится."""
+        if kind not in self._handlers:
+            raise ValueError(f'Неизвестный вид задачи: {kind}')
+        job_id = uuid.uuid4().hex
+        with db.engine.begin() as connection:
+            connection.execute(insert(Job).values(
+                id=job_id, kind=kind, status='pending', params=params or {},
+                processed=0, total=total, cancel_requested=False,
+                created_by=user_id, created_at=datetime.utcnow()))
+        self._enqueue(job_id)
+        return job_id
+
+    def _enqueue(self, job_id):
+        with self._lock:
+            self._owned.add(job_id)
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            try:
+                self._execute(job_id)
+            except Exception as e:
+                print(f"❌ Ошибка очереди задач {job_id}: {e}")
+            finally:
+                db.session.remove()
+                with self._lock:
+                    self._owned.discard(job_id)
+                    self._cancelled.discard(job_id)
+
+    def _execute(self, job_id):
+        with db.engine.connect() as connection:
+            job = connection.execute(
+                select(Job.kind, Job.params, Job.total).where(Job.id == job_id)).first()
+        if job is None:
+            return
+        function, writes = self._handlers[job.kind]
+
+        # Пишущие задачи ждут своей очереди до перевода в running
+        with self._write_lock if writes else nullcontext():
+            cancelled = self._cancel_seen(job_id) or self.cancel_requested(job_id)
+            now = datetime.utcnow()
+            statement = update(Job).where(Job.id == job_id, Job.status == 'pending')
+            if cancelled:
+                statement = statement.values(status='cancelled', finished_at=now)
+            else:
+                statement = statement.values(status='running', started_at=now)
+            with db.engine.begin() as connection:
+                claimed = connection.execute(statement).rowcount
+            if not claimed or cancelled:
+                # Отменена, пока ждала в очереди
+                self._remove_upload(job.params)
+                return
+
+            with self._lock:
+                self._live[job_id] = {'processed': 0, 'total': job.total,
+                                      'started': time.monotonic()}
+            try:
+                result = function(JobContext(self, job_id), **job.params)
+                values = {'status': 'done', 'result': result}
+            except JobCancelled:
+                db.session.rollback()
+                values = {'status': 'cancelled'}
+                print(f"✅ Задача {job.kind} {job_id} отменена")
+            except Exception as e:
+                db.session.rollback()
+                values = {'status': 'failed', 'error': str(e)}
+                print(f"❌ Ошибка задачи {job.kind} {job_id}: {e}")
+            finally:
+                self._remove_upload(job.params)
+                with self._lock:
+                    live = self._live.pop(job_id)
+
+        with db.engine.begin() as connection:
+            connection.execute(update(Job).where(Job.id == job_id).values(
+                processed=live['processed'], total=live['total'],
+                finished_at=datetime.utcnow(), **values))
+
+    @staticmethod
+    def _remove_upload(params):
+        path = (params or {}).get('upload')
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def _set_progress(self, job_id, processed, total):
+        with self._lock:
+            live = self._live.get(job_id)
+            if live is not None:
+                live['processed'] = processed
+                if total is not None:
+                    live['total'] = total
+
+    def _cancel_seen(self, job_id):
+        with self._lock:
+            return job_id in self._cancelled
+
+    def cancel_requested(self, job_id):
+        # Отдельное соединение: транзакция задачи не видит изменений после своего начала
+        with db.engine.connect() as connection:
+            return bool(connection.scalar(
+                select(Job.cancel_requested).where(Job.id == job_id)))
+
+    def cancel(self, job_id):
+        """Отменяет задачу. Возвращает None, если задачи нет, False, если она
+        уже завершена, и True, если отмена принята"""
+        with db.engine.connect() as connection:
+            status = connection.scalar(select(Job.status).where(Job.id == job_id))
+        if status is None:
+            return None
+        if status in FINISHED:
+            return False
+        with self._lock:
+            owned = job_id in self._owned
+            if owned:
+                self._cancelled.add(job_id)
+        if not owned:
+            # Задача другого процесса увидит отметку при следующей проверке
+            with db.engine.begin() as connection:
+                connection.execute(update(Job).where(Job.id == job_id, Job.status.not_in(FINISHED))
+                                   .values(cancel_requested=True))
+        return True
+
+    def every(self, kind, interval, params=None):
+        """Запускает поток, который ставит задачу kind в очередь раз в interval
+        секунд, если такая задача еще не ждет и не выполняется"""
+        def run():
+            while True:
+                time.sleep(interval)
+                with self.app.app_context():
+                    try:
+                        active = db.session.scalar(select(Job.id).where(
+                            Job.kind == kind, Job.status.in_(('pending', 'running'))).limit(1))
+                        if active is None:
+                            self.submit(kind, params)
+                    except Exception as e:
+                        print(f"❌ Ошибка планирования задачи {kind}: {e}")
+                    finally:
+                        db.session.remove()
+
+        thread = threading.Thread(target=run, name=f'job-every-{kind}', daemon=True)
+        thread.start()
+        return thread
+
+    def recover(self):
+        """После перезапуска: прерванные задачи помечаются ошибкой,
+        ожидавшие снова ставятся в очередь"""
+        with db.engine.begin() as connection:
+            interrupted = connection.scalars(
+                update(Job).where(Job.status == 'running').values(
+                    status='failed', error='Прервано перезапуском сервера',
+                    finished_at=datetime.utcnow())
+                .returning(Job.params)).all()
+            pending = connection.scalars(
+                select(Job.id).where(Job.status == 'pending').order_by(Job.created_at)).all()
+        # Прерванная задача уже не прочитает загруженный файл
+        for params in interrupted:
+            self._remove_upload(params)
+        for job_id in pending:
+            self._enqueue(job_id)
+        return len(pending)
+
+    def _serialize(self, job):
+        data = {
+            'id': job.id,
+            'kind': job.kind,
+            'status': job.status,
+            'processed': job.processed,
+            'total': job.total,
+            'result': job.result,
+            'error': job.error,
+            'cancel_requested': job.cancel_requested or self._cancel_seen(job.id),
+            'created_at': job.created_at.isoformat(),
+            'started_at': job.started_at.isoformat() if job.started_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+            'eta_seconds': None
+        }
+        with self._lock:
+            live = dict(self._live.get(job.id) or {})
+        if live and job.status == 'running':
+            data['processed'] = live['processed']
+            data['total'] = live['total']
+            elapsed = time.monotonic() - live['started']
+            if live['total'] and live['processed'] and elapsed > 0:
+                rate = live['processed'] / elapsed
+                data['eta_seconds'] = round(max(live['total'] - live['processed'], 0) / rate, 1)
+        data['percent'] = (round(min(data['processed'] / data['total'], 1) * 100, 1)
+                           if data['total'] else None)
+        if job.status == 'done':
+            data['percent'] = 100.0
+        return data
+
+    def get(self, job_id):
+        job = db.session.get(Job, job_id, populate_existing=True)
+        return self._serialize(job) if job else None
+
+    def recent(self, limit):
+        jobs = db.session.scalars(select(Job).order_by(Job.created_at.desc()).limit(limit))
+        return [self._serialize(job) for job in jobs]
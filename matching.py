@@ -0,0 +1,159 @@
+"""Распределение тем по предпочтениям студентов.
+
+Используется алгоритм отложенного принятия (Гейла-Шепли), в котором
+предложения делают студенты. У темы одно место, у руководителя - лимит
+назначенных тем. Приоритет студента для темы и руководителя определяется
+местом темы в его списке (выше место - сильнее заявка), при равенстве -
+жребием с заданным seed. Каждое предложение обрабатывается за O(log n),
+поэтому время растет как O(P log P) от общего числа предпочтений P, а не
+от произведения числа студентов и тем.
+"""
+import heapq
+import random
+import time
+from collections import defaultdict
+
+from sqlalchemy import select
+
+from models import db, Student, Topic, TopicPreference
+from distribution import assigned_students, supervisor_loads, write_assignments
+
+
+def stable_match(preferences, topic_supervisors, capacities=None, seed=None):
+    """Считает устойчивое распределение.
+
+    preferences - словарь {id студента: [id тем по убыванию желания]},
+    topic_supervisors - {id темы: id руководителя} для доступных тем,
+    capacities - {id руководителя: сколько еще тем можно назначить}; если
+    руководителя нет в словаре (или словарь не задан), лимита нет.
+    Возвращает словарь {id студента: id темы}.
+    """
+    capacities = capacities or {}
+    rng = random.Random(seed)
+    lottery = {student_id: rng.random() for student_id in preferences}
+
+    holder = {}  # тема -> (приоритет, студент)
+    # Для каждого руководителя куча удерживаемых заявок, наверху - самая слабая.
+    # Устаревшие записи (тема перешла другому студенту) удаляются лениво.
+    held = defaultdict(list)
+    held_count = defaultdict(int)
+    next_choice = dict.fromkeys(preferences, 0)
+    free = list(preferences)
+
+    while free:
+        student_id = free.pop()
+        choices = preferences[student_id]
+        while next_choice[student_id] < len(choices):
+            rank = next_choice[student_id]
+            topic_id = choices[rank]
+            next_choice[student_id] += 1
+            supervisor_id = topic_supervisors.get(topic_id)
+            if supervisor_id is None:
+                continue
+
+            priority = (rank, lottery[student_id])
+            current = holder.get(topic_id)
+            if current is not None:
+                if current[0] <= priority:
+                    continue
+                # Тема переходит более сильной заявке, нагрузка руководителя не меняется
+                holder[topic_id] = (priority, student_id)
+                heapq.heappush(held[supervisor_id], (_negate(priority), student_id, topic_id))
+                free.append(current[1])
+                break
+
+            capacity = capacities.get(supervisor_id)
+            if capacity is not None and held_count[supervisor_id] >= capacity:
+                heap = held[supervisor_id]
+                _drop_stale(heap, holder)
+                if not heap or _negate(heap[0][0]) <= priority:
+                    continue
+                # Вытесняем самую слабую заявку к этому руководителю
+                _, weakest, weakest_topic = heapq.heappop(heap)
+                del holder[weakest_topic]
+                held_count[supervisor_id] -= 1
+                free.append(weakest)
+
+            holder[topic_id] = (priority, student_id)
+            heapq.heappush(held[supervisor_id], (_negate(priority), student_id, topic_id))
+            held_count[supervisor_id] += 1
+            break
+
+    return {student_id: topic_id for topic_id, (_, student_id) in holder.items()}
+
+
+def _negate(priority):
+    return (-priority[0], -priority[1])
+
+
+def _drop_stale(heap, holder):
+    while heap:
+        _, student_id, topic_id = heap[0]
+        current = holder.get(topic_id)
+        if current is not None and current[1] == student_id:
+            return
+        heapq.heappop(heap)
+
+
+def match_preferences(group_ids=None, seed=None, max_load=None, apply=False, progress=None):
+    """Распределяет свободные темы по предпочтениям студентов без темы.
+
+    При apply=False база не изменяется, возвращается только отчет.
+    """
+    if seed is None:
+        seed = random.SystemRandom().randrange(2 ** 32)
+    timings = {}
+
+    started = time.perf_counter()
+    connection = db.session.connection()
+    query = (
+        select(TopicPreference.student_id, TopicPreference.topic_id, Student.group_id)
+        .join(Student, Student.id == TopicPreference.student_id)
+        .where(Student.topic_id.is_(None), Student.id.not_in(assigned_students()))
+        .order_by(TopicPreference.student_id, TopicPreference.rank)
+    )
+    if group_ids:
+        query = query.where(Student.group_id.in_(group_ids))
+    preferences = defaultdict(list)
+    student_groups = {}
+    for student_id, topic_id, group_id in connection.execute(query):
+        preferences[student_id].append(topic_id)
+        student_groups[student_id] = group_id
+
+    wanted = select(TopicPreference.topic_id)
+    topic_supervisors = dict(connection.execute(
+        select(Topic.id, Topic.supervisor_id)
+        .where(Topic.effective_status_is('free'), Topic.id.in_(wanted))
+    ).all())
+    capacities = {}
+    if max_load is not None:
+        loads = supervisor_loads(connection)
+        capacities = {supervisor_id: max(max_load - loads.get(supervisor_id, 0), 0)
+                      for supervisor_id in set(topic_supervisors.values())}
+    timings['load'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matching = stable_match(preferences, topic_supervisors, capacities, seed)
+    timings['match'] = time.perf_counter() - started
+
+    assigned = 0
+    if apply:
+        started = time.perf_counter()
+        assigned = write_assignments([(topic_id, student_id, student_groups[student_id])
+                                      for student_id, topic_id in matching.items()],
+                                     progress)
+        timings['write'] = time.perf_counter() - started
+
+    ranks = [preferences[student_id].index(topic_id) + 1
+             for student_id, topic_id in matching.items()]
+    return {
+        'students': len(preferences),
+        'matched': len(matching),
+        'assigned': assigned,
+        'unmatched': len(preferences) - len(matching),
+        'first_choice': sum(1 for rank in ranks if rank == 1),
+        'average_rank': round(sum(ranks) / len(ranks), 2) if ranks else None,
+        'applied': apply,
+        'seed': seed,
+        'timings': {phase: round(value, 3) for phase, value in timings.items()}
+    }
@@ -0,0 +1,264 @@
+"""Версионные миграции схемы базы.
+
+Примененные версии записываются в таблицу schema_version. При старте
+читается только номер последней версии: если схема актуальна, структура
+базы не проверяется вовсе. Новая база создается по моделям целиком и сразу
+получает последнюю версию, база без schema_version (созданная до миграций)
+проходит все шаги по порядку - каждый шаг проверяет, нужен ли он.
+
+Изменения данных в больших таблицах выполняются пачками по
+MIGRATION_BATCH_SIZE строк, каждая пачка - отдельной транзакцией, чтобы
+не держать блокировку записи. Индексы на PostgreSQL строятся CONCURRENTLY.
+
+Новая миграция - функция с декоратором @migration(номер, описание),
+номера идут по возрастанию.
+
+    python migrations.py           # применить миграции
+    python migrations.py --status  # показать текущую версию
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import (MetaData, Table, Column, Integer, String, DateTime,
+                        bindparam, func, inspect, insert, select, update, delete)
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from models import db, Student, Topic, TopicReservation, User
+from search import create_fts_index
+from stats import recompute
+
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(function):
+        MIGRATIONS.append((version, description, function))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return function
+    return register
+
+
+def head_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(engine):
+    """Последняя примененная версия или None, если таблицы версий нет"""
+    try:
+        with engine.connect() as connection:
+            return connection.scalar(select(func.max(schema_version.c.version))) or 0
+    except (OperationalError, ProgrammingError):
+        return None
+
+
+def _record(connection, version, description):
+    connection.execute(insert(schema_version).values(
+        version=version, description=description, applied_at=datetime.utcnow()))
+
+
+def upgrade(engine, config):
+    """Приводит схему к последней версии, возвращает список примененных версий"""
+    version = current_version(engine)
+    if version == head_version():
+        return []
+
+    if version is None:
+        schema_version.create(engine, checkfirst=True)
+        if not inspect(engine).has_table(TopicReservation.__tablename__):
+            # Пустая база: создаем все по моделям, шаги миграций не нужны
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                _record(connection, head_version(), 'Создание схемы')
+            print(f"✅ Схема базы создана, версия {head_version()}")
+            return [head_version()]
+        version = 0
+
+    applied = []
+    for number, description, function in MIGRATIONS:
+        if number <= version:
+            continue
+        function(engine, config)
+        with engine.begin() as connection:
+            _record(connection, number, description)
+        applied.append(number)
+        print(f"✅ Миграция {number}: {description}")
+    return applied
+
+
+# === Вспомогательные функции ===
+def column_names(engine, table_name):
+    return {column['name'] for column in inspect(engine).get_columns(table_name)}
+
+
+def add_column(engine, table, column_name):
+    """Добавляет колонку модели, если ее еще нет"""
+    if column_name in column_names(engine, table.name):
+        return False
+    column = table.c[column_name]
+    preparer = engine.dialect.identifier_preparer
+    column_type = column.type.compile(dialect=engine.dialect)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            f'ALTER TABLE {preparer.format_table(table)} '
+            f'ADD COLUMN {preparer.format_column(column)} {column_type}')
+    return True
+
+
+def batched_ids(engine, query, batch_size):
+    """Пачки id из query; query должен перестать возвращать строку после ее обработки"""
+    while True:
+        with engine.connect() as connection:
+            ids = connection.scalars(query.limit(batch_size)).all()
+        if not ids:
+            return
+        yield ids
+
+
+def create_index(engine, index):
+    """Создает индекс, если его нет; на PostgreSQL - без блокировки записи"""
+    if engine.dialect.name == 'postgresql':
+        options = index.dialect_options['postgresql']
+        options['concurrently'] = True
+        try:
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                index.create(connection, checkfirst=True)
+        finally:
+            options['concurrently'] = False
+    else:
+        with engine.begin() as connection:
+            index.create(connection, checkfirst=True)
+
+
+# === Миграции ===
+@migration(1, 'Создание недостающих таблиц')
+def create_missing_tables(engine, config):
+    db.metadata.create_all(engine, checkfirst=True)
+
+
+@migration(2, 'Колонка user.student_id')
+def add_user_student_id(engine, config):
+    add_column(engine, User.__table__, 'student_id')
+
+
+@migration(3, 'Колонка topic_reservation.expires_at')
+def add_reservation_expires_at(engine, config):
+    table = TopicReservation.__table__
+    add_column(engine, table, 'expires_at')
+
+    # Старые резервации получают срок по их времени начала
+    timeout = timedelta(seconds=config['RESERVATION_TIMEOUT'])
+    now = datetime.utcnow()
+    query = select(table.c.id).where(table.c.expires_at.is_(None)).order_by(table.c.id)
+    statement = (update(table).where(table.c.id == bindparam('b_id'))
+                 .values(expires_at=bindparam('b_expires_at')))
+    for ids in batched_ids(engine, query, config['MIGRATION_BATCH_SIZE']):
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(table.c.id, table.c.reserved_at).where(table.c.id.in_(ids))).all()
+            connection.execute(statement, [
+                {'b_id': reservation_id, 'b_expires_at': (reserved_at or now) + timeout}
+                for reservation_id, reserved_at in rows])
+
+
+@migration(4, 'Индексы горячих запросов и уникальная резервация темы')
+def create_indexes(engine, config):
+    table = TopicReservation.__table__
+    # Для уникального индекса по topic_id оставляем у темы только последнюю резервацию
+    duplicates = (select(table.c.topic_id).group_by(table.c.topic_id)
+                  .having(func.count() > 1).order_by(table.c.topic_id))
+    for topic_ids in batched_ids(engine, duplicates, config['MIGRATION_BATCH_SIZE']):
+        latest = (select(func.max(table.c.id)).where(table.c.topic_id.in_(topic_ids))
+                  .group_by(table.c.topic_id))
+        with engine.begin() as connection:
+            connection.execute(delete(table).where(table.c.topic_id.in_(topic_ids),
+                                                   table.c.id.not_in(latest)))
+
+    for model_table in db.metadata.tables.values():
+        for index in model_table.indexes:
+            create_index(engine, index)
+
+
+@migration(5, 'Таблица фоновых задач job')
+def create_job_table(engine, config):
+    db.metadata.tables['job'].create(engine, checkfirst=True)
+
+
+@migration(6, 'Полнотекстовый индекс названий тем')
+def create_topic_search_index(engine, config):
+    with engine.begin() as connection:
+        create_fts_index(connection, rebuild=True)
+
+
+@migration(7, 'Сводные счетчики статистики summary_counter')
+def create_summary_counters(engine, config):
+    db.metadata.tables['summary_counter'].create(engine, checkfirst=True)
+    with engine.begin() as connection:
+        recompute(connection)
+
+
+@migration(8, 'Заполнение student.topic_id по назначенным темам')
+def backfill_student_topic_id(engine, config):
+    topic, student = Topic.__table__, Student.__table__
+    # Назначения старых версий записаны только в topic.student_id
+    conflicts = (
+        select(topic.c.student_id.distinct())
+        .join(student, student.c.id == topic.c.student_id)
+        .where((student.c.topic_id.is_(None)) | (student.c.topic_id != topic.c.id))
+        .order_by(topic.c.student_id)
+    )
+    for ids in batched_ids(engine, conflicts, config['MIGRATION_BATCH_SIZE']):
+        with engine.begin() as connection:
+            current = dict(connection.execute(
+                select(student.c.id, student.c.topic_id).where(student.c.id.in_(ids))).all())
+            held = {}
+            for topic_id, student_id in connection.execute(
+                    select(topic.c.id, topic.c.student_id)
+                    .where(topic.c.student_id.in_(ids)).order_by(topic.c.id)):
+                held.setdefault(student_id, []).append(topic_id)
+
+            kept, released = {}, []
+            for student_id, topic_ids in held.items():
+                # У студента остается тема из student.topic_id, иначе первая по id
+                keep = current[student_id] if current[student_id] in topic_ids else topic_ids[0]
+                kept[student_id] = keep
+                released += [topic_id for topic_id in topic_ids if topic_id != keep]
+
+            connection.execute(
+                update(student).where(student.c.id == bindparam('b_id'))
+                .values(topic_id=bindparam('b_topic_id')),
+                [{'b_id': student_id, 'b_topic_id': topic_id}
+                 for student_id, topic_id in kept.items()])
+            if released:
+                # Лишние темы студента снова становятся свободными
+                connection.execute(
+                    update(topic).where(topic.c.id.in_(released))
+                    .values(status='free', student_id=None, group_id=None,
+                            reserved_at=None, reserved_by=None))
+                connection.execute(delete(TopicReservation.__table__)
+                                   .where(TopicReservation.__table__.c.topic_id.in_(released)))
+                print(f"❌ Студенты с несколькими темами: освобождено тем {len(released)}")
+
+    with engine.begin() as connection:
+        recompute(connection)
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Миграции схемы базы')
+    parser.add_argument('--status', action='store_true', help='показать версию и выйти')
+    args = parser.parse_args()
+
+    with app.app_context():
+        version = current_version(db.engine)
+        print(f"Версия схемы: {version if version is not None else 'нет'}, последняя: {head_version()}")
+        if not args.status:
+            applied = upgrade(db.engine, app.config)
+            print(f"✅ Применено миграций: {len(applied)}" if applied else "✅ Схема актуальна")
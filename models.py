@@ -1,20 +1,34 @@
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, case
+from sqlalchemy.ext.hybrid import hybrid_property
+from werkzeug.security import check_password_hash
+from passwords import hash_password
 
 db = SQLAlchemy()
 
+DEFAULT_RESERVATION_TIMEOUT = 1800
+
+
+def reservation_cutoff(now=None):
+    """Резервации, начатые не позже этого момента, считаются истекшими"""
+    timeout = DEFAULT_RESERVATION_TIMEOUT
+    if has_app_context():
+        timeout = current_app.config.get('RESERVATION_TIMEOUT', timeout)
+    return (now or datetime.utcnow()) - timedelta(seconds=timeout)
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(120), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # 'admin', 'headman', 'student'
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'))
-    student_id = db.Column(db.Integer, db.ForeignKey('student.id'))  # Новая связь со студентом
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), index=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), index=True)  # Новая связь со студентом
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -30,9 +44,13 @@ class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     full_name = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(20))
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
-    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False, index=True)
+    # student и topic ссылаются друг на друга, поэтому внешний ключ создается
+    # отдельным ALTER TABLE после обеих таблиц
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id', use_alter=True, name='fk_student_topic_id'),
+                         nullable=True, index=True)
     user = db.relationship('User', backref='student_ref', uselist=False)  # Обратная связь
+    topic = db.relationship('Topic', foreign_keys=[topic_id])  # Назначенная тема
 
 class Supervisor(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -47,27 +65,108 @@ class WorkType(db.Model):
     topics = db.relationship('Topic', backref='work_type', lazy=True)
 
 class Topic(db.Model):
+    __table_args__ = (
+        # Выборка свободных тем нужного типа в панели старосты
+        db.Index('ix_topic_status_work_type', 'status', 'work_type_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.Text, nullable=False)
     status = db.Column(db.String(20), default='free')  # 'free', 'reserved', 'assigned'
-    supervisor_id = db.Column(db.Integer, db.ForeignKey('supervisor.id'), nullable=False)
-    work_type_id = db.Column(db.Integer, db.ForeignKey('work_type.id'), nullable=False)
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True)
-    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=True)
+    supervisor_id = db.Column(db.Integer, db.ForeignKey('supervisor.id'), nullable=False, index=True)
+    work_type_id = db.Column(db.Integer, db.ForeignKey('work_type.id'), nullable=False, index=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True, index=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=True, index=True)
     reserved_at = db.Column(db.DateTime)
-    reserved_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    reserved_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
     
     # Явно указываем связь с student
     student = db.relationship('Student', backref='assigned_topic', foreign_keys=[student_id])
 
+    @hybrid_property
+    def effective_status(self):
+        """Статус с учетом истечения резервации: просроченная резервация
+        считается свободной темой, не дожидаясь фоновой очистки"""
+        if (self.status == 'reserved' and self.reserved_at is not None
+                and self.reserved_at <= reservation_cutoff()):
+            return 'free'
+        return self.status
+
+    @effective_status.expression
+    def effective_status(cls):
+        return case(
+            (and_(cls.status == 'reserved', cls.reserved_at <= reservation_cutoff()), 'free'),
+            else_=cls.status
+        )
+
+    @classmethod
+    def effective_status_is(cls, status):
+        """Условие на effective_status, которое может использовать индекс по status"""
+        cutoff = reservation_cutoff()
+        if status == 'free':
+            return or_(cls.status == 'free',
+                       and_(cls.status == 'reserved', cls.reserved_at <= cutoff))
+        if status == 'reserved':
+            return and_(cls.status == 'reserved',
+                        or_(cls.reserved_at.is_(None), cls.reserved_at > cutoff))
+        return cls.status == status
+
 class TopicReservation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=False)
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
-    reserved_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # У темы может быть только одна резервация
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=False, unique=True, index=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False, index=True)
+    reserved_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     reserved_at = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
     
     topic = db.relationship('Topic', backref='reservations')
     group = db.relationship('Group')
-    user = db.relationship('User')
\ No newline at end of file
+    user = db.relationship('User')
+
+    @hybrid_property
+    def is_active(self):
+        return self.expires_at > datetime.utcnow()
+
+    @is_active.expression
+    def is_active(cls):
+        return cls.expires_at > datetime.utcnow()
+
+class TopicPreference(db.Model):
+    """Место темы в списке пожеланий студента (rank=1 - самая желанная)"""
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'topic_id'),
+        db.UniqueConstraint('student_id', 'rank'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=False, index=True)
+    rank = db.Column(db.Integer, nullable=False)
+
+    student = db.relationship('Student', backref=db.backref('preferences', order_by='TopicPreference.rank'))
+    topic = db.relationship('Topic')
+
+class Job(db.Model):
+    """Фоновая задача администратора: загрузка, распределение, выгрузка"""
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)  # 'pending', 'running', 'done', 'failed', 'cancelled'
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class SummaryCounter(db.Model):
+    """Сводный счетчик статистики: раздел (тип работы, руководитель, группа),
+    id в разделе и название счетчика; обновляется модулем stats"""
+    scope = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.Integer, primary_key=True)
+    metric = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,129 @@
+"""Хэширование и проверка паролей.
+
+Схема и стоимость хэша задаются PASSWORD_HASH_METHOD в формате Werkzeug
+(например 'scrypt:32768:8:1' или 'pbkdf2:sha256:600000'). Пароль с хэшем
+по старым параметрам пересчитывается при успешном входе.
+
+Проверка пароля нагружает процессор, поэтому выполняется в ограниченном
+пуле потоков (hashlib отпускает GIL на время вычисления): одновременно
+считается не больше PASSWORD_WORKERS хэшей, еще PASSWORD_QUEUE_LIMIT
+запросов ждут в очереди, остальные сразу получают отказ, а не
+растягивают время ответа всем остальным.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class VerifierBusy(Exception):
+    """Очередь проверки паролей переполнена"""
+
+
+def hash_method():
+    if has_app_context():
+        return current_app.config['PASSWORD_HASH_METHOD']
+    return None
+
+
+def hash_password(password, method=None):
+    method = method or hash_method()
+    if method:
+        return generate_password_hash(password, method=method)
+    return generate_password_hash(password)
+
+
+def method_prefix(method):
+    """Параметры хэша в том виде, в каком Werkzeug пишет их перед солью"""
+    return hash_password('', method).split('$', 1)[0]
+
+
+class PasswordVerifier:
+    def __init__(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.prefix = method_prefix(self.method)
+        self.workers = app.config['PASSWORD_WORKERS'] or os.cpu_count() or 1
+        self.queue_limit = app.config['PASSWORD_QUEUE_LIMIT']
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix='password')
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_limit)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.max_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self._waits = deque(maxlen=1000)
+        self._durations = deque(maxlen=1000)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.prefix
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise VerifierBusy()
+        submitted = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+            self.max_pending = max(self.max_pending, self._pending)
+
+        def task():
+            started = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self._waits.append(started - submitted)
+                    self._durations.append(finished - started)
+
+        try:
+            return self._executor.submit(task).result()
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._pending -= 1
+                self.completed += 1
+
+    def verify(self, user, password):
+        """Проверяет пароль пользователя; при устаревших параметрах хэша
+        пересчитывает его (изменение нужно сохранить commit)"""
+        if not self._run(check_password_hash, user.password_hash, password):
+            return False
+        if self.needs_rehash(user.password_hash):
+            user.password_hash = self._run(hash_password, password, self.method)
+            with self._lock:
+                self.rehashed += 1
+        return True
+
+    def stats(self):
+        def percentile(values, fraction):
+            if not values:
+                return 0.0
+            ordered = sorted(values)
+            return round(ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1000, 1)
+
+        with self._lock:
+            waits = list(self._waits)
+            durations = list(self._durations)
+            return {
+                'method': self.method,
+                'workers': self.workers,
+                'queue_limit': self.queue_limit,
+                'queue_depth': max(self._pending - self.workers, 0),
+                'in_flight': min(self._pending, self.workers),
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'rehashed': self.rehashed,
+                'wait_p50_ms': percentile(waits, 0.5),
+                'wait_p99_ms': percentile(waits, 0.99),
+                'hash_p50_ms': percentile(durations, 0.5),
+                'hash_p99_ms': percentile(durations, 0.99)
+            }
@@ -0,0 +1,192 @@
+"""Профилирование запросов к базе по HTTP-запросам.
+
+События движка SQLAlchemy замеряют каждый SQL-запрос, хуки Flask и сигналы
+шаблонов - время обработки и отрисовки. Итоги выбранных запросов (доля
+PROFILER_SAMPLE_RATE) попадают в скользящую статистику по маршрутам, а при
+PROFILER_HEADERS еще и в заголовки ответа X-DB-Queries, X-DB-Time-Ms,
+X-Render-Time-Ms и Server-Timing. Запросы к базе дольше
+SLOW_QUERY_THRESHOLD_MS пишутся в журнал медленных запросов всегда,
+независимо от выборки.
+"""
+import heapq
+import logging
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+
+slow_query_logger = logging.getLogger('thesis.slow_queries')
+
+
+def _statement_text(statement, limit=500):
+    text = ' '.join(statement.split())
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class QueryProfiler:
+    def __init__(self, app, db):
+        self.app = app
+        config = app.config
+        self.enabled = config['PROFILER_ENABLED']
+        self.sample_rate = config['PROFILER_SAMPLE_RATE']
+        self.headers = config['PROFILER_HEADERS']
+        self.slow_threshold = config['SLOW_QUERY_THRESHOLD_MS'] / 1000
+        self.top_statements = config['PROFILER_TOP_STATEMENTS']
+        self.window = config['PROFILER_WINDOW']
+        self._lock = threading.Lock()
+        self.reset()
+
+        if config.get('SLOW_QUERY_LOG'):
+            handler = logging.FileHandler(config['SLOW_QUERY_LOG'], encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            slow_query_logger.addHandler(handler)
+            slow_query_logger.setLevel(logging.WARNING)
+
+        if not self.enabled:
+            return
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(db.engine, 'handle_error', self._handle_error)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+
+    def reset(self):
+        with self._lock:
+            self._requests = defaultdict(lambda: deque(maxlen=self.window))
+            self._slowest = defaultdict(list)  # маршрут -> куча (время, запрос)
+            self._slow_queries = deque(maxlen=100)
+            self.sampled = 0
+            self.statements = 0
+            self.started_at = datetime.utcnow()
+
+    # === События движка ===
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['profiler_started'].pop()
+        profile = g.get('profile') if has_request_context() else None
+        if profile is not None:
+            profile['queries'] += 1
+            profile['db_time'] += elapsed
+            statements = profile['statements']
+            item = (elapsed, statement)
+            if len(statements) < self.top_statements:
+                heapq.heappush(statements, item)
+            elif elapsed > statements[0][0]:
+                heapq.heapreplace(statements, item)
+
+        if elapsed >= self.slow_threshold:
+            endpoint = request.endpoint if has_request_context() else None
+            text = _statement_text(statement)
+            with self._lock:
+                self._slow_queries.append({
+                    'at': datetime.utcnow().isoformat(),
+                    'endpoint': endpoint,
+                    'ms': round(elapsed * 1000, 1),
+                    'statement': text
+                })
+            slow_query_logger.warning('%.1f мс [%s] %s', elapsed * 1000, endpoint, text)
+
+    def _handle_error(self, context):
+        started = context.connection.info.get('profiler_started') if context.connection else None
+        if started:
+            started.pop()
+
+    # === Хуки Flask ===
+    def _before_request(self):
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            g.profile = {
+                'started': time.perf_counter(),
+                'queries': 0,
+                'db_time': 0.0,
+                'render_time': 0.0,
+                'render_started': None,
+                'statements': []
+            }
+
+    def _before_render(self, sender, template, context, **extra):
+        profile = g.get('profile')
+        if profile is not None:
+            profile['render_started'] = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        profile = g.get('profile')
+        if profile is not None and profile['render_started'] is not None:
+            profile['render_time'] += time.perf_counter() - profile['render_started']
+            profile['render_started'] = None
+
+    def _after_request(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+
+        total = time.perf_counter() - profile['started']
+        db_ms = profile['db_time'] * 1000
+        render_ms = profile['render_time'] * 1000
+        if self.headers:
+            response.headers['X-DB-Queries'] = str(profile['queries'])
+            response.headers['X-DB-Time-Ms'] = f'{db_ms:.1f}'
+            response.headers['X-Render-Time-Ms'] = f'{render_ms:.1f}'
+            response.headers['Server-Timing'] = (
+                f'db;dur={db_ms:.1f}, render;dur={render_ms:.1f}, total;dur={total * 1000:.1f}')
+
+        endpoint = request.endpoint or request.path
+        with self._lock:
+            self.sampled += 1
+            self.statements += profile['queries']
+            self._requests[endpoint].append(
+                (profile['queries'], profile['db_time'], profile['render_time'], total))
+            slowest = self._slowest[endpoint]
+            for item in profile['statements']:
+                if len(slowest) < self.top_statements:
+                    heapq.heappush(slowest, item)
+                elif item[0] > slowest[0][0]:
+                    heapq.heapreplace(slowest, item)
+        return response
+
+    # === Статистика ===
+    def stats(self):
+        """Сводка по маршрутам за последние PROFILER_WINDOW выбранных запросов"""
+        with self._lock:
+            endpoints = {}
+            for endpoint, samples in self._requests.items():
+                queries = [sample[0] for sample in samples]
+                db_times = [sample[1] for sample in samples]
+                totals = [sample[3] for sample in samples]
+                endpoints[endpoint] = {
+                    'requests': len(samples),
+                    'avg_queries': round(sum(queries) / len(samples), 1),
+                    'max_queries': max(queries),
+                    'avg_db_ms': round(sum(db_times) / len(samples) * 1000, 2),
+                    'avg_render_ms': round(sum(sample[2] for sample in samples) / len(samples) * 1000, 2),
+                    'avg_total_ms': round(sum(totals) / len(samples) * 1000, 2),
+                    'p95_total_ms': round(_percentile(totals, 0.95) * 1000, 2),
+                    'slowest_statements': [
+                        {'ms': round(elapsed * 1000, 2), 'statement': _statement_text(statement)}
+                        for elapsed, statement in sorted(self._slowest[endpoint], reverse=True)]
+                }
+            return {
+                'enabled': self.enabled,
+                'sample_rate': self.sample_rate,
+                'slow_query_threshold_ms': self.slow_threshold * 1000,
+                'since': self.started_at.isoformat(),
+                'sampled_requests': self.sampled,
+                'statements': self.statements,
+                'endpoints': dict(sorted(endpoints.items(),
+                                         key=lambda item: item[1]['avg_queries'], reverse=True)),
+                'slow_queries': list(self._slow_queries)
+            }
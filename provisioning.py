@@ -0,0 +1,200 @@
+"""Массовое создание учетных записей студентов.
+
+Для каждого студента без пользователя создается User с ролью student,
+логином student<id> (student<id>_2 и т.д., если логин уже занят) и
+случайным паролем. Хэши считаются параллельно в
+нескольких процессах, строки вставляются пачками, а логины и пароли
+записываются в CSV-файл в EXPORT_FOLDER для раздачи студентам.
+
+Пароли случайные и длинные, поэтому для них достаточно быстрой схемы
+PROVISION_HASH_METHOD; при первом входе хэш пересчитывается по основной
+схеме PASSWORD_HASH_METHOD.
+
+    python provisioning.py               # все студенты без учетной записи
+    python provisioning.py --group 3 5   # только указанные группы
+"""
+import csv
+import multiprocessing
+import os
+import secrets
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
+
+from sqlalchemy import insert, select
+
+from importers import chunked
+from models import db, Group, Student, User
+from passwords import hash_password
+
+# Без похожих символов (0/O, 1/l/I), чтобы пароль было легко переписать
+PASSWORD_ALPHABET = 'abcdefghjkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+PASSWORD_LENGTH = 12
+HASH_CHUNK_SIZE = 500
+CREDENTIALS_HEADER = ['Группа', 'Студент', 'Логин', 'Пароль']
+
+
+def generate_password(length=PASSWORD_LENGTH):
+    return ''.join(secrets.choice(PASSWORD_ALPHABET) for _ in range(length))
+
+
+def student_username(student_id, taken=frozenset()):
+    """Логин student<id>; если он занят (например, созданной вручную
+    записью), добавляется суффикс: student<id>_2, student<id>_3..."""
+    username = base = f'student{student_id}'
+    suffix = 2
+    while username in taken:
+        username = f'{base}_{suffix}'
+        suffix += 1
+    return username
+
+
+def _hash_chunk(passwords, method):
+    return [hash_password(password, method) for password in passwords]
+
+
+def _pool_context():
+    # Задача выполняется в потоке многопоточного сервера: fork скопировал бы
+    # захваченные другими потоками блокировки и соединения пула базы, и
+    # дочерний процесс мог бы зависнуть. forkserver запускает процессы из
+    # отдельного однопоточного процесса, на Windows есть только spawn.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def hash_passwords(passwords, method, processes=None, progress=None):
+    """Хэши паролей в том же порядке; при нескольких ядрах - в пуле процессов.
+    progress(готово) вызывается после каждой пачки."""
+    processes = processes or os.cpu_count() or 1
+    chunks = list(chunked(passwords, HASH_CHUNK_SIZE))
+    if processes == 1 or len(chunks) <= 1:
+        return _collect((_hash_chunk(chunk, method) for chunk in chunks), progress)
+    with ProcessPoolExecutor(max_workers=min(processes, len(chunks)),
+                             mp_context=_pool_context()) as pool:
+        try:
+            return _collect(pool.map(_hash_chunk, chunks, repeat(method)), progress)
+        except BaseException:
+            # Прерванная задача не ждет хэширования оставшихся пачек
+            pool.shutdown(cancel_futures=True)
+            raise
+
+
+def _collect(results, progress):
+    hashes = []
+    for result in results:
+        hashes.extend(result)
+        if progress:
+            progress(len(hashes))
+    return hashes
+
+
+def credentials_filename():
+    return f"credentials_{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:6]}.csv"
+
+
+def write_credentials(path, rows):
+    # Файл с паролями доступен только владельцу
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with open(descriptor, 'w', encoding='utf-8-sig', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(CREDENTIALS_HEADER)
+        writer.writerows(rows)
+
+
+def provision_students(folder, config, group_ids=None, progress=None):
+    """Создает учетные записи студентам без пользователя.
+    Возвращает отчет с числом созданных записей и именем файла с паролями.
+    progress(готово, всего) вызывается по ходу хэширования паролей."""
+    timings = {}
+
+    started = time.perf_counter()
+    query = (
+        select(Student.id, Student.full_name, Student.group_id, Group.name)
+        .join(Group, Group.id == Student.group_id)
+        .outerjoin(User, User.student_id == Student.id)
+        .where(User.id.is_(None))
+        .order_by(Group.name, Student.full_name)
+    )
+    if group_ids:
+        query = query.where(Student.group_id.in_(group_ids))
+    students = db.session.execute(query).all()
+    taken = set(db.session.scalars(select(User.username).where(User.username.like('student%'))))
+    usernames = []
+    renamed = []
+    for student in students:
+        username = student_username(student.id, taken)
+        taken.add(username)
+        usernames.append(username)
+        if username != student_username(student.id):
+            renamed.append({'student_id': student.id, 'full_name': student.full_name,
+                            'username': username})
+    timings['load'] = time.perf_counter() - started
+
+    if not students:
+        return {'created': 0, 'file': None, 'renamed': [], 'timings': {}}
+
+    started = time.perf_counter()
+    passwords = [generate_password() for _ in students]
+    hashes = hash_passwords(passwords, config['PROVISION_HASH_METHOD'],
+                            config['PROVISION_PROCESSES'],
+                            progress and (lambda done: progress(done, len(passwords))))
+    timings['hash'] = time.perf_counter() - started
+
+    # Файл пишется до вставки: учетные записи не должны появиться без паролей
+    started = time.perf_counter()
+    os.makedirs(folder, exist_ok=True)
+    filename = credentials_filename()
+    path = os.path.join(folder, filename)
+    write_credentials(path, [
+        (student.name, student.full_name, username, password)
+        for student, username, password in zip(students, usernames, passwords)])
+    timings['file'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rows = [{
+        'username': username,
+        'password_hash': password_hash,
+        'role': 'student',
+        'group_id': student.group_id,
+        'student_id': student.id
+    } for student, username, password_hash in zip(students, usernames, hashes)]
+    try:
+        for batch in chunked(rows, config['IMPORT_BATCH_SIZE']):
+            db.session.execute(insert(User), batch)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        os.remove(path)
+        raise
+    timings['insert'] = time.perf_counter() - started
+
+    return {
+        'created': len(rows),
+        'file': filename,
+        # Студенты, чей логин student<id> уже был занят другой записью
+        'renamed': renamed,
+        'timings': {phase: round(value, 3) for phase, value in timings.items()}
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Учетные записи для студентов без пользователя')
+    parser.add_argument('--group', type=int, nargs='*', help='id групп')
+    args = parser.parse_args()
+
+    with app.app_context():
+        folder = os.path.join(app.root_path, app.config['EXPORT_FOLDER'])
+        report = provision_students(folder, app.config, args.group)
+    if report['created']:
+        print(f"✅ Создано учетных записей: {report['created']}, время: {report['timings']}")
+        print(f"✅ Логины и пароли: {os.path.join(folder, report['file'])}")
+        for item in report['renamed']:
+            print(f"❌ Логин student{item['student_id']} занят, {item['full_name']} "
+                  f"получил логин {item['username']}")
+    else:
+        print("✅ Все студенты уже имеют учетные записи")
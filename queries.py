@@ -0,0 +1,130 @@
+"""Запросы для таблиц панелей: фильтры, постраничный вывод, сериализация"""
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+
+from models import db, Student, Topic
+from search import apply_search
+
+STUDENT_STATUSES = ('assigned', 'unassigned')
+TOPIC_STATUSES = ('free', 'reserved', 'assigned')
+
+
+def parse_int(value):
+    """Число из параметра запроса или None"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def page_args(args, default_per_page, max_per_page):
+    """Номер страницы и размер страницы из параметров запроса"""
+    page = max(parse_int(args.get('page')) or 1, 1)
+    per_page = parse_int(args.get('per_page')) or default_per_page
+    return page, min(max(per_page, 1), max_per_page)
+
+
+def student_filters(args, prefix=''):
+    """Фильтры таблицы студентов; prefix позволяет держать на одной странице
+    фильтры нескольких таблиц"""
+    status = args.get(prefix + 'status')
+    return {
+        'group_id': parse_int(args.get(prefix + 'group_id')),
+        'work_type_id': parse_int(args.get(prefix + 'work_type_id')),
+        'status': status if status in STUDENT_STATUSES else None
+    }
+
+
+def topic_filters(args, prefix=''):
+    """Фильтры таблицы тем"""
+    status = args.get(prefix + 'status')
+    return {
+        'group_id': parse_int(args.get(prefix + 'group_id')),
+        'work_type_id': parse_int(args.get(prefix + 'work_type_id')),
+        'status': status if status in TOPIC_STATUSES else None,
+        'search': (args.get(prefix + 'q') or '').strip() or None
+    }
+
+
+def students_query(group_id=None, work_type_id=None, status=None):
+    """Студенты с группой и темой, загруженными одним запросом"""
+    query = Student.query.options(
+        joinedload(Student.group),
+        joinedload(Student.topic)
+    )
+    if group_id:
+        query = query.filter(Student.group_id == group_id)
+    if status == 'assigned':
+        query = query.filter(Student.topic_id.isnot(None))
+    elif status == 'unassigned':
+        query = query.filter(Student.topic_id.is_(None))
+    if work_type_id:
+        query = query.filter(Student.topic.has(Topic.work_type_id == work_type_id))
+    return query.order_by(Student.id)
+
+
+def topics_query(group_id=None, work_type_id=None, status=None, search=None):
+    """Темы с руководителем и типом работы, загруженными одним запросом;
+    с поиском - в порядке релевантности"""
+    query = Topic.query.options(
+        joinedload(Topic.supervisor),
+        joinedload(Topic.work_type)
+    )
+    if group_id:
+        query = query.filter(Topic.group_id == group_id)
+    if status:
+        query = query.filter(Topic.effective_status_is(status))
+    if work_type_id:
+        query = query.filter(Topic.work_type_id == work_type_id)
+    return apply_search(query.order_by(Topic.id), db.session.connection(), search)
+
+
+def available_topics_query(group_id, work_type_id=None, search=None):
+    """Темы, доступные старосте группы: свободные и зарезервированные этой группой"""
+    query = Topic.query.options(
+        joinedload(Topic.supervisor),
+        joinedload(Topic.work_type)
+    ).filter(or_(
+        Topic.effective_status_is('free'),
+        and_(Topic.effective_status_is('reserved'), Topic.group_id == group_id)
+    ))
+    if work_type_id:
+        query = query.filter(Topic.work_type_id == work_type_id)
+    return apply_search(query.order_by(Topic.id), db.session.connection(), search)
+
+
+def paginate(query, page, per_page):
+    return query.paginate(page=page, per_page=per_page, error_out=False)
+
+
+def serialize_student(student):
+    return {
+        'id': student.id,
+        'full_name': student.full_name,
+        'group': student.group.name,
+        'phone': student.phone,
+        'topic_id': student.topic_id,
+        'topic_title': student.topic.title if student.topic else None
+    }
+
+
+def serialize_topic(topic):
+    return {
+        'id': topic.id,
+        'title': topic.title,
+        'status': topic.effective_status,
+        'supervisor': topic.supervisor.full_name,
+        'work_type': topic.work_type.name,
+        'subject': topic.work_type.subject,
+        'group_id': topic.group_id
+    }
+
+
+def serialize_page(pagination, serializer):
+    return {
+        'items': [serializer(item) for item in pagination.items],
+        'page': pagination.page,
+        'per_page': pagination.per_page,
+        'pages': pagination.pages,
+        'total': pagination.total
+    }
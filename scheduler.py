@@ -0,0 +1,160 @@
+"""Планировщик снятия просроченных резерваций.
+
+Вместо опроса таблицы раз в минуту держим в памяти кучу (min-heap) сроков
+окончания резерваций и спим ровно до ближайшего из них. При старте куча
+строится по базе, новые резервации добавляются в нее из reserve_topic.
+"""
+import heapq
+import threading
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import select, update, delete
+
+import stats
+from models import db, Topic, TopicReservation
+
+
+class ExpiryScheduler:
+    def __init__(self, app, resync_interval=300, events=None):
+        self.app = app
+        # Брокер событий: снятые резервации рассылаются открытым вкладкам
+        self.events = events
+        # Раз в resync_interval секунд куча перестраивается по базе, чтобы
+        # подхватить резервации, созданные другими процессами
+        self.resync_interval = resync_interval
+        self._heap = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.released_total = 0
+        self.wakeups = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._lag_sum = 0.0
+
+    def rebuild(self):
+        """Строит кучу по активным резервациям из базы"""
+        with self.app.app_context():
+            try:
+                rows = db.session.execute(
+                    select(TopicReservation.expires_at, TopicReservation.topic_id)
+                ).all()
+            except Exception as e:
+                print(f"❌ Ошибка при загрузке резерваций: {e}")
+                return
+        with self._condition:
+            self._heap = [(expires_at, topic_id) for expires_at, topic_id in rows]
+            heapq.heapify(self._heap)
+            self._condition.notify()
+
+    def schedule(self, topic_id, expires_at):
+        """Добавляет срок окончания новой резервации"""
+        with self._condition:
+            heapq.heappush(self._heap, (expires_at, topic_id))
+            if self._heap[0][1] == topic_id:
+                # Новый срок раньше всех остальных - будим поток
+                self._condition.notify()
+
+    def release_expired(self, now=None):
+        """Снимает все просроченные резервации одной транзакцией, возвращает их число"""
+        now = now or datetime.utcnow()
+        with self.app.app_context():
+            try:
+                expired = db.session.execute(
+                    select(TopicReservation.topic_id, TopicReservation.expires_at)
+                    .where(TopicReservation.expires_at <= now)
+                ).all()
+                if not expired:
+                    return 0
+
+                expired_topics = select(TopicReservation.topic_id).where(
+                    TopicReservation.expires_at <= now)
+                released = db.session.execute(
+                    update(Topic)
+                    .where(Topic.status == 'reserved', Topic.id.in_(expired_topics))
+                    .values(status='free', group_id=None, reserved_at=None, reserved_by=None)
+                    .returning(Topic.work_type_id, Topic.supervisor_id)
+                    .execution_options(synchronize_session=False)
+                ).all()
+                deltas = Counter()
+                for (work_type_id, supervisor_id), count in Counter(released).items():
+                    deltas.update(stats.topic_moved(work_type_id, supervisor_id,
+                                                    'reserved', 'free', count))
+                stats.apply(db.session.connection(), deltas)
+                db.session.execute(
+                    delete(TopicReservation)
+                    .where(TopicReservation.expires_at <= now)
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Ошибка при очистке резерваций: {e}")
+                return 0
+
+        released_at = datetime.utcnow()
+        lags = [(released_at - expires_at).total_seconds() for _, expires_at in expired]
+        with self._lock:
+            self.released_total += len(expired)
+            self.last_lag = max(lags)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self._lag_sum += sum(lags)
+        if self.events is not None:
+            self.events.publish('expired', topic_ids=[topic_id for topic_id, _ in expired])
+        print(f"✅ Снято просроченных резерваций: {len(expired)}")
+        return len(expired)
+
+    def _next_timeout(self, now):
+        if not self._heap:
+            return self.resync_interval
+        delay = (self._heap[0][0] - now).total_seconds()
+        return max(0.0, min(delay, self.resync_interval))
+
+    def _run(self):
+        self.rebuild()
+        last_resync = datetime.utcnow()
+        while True:
+            with self._condition:
+                timeout = self._next_timeout(datetime.utcnow())
+                if timeout > 0:
+                    self._condition.wait(timeout)
+
+                now = datetime.utcnow()
+                due = False
+                while self._heap and self._heap[0][0] <= now:
+                    heapq.heappop(self._heap)
+                    due = True
+
+            self.wakeups += 1
+            if due:
+                self.release_expired(now)
+            if (now - last_resync).total_seconds() >= self.resync_interval:
+                self.release_expired(now)
+                self.rebuild()
+                last_resync = now
+
+    def start(self):
+        """Запускает фоновый поток планировщика"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='reservation-expiry')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stats(self):
+        """Метрики: размер кучи, ближайший срок, задержка снятия резерваций"""
+        with self._condition:
+            pending = len(self._heap)
+            next_expiry = self._heap[0][0].isoformat() if self._heap else None
+        with self._lock:
+            return {
+                'pending': pending,
+                'next_expiry': next_expiry,
+                'released_total': self.released_total,
+                'wakeups': self.wakeups,
+                'last_lag_seconds': round(self.last_lag, 3),
+                'max_lag_seconds': round(self.max_lag, 3),
+                'avg_lag_seconds': round(self._lag_sum / self.released_total, 3)
+                if self.released_total else 0.0
+            }
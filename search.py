@@ -0,0 +1,176 @@
+"""Полнотекстовый поиск тем и поиск похожих названий при загрузке.
+
+На SQLite названия тем индексируются таблицей FTS5 topic_fts, которую
+триггеры обновляют при вставке, удалении и изменении названия темы, так
+что поиск не читает таблицу topic целиком. Каждое слово запроса ищется
+по началу слова ("инфор" найдет "информационной"), результаты
+упорядочиваются по bm25. Индекс хранит названия с заменой ё на е:
+токенизатор unicode61 не снимает диакритику с кириллицы. Без FTS5
+(например, на PostgreSQL) поиск сводится к ILIKE по каждому слову.
+
+Похожие названия при загрузке ищутся среди тем того же руководителя и
+строк того же файла по сходству множеств триграмм.
+"""
+import re
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import (Column, Integer, MetaData, Table, Text, and_, event, func,
+                        literal_column, select, text)
+
+from models import Topic
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TERMS = 8
+MIN_PREFIX_LENGTH = 2
+
+topic_fts = Table(
+    'topic_fts', MetaData(),
+    Column('rowid', Integer, primary_key=True),
+    Column('title', Text)
+)
+
+
+def _normalized(column):
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+FTS_DDL = [
+    # Таблица без собственной копии названий: найденные id соединяются с topic
+    "CREATE VIRTUAL TABLE IF NOT EXISTS topic_fts USING fts5("
+    "title, content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS topic_fts_insert AFTER INSERT ON topic BEGIN "
+    f"INSERT INTO topic_fts(rowid, title) VALUES (new.id, {_normalized('new.title')}); END",
+    "CREATE TRIGGER IF NOT EXISTS topic_fts_delete AFTER DELETE ON topic BEGIN "
+    "INSERT INTO topic_fts(topic_fts, rowid, title) "
+    f"VALUES ('delete', old.id, {_normalized('old.title')}); END",
+    # Смена статуса при резервировании индекс не трогает
+    "CREATE TRIGGER IF NOT EXISTS topic_fts_update AFTER UPDATE OF title ON topic BEGIN "
+    "INSERT INTO topic_fts(topic_fts, rowid, title) "
+    f"VALUES ('delete', old.id, {_normalized('old.title')}); "
+    f"INSERT INTO topic_fts(rowid, title) VALUES (new.id, {_normalized('new.title')}); END"
+]
+
+_fts_enabled = WeakKeyDictionary()
+
+
+def fts_supported(connection):
+    if connection.dialect.name != 'sqlite':
+        return False
+    options = connection.exec_driver_sql('PRAGMA compile_options').scalars().all()
+    return 'ENABLE_FTS5' in options
+
+
+def create_fts_index(connection, rebuild=False):
+    """Создает индекс и триггеры, если SQLite собран с FTS5; rebuild=True
+    заново заполняет индекс по существующим темам"""
+    if not fts_supported(connection):
+        return False
+    for statement in FTS_DDL:
+        connection.exec_driver_sql(statement)
+    if rebuild:
+        connection.exec_driver_sql("INSERT INTO topic_fts(topic_fts) VALUES ('delete-all')")
+        connection.exec_driver_sql(
+            f"INSERT INTO topic_fts(rowid, title) SELECT id, {_normalized('title')} FROM topic")
+    _fts_enabled.pop(connection.engine, None)
+    return True
+
+
+@event.listens_for(Topic.__table__, 'after_create')
+def _create_with_topic_table(target, connection, **kwargs):
+    # Новая база получает индекс вместе с таблицей topic
+    create_fts_index(connection)
+
+
+def fts_enabled(connection):
+    """Есть ли в базе индекс topic_fts; результат запоминается для движка"""
+    engine = connection.engine
+    if engine not in _fts_enabled:
+        _fts_enabled[engine] = connection.dialect.name == 'sqlite' and bool(connection.scalar(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'topic_fts'")))
+    return _fts_enabled[engine]
+
+
+def search_terms(query_text):
+    normalized = (query_text or '').lower().replace('ё', 'е')
+    return TOKEN_RE.findall(normalized)[:MAX_TERMS]
+
+
+def match_expression(terms):
+    """Запрос FTS5: все слова, каждое по началу; кавычки отключают синтаксис FTS5"""
+    return ' '.join(f'"{term}"*' if len(term) >= MIN_PREFIX_LENGTH else f'"{term}"'
+                    for term in terms)
+
+
+def apply_search(query, connection, query_text):
+    """Ограничивает запрос тем (ORM Query по Topic) поиском по названию.
+    С FTS5 результаты упорядочиваются по релевантности."""
+    terms = search_terms(query_text)
+    if not terms:
+        return query
+    if fts_enabled(connection):
+        rank = func.bm25(literal_column('topic_fts'))
+        return (query.join(topic_fts, topic_fts.c.rowid == Topic.id)
+                .filter(literal_column('topic_fts').op('MATCH')(match_expression(terms)))
+                .order_by(None).order_by(rank, Topic.id))
+    return query.filter(and_(*[Topic.title.ilike(f'%{term}%') for term in terms]))
+
+
+# === Похожие названия ===
+def normalize_title(title):
+    return ' '.join(TOKEN_RE.findall((title or '').lower().replace('ё', 'е')))
+
+
+def trigrams(normalized):
+    padded = f' {normalized} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(first, second):
+    """Сходство множеств триграмм (коэффициент Жаккара) от 0 до 1"""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+class DuplicateIndex:
+    """Названия тем по руководителям для поиска похожих при загрузке"""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self._titles = {}  # руководитель -> {нормализованное название: (триграммы, название)}
+
+    def known(self, supervisor):
+        return supervisor in self._titles
+
+    def load(self, connection, supervisor_ids):
+        """Загружает названия существующих тем руководителей {имя: id} одним запросом"""
+        names = {supervisor_id: name for name, supervisor_id in supervisor_ids.items()
+                 if supervisor_id is not None}
+        for name in supervisor_ids:
+            self._titles.setdefault(name, {})
+        if not names:
+            return
+        rows = connection.execute(select(Topic.supervisor_id, Topic.title)
+                                  .where(Topic.supervisor_id.in_(names)))
+        for supervisor_id, title in rows:
+            self.add(names[supervisor_id], title)
+
+    def add(self, supervisor, title):
+        normalized = normalize_title(title)
+        self._titles.setdefault(supervisor, {}).setdefault(
+            normalized, (trigrams(normalized), title))
+
+    def find(self, supervisor, title):
+        """Самое похожее название руководителя: (название, сходство) или None.
+        Для совпадающих после нормализации названий сходство равно 1."""
+        titles = self._titles.get(supervisor) or {}
+        normalized = normalize_title(title)
+        if normalized in titles:
+            return titles[normalized][1], 1.0
+        grams = trigrams(normalized)
+        best = None
+        for other_grams, other_title in titles.values():
+            score = similarity(grams, other_grams)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (other_title, score)
+        return best
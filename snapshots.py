@@ -0,0 +1,145 @@
+"""Кэш готовых JSON-ответов списка тем и резерваций старосты.
+
+Каталог тем имеет версию - число, которое растет при каждом изменении
+статуса темы: кэш подписан на брокер событий, а загрузки тем увеличивают
+версию явно (bump). Ответ маршрута сохраняется снимком: сериализованный
+JSON, его gzip-вариант (строится при первом запросе с Accept-Encoding:
+gzip) и ETag - хэш содержимого. Снимок действует, пока версия каталога не
+изменилась и не прошло SNAPSHOT_TTL секунд; TTL ограничивает устаревание,
+если данные меняет другой процесс сервера.
+
+Запрос с If-None-Match, совпадающим с ETag действующего снимка, получает
+304 без обращения к базе. После смены версии снимок строится заново, и
+если содержимое не изменилось, ETag тот же - клиент снова получает 304.
+Кэш хранит не больше SNAPSHOT_CACHE_SIZE снимков: при переполнении сначала
+удаляются снимки старых версий, затем давно не использованные.
+"""
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+
+
+class Snapshot:
+    __slots__ = ('version', 'expires', 'body', 'etag', 'gzipped')
+
+    def __init__(self, version, expires, body):
+        self.version = version
+        self.expires = expires
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.gzipped = None
+
+
+class SnapshotCache:
+    def __init__(self, app, events=None):
+        self.size = app.config['SNAPSHOT_CACHE_SIZE']
+        self.ttl = app.config['SNAPSHOT_TTL']
+        self.gzip_min_size = app.config['SNAPSHOT_GZIP_MIN_SIZE']
+        self.version = 0
+        self._snapshots = OrderedDict()  # ключ -> Snapshot
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.stale = 0
+        self.evictions = 0
+        if events is not None:
+            events.add_listener(lambda event: self.bump())
+
+    def bump(self):
+        """Новая версия каталога: все снимки становятся устаревшими"""
+        with self._lock:
+            self.version += 1
+            return self.version
+
+    def _lookup(self, key):
+        now = time.monotonic()
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and (snapshot.version != self.version
+                                         or snapshot.expires <= now):
+                del self._snapshots[key]
+                self.stale += 1
+                snapshot = None
+            if snapshot is not None:
+                self._snapshots.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return snapshot, self.version
+
+    def _store(self, key, snapshot):
+        with self._lock:
+            if snapshot.version != self.version:
+                # Каталог изменился, пока строился ответ: такой снимок не сохраняем
+                return
+            self._snapshots[key] = snapshot
+            self._snapshots.move_to_end(key)
+            if len(self._snapshots) > self.size:
+                for old_key in [old_key for old_key, old in self._snapshots.items()
+                                if old.version != self.version]:
+                    del self._snapshots[old_key]
+                    self.evictions += 1
+            while len(self._snapshots) > self.size:
+                self._snapshots.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key, build):
+        """Действующий снимок key; build() возвращает данные ответа при промахе"""
+        snapshot, version = self._lookup(key)
+        if snapshot is None:
+            # Версия берется до чтения базы: изменение во время построения
+            # сделает снимок устаревшим, а не спрячет новые данные
+            body = json.dumps(build(), ensure_ascii=False, separators=(',', ':')).encode()
+            snapshot = Snapshot(version, time.monotonic() + self.ttl, body)
+            self._store(key, snapshot)
+        return snapshot
+
+    def respond(self, key, build):
+        """Ответ маршрута по снимку: 304 при совпадении If-None-Match,
+        gzip - если клиент его принимает и ответ достаточно велик"""
+        snapshot = self.get(key, build)
+        compress = (len(snapshot.body) >= self.gzip_min_size
+                    and 'gzip' in request.accept_encodings)
+        # У сжатого варианта свой ETag: это другое представление ответа
+        etag = snapshot.etag + '-gz' if compress else snapshot.etag
+
+        response = current_app.response_class(mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Accept-Encoding')
+        if request.if_none_match.contains_weak(etag):
+            with self._lock:
+                self.not_modified += 1
+            response.status_code = 304
+            return response
+
+        if compress:
+            if snapshot.gzipped is None:
+                snapshot.gzipped = gzip.compress(snapshot.body, compresslevel=6)
+            response.set_data(snapshot.gzipped)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response.set_data(snapshot.body)
+        return response
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self.version,
+                'size': len(self._snapshots),
+                'max_size': self.size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'not_modified': self.not_modified,
+                'stale': self.stale,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,113 @@
+"""Потоковое чтение загружаемых Excel/CSV файлов пачками строк"""
+import csv
+import io
+import os
+
+from openpyxl import load_workbook
+
+
+class SpreadsheetError(ValueError):
+    """Файл не подходит для загрузки (нет нужных колонок, пустой файл)"""
+
+
+def _normalize_header(header):
+    return [str(cell).strip() if cell is not None else '' for cell in header]
+
+
+def _check_header(header, required_columns):
+    missing = [column for column in required_columns if column not in header]
+    if missing:
+        raise SpreadsheetError(f'В файле нет колонок: {", ".join(missing)}')
+
+
+def _iter_xlsx_rows(file):
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield row
+    finally:
+        workbook.close()
+
+
+def _iter_csv_rows(file):
+    # Декодируем поток построчно, не читая файл целиком
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        for row in csv.reader(text):
+            yield row
+    finally:
+        text.detach()
+
+
+def check_format(filename):
+    """Проверяет расширение файла: читаются только CSV и XLSX"""
+    extension = os.path.splitext(filename.lower())[1]
+    if extension == '.xls':
+        raise SpreadsheetError('Формат .xls не поддерживается: сохраните файл как .xlsx или .csv')
+    if extension not in ('.csv', '.xlsx'):
+        raise SpreadsheetError('Поддерживаются файлы .xlsx и .csv')
+
+
+def open_rows(file, filename, required_columns):
+    """Открывает файл и проверяет заголовок.
+
+    Возвращает итератор пар (номер строки, словарь значений). Заголовок
+    проверяется сразу, до того как прочитана хотя бы одна строка данных.
+    """
+    check_format(filename)
+    if filename.lower().endswith('.csv'):
+        rows = _iter_csv_rows(file)
+    else:
+        rows = _iter_xlsx_rows(file)
+
+    try:
+        header = _normalize_header(next(rows))
+        _check_header(header, required_columns)
+    except StopIteration:
+        rows.close()
+        raise SpreadsheetError('Файл пуст')
+    except SpreadsheetError:
+        # Закрываем чтение, пока файл еще открыт
+        rows.close()
+        raise
+
+    def generate():
+        # Строка 1 в файле - заголовок, данные начинаются со строки 2
+        for line, values in enumerate(rows, start=2):
+            if not any(value not in (None, '') for value in values):
+                continue
+            yield line, dict(zip(header, values))
+
+    return generate()
+
+
+def iter_batches(rows, batch_size):
+    """Группирует строки в списки фиксированного размера"""
+    batch = []
+    for item in rows:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def estimate_rows(path, filename):
+    """Примерное число строк данных для оценки хода загрузки: в CSV - по
+    числу переводов строки, в Excel - по размеру листа из его описания"""
+    check_format(filename)
+    if filename.lower().endswith('.csv'):
+        with open(path, 'rb') as file:
+            lines = sum(chunk.count(b'\n') for chunk in iter(lambda: file.read(1 << 20), b''))
+        return max(lines - 1, 0)
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return max((workbook.active.max_row or 1) - 1, 0)
+    finally:
+        workbook.close()
+
+
+def read_batches(file, filename, required_columns, batch_size):
+    """Итератор пачек строк файла; заголовок проверяется при вызове"""
+    return iter_batches(open_rows(file, filename, required_columns), batch_size)
@@ -0,0 +1,220 @@
+"""Сводные счетчики распределения тем.
+
+Таблица summary_counter хранит готовые числа для панели администратора:
+темы по типам работ и статусам, нагрузку руководителей и охват групп
+(сколько студентов группы уже получили тему). Маршрут статистики читает
+только эту таблицу, и его время не зависит от числа тем и студентов.
+
+Счетчики меняются в той же транзакции, что и данные: резервирование,
+отмена, назначение и снятие просроченных резерваций прибавляют разницу
+(apply), загрузки и синхронизация - разницу по вставленным и удаленным
+строкам, а массовое распределение пересчитывает счетчики GROUP BY перед
+фиксацией. Статус темы учитывается сохраненный: просроченная, но еще не
+снятая резервация считается зарезервированной до очистки.
+
+Периодическая сверка (reconcile) пересчитывает все счетчики по данным,
+исправляет расхождения и сообщает о них: расхождение означает путь
+изменения данных, который не обновляет счетчики.
+"""
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Group, Student, Supervisor, SummaryCounter, Topic, WorkType
+
+WORK_TYPE = 'work_type'  # free, reserved, assigned - темы типа работы по статусам
+SUPERVISOR = 'supervisor'  # topics, assigned - все и назначенные темы руководителя
+GROUP = 'group'  # students, assigned - студенты группы и студенты с темой
+META = 'meta'  # reconciled_at, drift - время и результат последней сверки
+
+STATUSES = ('free', 'reserved', 'assigned')
+MAX_REPORTED_DRIFT = 100
+
+_DIALECT_INSERT = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+# === Изменения счетчиков ===
+# Разница - Counter {(раздел, id, счетчик): приращение}. Приращения бывают
+# отрицательными, поэтому разницы складываются методом update, а не "+".
+def topic_moved(work_type_id, supervisor_id, old, new, count=1):
+    """Разница для count тем, перешедших из статуса old в new"""
+    deltas = Counter()
+    if old == new:
+        return deltas
+    deltas[(WORK_TYPE, work_type_id, old)] -= count
+    deltas[(WORK_TYPE, work_type_id, new)] += count
+    if 'assigned' in (old, new):
+        deltas[(SUPERVISOR, supervisor_id, 'assigned')] += count if new == 'assigned' else -count
+    return deltas
+
+
+def topics_added(topics, sign=1):
+    """Разница для свободных тем, заданных парами (id типа работы, id руководителя);
+    sign=-1 - для удаленных"""
+    deltas = Counter()
+    for (work_type_id, supervisor_id), count in Counter(topics).items():
+        deltas[(WORK_TYPE, work_type_id, 'free')] += sign * count
+        deltas[(SUPERVISOR, supervisor_id, 'topics')] += sign * count
+    return deltas
+
+
+def students_added(group_ids, sign=1):
+    """Разница для студентов без темы в группах group_ids (по одному id на студента)"""
+    return Counter({(GROUP, group_id, 'students'): sign * count
+                    for group_id, count in Counter(group_ids).items()})
+
+
+def student_assigned(group_id):
+    return Counter({(GROUP, group_id, 'assigned'): 1})
+
+
+def _upsert(connection, rows, increment):
+    if not rows:
+        return
+    table = SummaryCounter.__table__
+    statement = _DIALECT_INSERT[connection.dialect.name](table)
+    value = table.c.value + statement.excluded.value if increment else statement.excluded.value
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.scope, table.c.key, table.c.metric], set_={'value': value}),
+        rows)
+
+
+def apply(connection, deltas):
+    """Прибавляет разницу к счетчикам в текущей транзакции connection"""
+    # Строки всегда обновляются в одном порядке, чтобы параллельные
+    # транзакции PostgreSQL не ждали друг друга по кругу
+    _upsert(connection, [{'scope': scope, 'key': key, 'metric': metric, 'value': value}
+                         for (scope, key, metric), value in sorted(deltas.items()) if value],
+            increment=True)
+
+
+# === Пересчет и сверка ===
+def compute(connection):
+    """Значения всех счетчиков по данным: три запроса GROUP BY"""
+    actual = Counter()
+    status = func.coalesce(Topic.status, 'free')
+    for work_type_id, topic_status, count in connection.execute(
+            select(Topic.work_type_id, status, func.count())
+            .group_by(Topic.work_type_id, status)):
+        actual[(WORK_TYPE, work_type_id, topic_status)] = count
+    for supervisor_id, count, assigned in connection.execute(
+            select(Topic.supervisor_id, func.count(),
+                   func.count(case((Topic.status == 'assigned', 1))))
+            .group_by(Topic.supervisor_id)):
+        actual[(SUPERVISOR, supervisor_id, 'topics')] = count
+        actual[(SUPERVISOR, supervisor_id, 'assigned')] = assigned
+    for group_id, count, assigned in connection.execute(
+            select(Student.group_id, func.count(), func.count(Student.topic_id))
+            .group_by(Student.group_id)):
+        actual[(GROUP, group_id, 'students')] = count
+        actual[(GROUP, group_id, 'assigned')] = assigned
+    return actual
+
+
+def _lock(connection):
+    if connection.dialect.name == 'postgresql':
+        # Приращения других транзакций ждут окончания пересчета, а не теряются
+        connection.exec_driver_sql('LOCK TABLE summary_counter IN EXCLUSIVE MODE')
+
+
+def _set_meta(connection, metric, value):
+    _upsert(connection, [{'scope': META, 'key': 0, 'metric': metric, 'value': value}],
+            increment=False)
+
+
+def recompute(connection):
+    """Записывает пересчитанные значения в текущей транзакции connection.
+    Возвращает измененные счетчики [(раздел, id, счетчик, было, стало)]."""
+    _lock(connection)
+    actual = compute(connection)
+    table = SummaryCounter.__table__
+    stored = {(scope, key, metric): value for scope, key, metric, value in connection.execute(
+        select(table.c.scope, table.c.key, table.c.metric, table.c.value)
+        .where(table.c.scope != META))}
+
+    changed = [(*counter, stored.get(counter, 0), actual.get(counter, 0))
+               for counter in sorted(set(stored) | set(actual))
+               if stored.get(counter, 0) != actual.get(counter, 0)]
+    _upsert(connection, [{'scope': scope, 'key': key, 'metric': metric, 'value': value}
+                         for scope, key, metric, _, value in changed], increment=False)
+    # Счетчики удаленных групп, руководителей и типов работ
+    for scope, key, metric in set(stored) - set(actual):
+        connection.execute(delete(table).where(table.c.scope == scope, table.c.key == key,
+                                               table.c.metric == metric))
+    return changed
+
+
+def reconcile():
+    """Сверка счетчиков с данными одной транзакцией; возвращает отчет
+    с расхождениями, которые были исправлены"""
+    started = time.perf_counter()
+    try:
+        connection = db.session.connection()
+        # Первой идет запись: в SQLite транзакция сразу получает блокировку
+        # записи, и пересчет не пропустит изменений других транзакций
+        _set_meta(connection, 'reconciled_at', int(time.time()))
+        drift = recompute(connection)
+        _set_meta(connection, 'drift', len(drift))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if drift:
+        print(f"❌ Счетчики статистики расходились с данными: {len(drift)}")
+    return {
+        'drifted': len(drift),
+        'drift': [{'scope': scope, 'key': key, 'metric': metric, 'stored': stored,
+                   'actual': actual}
+                  for scope, key, metric, stored, actual in drift[:MAX_REPORTED_DRIFT]],
+        'elapsed': round(time.perf_counter() - started, 3)
+    }
+
+
+# === Чтение ===
+def summary():
+    """Статистика для панели администратора из таблицы счетчиков"""
+    counters = {}
+    for scope, key, metric, value in db.session.execute(
+            select(SummaryCounter.scope, SummaryCounter.key, SummaryCounter.metric,
+                   SummaryCounter.value)):
+        counters.setdefault(scope, {}).setdefault(key, {})[metric] = value
+    meta = counters.get(META, {}).get(0, {})
+
+    work_types = []
+    for work_type_id, name, subject in db.session.execute(
+            select(WorkType.id, WorkType.name, WorkType.subject).order_by(WorkType.id)):
+        values = counters.get(WORK_TYPE, {}).get(work_type_id, {})
+        work_types.append({'id': work_type_id, 'name': name, 'subject': subject,
+                           **{status: values.get(status, 0) for status in STATUSES}})
+
+    supervisors = []
+    for supervisor_id, full_name in db.session.execute(
+            select(Supervisor.id, Supervisor.full_name).order_by(Supervisor.full_name)):
+        values = counters.get(SUPERVISOR, {}).get(supervisor_id, {})
+        supervisors.append({'id': supervisor_id, 'full_name': full_name,
+                            'topics': values.get('topics', 0),
+                            'assigned': values.get('assigned', 0)})
+
+    groups = []
+    for group_id, name in db.session.execute(select(Group.id, Group.name).order_by(Group.name)):
+        values = counters.get(GROUP, {}).get(group_id, {})
+        students, assigned = values.get('students', 0), values.get('assigned', 0)
+        groups.append({'id': group_id, 'name': name, 'students': students,
+                       'assigned': assigned,
+                       'coverage': round(assigned / students * 100, 1) if students else None})
+
+    reconciled_at = meta.get('reconciled_at')
+    return {
+        'topics': {status: sum(item[status] for item in work_types) for status in STATUSES},
+        'students': {'total': sum(item['students'] for item in groups),
+                     'assigned': sum(item['assigned'] for item in groups)},
+        'work_types': work_types,
+        'supervisors': supervisors,
+        'groups': groups,
+        'reconciled_at': (datetime.utcfromtimestamp(reconciled_at).isoformat()
+                          if reconciled_at else None),
+        'drift': meta.get('drift')
+    }
@@ -0,0 +1,325 @@
+"""Синхронизация повторно загруженных списков студентов и тем.
+
+Вместо добавления всех строк файла заново строки сопоставляются с базой
+по ключу: студент - (ФИО, группа), тема - (название, руководитель, тип
+работы, предмет). Остальные колонки сравниваются со значениями в базе, и
+строки делятся на новые, измененные, неизменные и отсутствующие в файле.
+В базу пишется только разница пакетными INSERT, UPDATE и DELETE (вместе с
+ней - изменения счетчиков stats): запись для файла с 1% изменений занимает
+около 1% записи полной загрузки, а чтение файла и сравнение с базой
+выполняются в памяти одним проходом.
+
+Без apply база не меняется, отчет содержит число строк каждого вида и
+примеры. Отсутствующие в файле строки удаляются только с delete_missing и
+только в группах (у руководителей), которые есть в файле; студенты с
+темой или учетной записью и зарезервированные или назначенные темы не
+удаляются. Лишние копии одной строки, оставшиеся от повторных загрузок,
+считаются отсутствующими в файле.
+"""
+import time
+
+from sqlalchemy import bindparam, delete, insert, select, update
+
+from importers import (ImportReport, IN_CLAUSE_LIMIT, TOPIC_COLUMNS, chunked, clean_value,
+                       fetch_group_ids, fetch_supervisor_ids, fetch_work_type_ids)
+import stats
+from models import db, Group, Student, Supervisor, Topic, TopicPreference, User, WorkType
+
+SAMPLE_SIZE = 20
+WRITE_BATCH_SIZE = 5000
+
+
+def _select_ids(column, ids, *conditions):
+    result = set()
+    for part in chunked(ids, IN_CLAUSE_LIMIT):
+        result.update(db.session.scalars(select(column).where(column.in_(part), *conditions)))
+    return result
+
+
+def _execute_batches(statement, params, progress=None):
+    for batch in chunked(params, WRITE_BATCH_SIZE):
+        db.session.execute(statement, batch)
+        if progress:
+            progress()
+
+
+def _delete_ids(model, ids, *conditions, returning, progress=None):
+    """Удаляет строки по id, возвращает значения колонок returning удаленных строк"""
+    deleted = []
+    for part in chunked(ids, IN_CLAUSE_LIMIT):
+        deleted.extend(db.session.execute(
+            delete(model).where(model.id.in_(part), *conditions).returning(*returning)))
+        if progress:
+            progress()
+    return deleted
+
+
+def _finish(report, started, timings, diff, samples, apply, delete_missing, deleted=0, **extra):
+    timings['total'] = time.perf_counter() - started
+    applied = {
+        'inserted': diff['new'] if apply else 0,
+        'updated': diff['changed'] if apply else 0,
+        'deleted': deleted
+    }
+    report.inserted = applied['inserted']
+    return report.as_dict(
+        applied=apply,
+        delete_missing=delete_missing,
+        samples=samples,
+        timings={phase: round(value, 3) for phase, value in timings.items()},
+        **diff, **applied, **extra)
+
+
+def sync_students(batches, apply=False, delete_missing=False, progress=None):
+    """Синхронизирует студентов с файлом; ключ - (ФИО, группа), содержимое - телефон"""
+    report = ImportReport()
+    started = time.perf_counter()
+    timings = {}
+    checkpoint = (lambda: progress(report.rows)) if progress else None
+
+    incoming = {}  # (ФИО, группа) -> (телефон, ЦМК)
+    for batch in batches:
+        for line, row in batch:
+            report.rows += 1
+            full_name = clean_value(row.get('full_name'))
+            group_name = clean_value(row.get('group'))
+            if not full_name:
+                report.error(line, 'Не указано ФИО')
+                continue
+            if not group_name:
+                report.error(line, 'Не указана группа')
+                continue
+            if (full_name, group_name) in incoming:
+                report.error(line, 'Студент уже указан в файле выше')
+                continue
+            incoming[(full_name, group_name)] = (clean_value(row.get('phone')) or '',
+                                                 clean_value(row.get('cmk')) or 'Общая')
+        if checkpoint:
+            checkpoint()
+    timings['read'] = time.perf_counter() - started
+
+    phase = time.perf_counter()
+    group_ids = fetch_group_ids({group_name for _, group_name in incoming})
+    existing = {}  # ключ -> (id, телефон)
+    missing = []  # (id, ключ) студентов групп файла, которых нет в файле
+    # Чтение через соединение без ORM: строки сразу превращаются в кортежи
+    connection = db.session.connection()
+    for part in chunked(list(group_ids.values()), IN_CLAUSE_LIMIT):
+        rows = connection.execute(
+            select(Student.id, Student.full_name, Group.name, Student.phone)
+            .join(Group, Group.id == Student.group_id)
+            .where(Student.group_id.in_(part))
+            .order_by(Student.id))
+        for student_id, full_name, group_name, phone in rows:
+            key = (full_name, group_name)
+            if key in existing or key not in incoming:
+                missing.append((student_id, key))
+            else:
+                existing[key] = (student_id, phone or '')
+
+    new, changed, unchanged = [], [], 0
+    for key, (phone, cmk) in incoming.items():
+        current = existing.get(key)
+        if current is None:
+            new.append(key)
+        elif current[1] != phone:
+            changed.append((current[0], key, current[1], phone))
+        else:
+            unchanged += 1
+
+    # Студента с темой или учетной записью не удаляем
+    missing_ids = [student_id for student_id, _ in missing]
+    protected = _select_ids(Student.id, missing_ids, Student.topic_id.isnot(None))
+    protected |= _select_ids(User.student_id, missing_ids)
+    # Старые назначения записаны только в topic.student_id
+    protected |= _select_ids(Topic.student_id, missing_ids)
+    timings['diff'] = time.perf_counter() - phase
+
+    diff = {'new': len(new), 'changed': len(changed), 'unchanged': unchanged,
+            'missing': len(missing), 'protected': len(protected)}
+    samples = {
+        'new': [{'full_name': key[0], 'group': key[1], 'phone': incoming[key][0]}
+                for key in new[:SAMPLE_SIZE]],
+        'changed': [{'full_name': key[0], 'group': key[1], 'old': old, 'new': phone}
+                    for _, key, old, phone in changed[:SAMPLE_SIZE]],
+        'missing': [{'full_name': key[0], 'group': key[1], 'protected': student_id in protected}
+                    for student_id, key in missing[:SAMPLE_SIZE]]
+    }
+    if not apply:
+        return _finish(report, started, timings, diff, samples, apply, delete_missing)
+
+    phase = time.perf_counter()
+    deleted = []
+    try:
+        new_groups = {}
+        for full_name, group_name in new:
+            if group_name not in group_ids:
+                new_groups.setdefault(group_name, incoming[(full_name, group_name)][1])
+        if new_groups:
+            db.session.execute(insert(Group), [{'name': name, 'cmk': cmk}
+                                               for name, cmk in new_groups.items()])
+            group_ids.update(fetch_group_ids(new_groups))
+
+        _execute_batches(insert(Student), [
+            {'full_name': full_name, 'phone': incoming[(full_name, group_name)][0],
+             'group_id': group_ids[group_name]}
+            for full_name, group_name in new], checkpoint)
+        deltas = stats.students_added(group_ids[group_name] for _, group_name in new)
+        table = Student.__table__
+        _execute_batches(
+            update(table).where(table.c.id == bindparam('b_id')).values(phone=bindparam('b_phone')),
+            [{'b_id': student_id, 'b_phone': phone} for student_id, _, _, phone in changed],
+            checkpoint)
+        if delete_missing:
+            removable = [student_id for student_id in missing_ids if student_id not in protected]
+            for part in chunked(removable, IN_CLAUSE_LIMIT):
+                db.session.execute(delete(TopicPreference)
+                                   .where(TopicPreference.student_id.in_(part)))
+            # Студент мог получить тему после сравнения - такой не удаляется
+            deleted = _delete_ids(Student, removable, Student.topic_id.is_(None),
+                                  ~select(User.id).where(User.student_id == Student.id).exists(),
+                                  ~select(Topic.id).where(Topic.student_id == Student.id).exists(),
+                                  returning=[Student.group_id], progress=checkpoint)
+            deltas.update(stats.students_added((group_id for group_id, in deleted), sign=-1))
+        stats.apply(db.session.connection(), deltas)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    timings['write'] = time.perf_counter() - phase
+
+    return _finish(report, started, timings, diff, samples, apply, delete_missing,
+                   deleted=len(deleted), groups_created=len(new_groups))
+
+
+def sync_topics(batches, apply=False, delete_missing=False, progress=None):
+    """Синхронизирует каталог тем с файлом; ключ - (название, руководитель,
+    тип работы, предмет). У темы нет других колонок, поэтому измененными
+    считаются только руководители с другим списком предметов (subjects)."""
+    report = ImportReport()
+    started = time.perf_counter()
+    timings = {}
+    checkpoint = (lambda: progress(report.rows)) if progress else None
+
+    incoming = set()
+    subjects = {}  # руководитель -> список предметов из файла
+    for batch in batches:
+        for line, row in batch:
+            report.rows += 1
+            values = {column: clean_value(row.get(column)) for column in TOPIC_COLUMNS}
+            empty = [column for column, value in values.items() if not value]
+            if empty:
+                report.error(line, f'Пустые колонки: {", ".join(empty)}')
+                continue
+            key = (values['title'], values['supervisor'], values['work_type'], values['subject'])
+            if key in incoming:
+                report.error(line, 'Тема уже указана в файле выше')
+                continue
+            incoming.add(key)
+            supervisor_subjects = clean_value(row.get('subjects'))
+            if supervisor_subjects:
+                subjects.setdefault(values['supervisor'], supervisor_subjects)
+        if checkpoint:
+            checkpoint()
+    timings['read'] = time.perf_counter() - started
+
+    phase = time.perf_counter()
+    supervisor_ids = fetch_supervisor_ids({key[1] for key in incoming})
+    existing = set()
+    missing = []  # (id, ключ, статус свободна)
+    connection = db.session.connection()
+    for part in chunked(list(supervisor_ids.values()), IN_CLAUSE_LIMIT):
+        rows = connection.execute(
+            select(Topic.id, Topic.title, Supervisor.full_name, WorkType.name, WorkType.subject,
+                   Topic.status, Topic.student_id)
+            .join(Supervisor, Supervisor.id == Topic.supervisor_id)
+            .join(WorkType, WorkType.id == Topic.work_type_id)
+            .where(Topic.supervisor_id.in_(part))
+            .order_by(Topic.id))
+        for topic_id, title, supervisor, work_type, subject, status, student_id in rows:
+            key = (title, supervisor, work_type, subject)
+            if key in existing or key not in incoming:
+                missing.append((topic_id, key, status == 'free' and student_id is None))
+            else:
+                existing.add(key)
+    new = sorted(incoming - existing, key=lambda key: (key[1], key[0]))
+
+    current_subjects = dict(db.session.execute(
+        select(Supervisor.id, Supervisor.subjects)
+        .where(Supervisor.id.in_([supervisor_ids[name] for name in subjects
+                                  if name in supervisor_ids])))
+        .all()) if subjects else {}
+    changed = [(supervisor_ids[name], name, current_subjects.get(supervisor_ids[name]), value)
+               for name, value in sorted(subjects.items())
+               if name in supervisor_ids
+               and (current_subjects.get(supervisor_ids[name]) or '') != value]
+
+    protected = {topic_id for topic_id, _, free in missing if not free}
+    missing_ids = [topic_id for topic_id, _, _ in missing]
+    # Зарезервированная тема со снятой, но еще не очищенной резервацией тоже не удаляется
+    protected |= _select_ids(Topic.id, missing_ids, Topic.reservations.any())
+    timings['diff'] = time.perf_counter() - phase
+
+    diff = {'new': len(new), 'changed': len(changed), 'unchanged': len(existing),
+            'missing': len(missing), 'protected': len(protected)}
+    samples = {
+        'new': [{'title': title, 'supervisor': supervisor, 'work_type': work_type,
+                 'subject': subject} for title, supervisor, work_type, subject in new[:SAMPLE_SIZE]],
+        'changed': [{'supervisor': name, 'old': old, 'new': value}
+                    for _, name, old, value in changed[:SAMPLE_SIZE]],
+        'missing': [{'title': key[0], 'supervisor': key[1], 'protected': topic_id in protected}
+                    for topic_id, key, _ in missing[:SAMPLE_SIZE]]
+    }
+    if not apply:
+        return _finish(report, started, timings, diff, samples, apply, delete_missing)
+
+    phase = time.perf_counter()
+    deleted = []
+    try:
+        missing_supervisors = sorted({key[1] for key in new} - set(supervisor_ids))
+        if missing_supervisors:
+            db.session.execute(insert(Supervisor), [
+                {'full_name': name, 'subjects': subjects.get(name, '')}
+                for name in missing_supervisors])
+            supervisor_ids.update(fetch_supervisor_ids(missing_supervisors))
+        work_type_keys = {(key[2], key[3]) for key in new}
+        work_type_ids = fetch_work_type_ids(work_type_keys)
+        missing_work_types = sorted(work_type_keys - set(work_type_ids))
+        if missing_work_types:
+            db.session.execute(insert(WorkType), [{'name': name, 'subject': subject}
+                                                  for name, subject in missing_work_types])
+            work_type_ids.update(fetch_work_type_ids(missing_work_types))
+
+        _execute_batches(insert(Topic), [
+            {'title': title, 'status': 'free', 'supervisor_id': supervisor_ids[supervisor],
+             'work_type_id': work_type_ids[(work_type, subject)]}
+            for title, supervisor, work_type, subject in new], checkpoint)
+        deltas = stats.topics_added((work_type_ids[(work_type, subject)], supervisor_ids[supervisor])
+                                    for _, supervisor, work_type, subject in new)
+        table = Supervisor.__table__
+        _execute_batches(
+            update(table).where(table.c.id == bindparam('b_id'))
+            .values(subjects=bindparam('b_subjects')),
+            [{'b_id': supervisor_id, 'b_subjects': value}
+             for supervisor_id, _, _, value in changed], checkpoint)
+        if delete_missing:
+            removable = [topic_id for topic_id in missing_ids if topic_id not in protected]
+            for part in chunked(removable, IN_CLAUSE_LIMIT):
+                db.session.execute(delete(TopicPreference)
+                                   .where(TopicPreference.topic_id.in_(part)))
+            # Тема могла стать занятой после сравнения - удаляется только свободная
+            deleted = _delete_ids(Topic, removable, Topic.status == 'free',
+                                  Topic.student_id.is_(None),
+                                  returning=[Topic.work_type_id, Topic.supervisor_id],
+                                  progress=checkpoint)
+            deltas.update(stats.topics_added((tuple(row) for row in deleted), sign=-1))
+        stats.apply(db.session.connection(), deltas)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    timings['write'] = time.perf_counter() - phase
+
+    return _finish(report, started, timings, diff, samples, apply, delete_missing,
+                   deleted=len(deleted), supervisors_created=len(missing_supervisors),
+                   work_types_created=len(missing_work_types))
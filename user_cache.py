@@ -0,0 +1,146 @@
+"""Кэш пользователей для Flask-Login.
+
+load_user вызывается на каждый запрос, а шаблоны и маршруты затем
+обращаются к current_user.group. Кэш хранит колонки пользователя и его
+группы (LRU на USER_CACHE_SIZE записей, каждая живет USER_CACHE_TTL
+секунд) и собирает из них объекты, подключенные к текущей сессии без
+запросов к базе.
+
+Запись сбрасывается при любом изменении пользователя или его группы через
+ORM, а также явно через invalidate(). Измененные id запоминаются при
+flush (события after_update/after_delete), а сбрасываются после фиксации
+транзакции: иначе параллельный запрос между flush и commit снова закэшировал
+бы старую строку. При откате запомненные id отбрасываются.
+TTL ограничивает устаревание, если данные меняются в другом процессе.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import joinedload, make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import db, Group, User
+
+
+def _columns(instance):
+    return {attr.key: getattr(instance, attr.key) for attr in inspect(type(instance)).column_attrs}
+
+
+class UserCache:
+    def __init__(self, app):
+        self.ttl = app.config['USER_CACHE_TTL']
+        self.size = app.config['USER_CACHE_SIZE']
+        self._entries = OrderedDict()  # id пользователя -> (срок, колонки, колонки группы)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        event.listen(User, 'after_update', self._user_changed)
+        event.listen(User, 'after_delete', self._user_changed)
+        event.listen(Group, 'after_update', self._group_changed)
+        event.listen(Group, 'after_delete', self._group_changed)
+        event.listen(db.session, 'after_commit', self._committed)
+        event.listen(db.session, 'after_rollback', self._rolled_back)
+
+    def get(self, user_id):
+        """Пользователь с загруженной группой, подключенный к db.session"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] <= now:
+                del self._entries[user_id]
+                self.expired += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            return self._load(user_id)
+        _, user_columns, group_columns = entry
+        return self._attach(user_columns, group_columns)
+
+    def _load(self, user_id):
+        user = db.session.get(User, user_id, options=[joinedload(User.group)])
+        if user is None:
+            return None
+        group = user.group
+        entry = (time.monotonic() + self.ttl, _columns(user),
+                 _columns(group) if group is not None else None)
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return user
+
+    def _attach(self, user_columns, group_columns):
+        # Объекты собираются как загруженные из базы и присоединяются к
+        # сессии через merge(load=False) - без SELECT
+        user = User(**user_columns)
+        make_transient_to_detached(user)
+        group = None
+        if group_columns is not None:
+            group = Group(**group_columns)
+            make_transient_to_detached(group)
+        set_committed_value(user, 'group', group)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_id=None):
+        """Сбрасывает запись пользователя или, без аргумента, весь кэш"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+            self.invalidations += 1
+
+    def invalidate_group(self, group_id):
+        with self._lock:
+            for user_id in [user_id for user_id, entry in self._entries.items()
+                            if entry[1]['group_id'] == group_id]:
+                del self._entries[user_id]
+            self.invalidations += 1
+
+    @staticmethod
+    def _pending(session):
+        return session.info.setdefault('user_cache_pending', (set(), set()))
+
+    def _user_changed(self, mapper, connection, target):
+        self._pending(object_session(target))[0].add(target.id)
+
+    def _group_changed(self, mapper, connection, target):
+        self._pending(object_session(target))[1].add(target.id)
+
+    def _committed(self, session):
+        user_ids, group_ids = session.info.pop('user_cache_pending', (set(), set()))
+        for user_id in user_ids:
+            self.invalidate(user_id)
+        for group_id in group_ids:
+            self.invalidate_group(group_id)
+
+    def _rolled_back(self, session):
+        session.info.pop('user_cache_pending', None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }